@@ -0,0 +1,237 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from db import admission_tats, sync_admission_buckets, purge_admission_buckets
+
+Limit = Tuple[float, float]  # (tokens per second, burst); rate 0 = unlimited
+
+def parse_limit(raw: Any) -> Limit | None:
+    """"2:20" or {"rate": 2, "burst": 20} -> (2.0, 20.0)"""
+    try:
+        if isinstance(raw, dict):
+            return float(raw.get("rate", 0)), float(raw.get("burst", 1))
+        rate, _, burst = str(raw).partition(":")
+        return float(rate), float(burst or 1)
+    except (TypeError, ValueError):
+        return None
+
+def parse_plans(raw: str) -> Dict[str, Limit]:
+    """"default=2:20;pro=10:100" -> {plan: (rate, burst)}"""
+    out: Dict[str, Limit] = {}
+    for part in filter(None, (raw or "").split(";")):
+        name, _, spec = part.partition("=")
+        limit = parse_limit(spec)
+        if name.strip() and limit is not None:
+            out[name.strip()] = limit
+    return out
+
+class Shed(Exception):
+    """Request not admitted; retry_after is when a token would be free."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Bucket:
+    __slots__ = ("tokens", "ts", "pending", "limit", "used")
+
+    def __init__(self, limit: Limit, now: float) -> None:
+        self.limit = limit
+        self.tokens = limit[1]
+        self.ts = now
+        self.pending = 0  # consumed here, not yet synced
+        self.used = now   # last admit; idle buckets aren't synced
+
+    def refill(self, now: float) -> None:
+        rate, burst = self.limit
+        self.tokens = min(burst, self.tokens + (now - self.ts) * rate)
+        self.ts = now
+
+    def wait_for_token(self) -> float:
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.limit[0]
+
+class AdmissionControl:
+    """
+    Token buckets per tenant ("c:<client_id>", limit from its plan) and per
+    client IP, in front of /chat only — /config, /widget.js, /health never
+    pass through here.
+
+    A request takes one token from both buckets. If one is short, the
+    request reserves the token and sleeps until it refills, but only if that
+    is within max_wait and fewer than max_waiting requests already sleep;
+    otherwise it is shed at once (Shed, with Retry-After) instead of queueing
+    into a deadline it can't meet.
+
+    Buckets are per process, mirrored in admission_buckets as a GCRA
+    theoretical arrival time. Every sync_interval s a background thread
+    charges this worker's consumption there (one transaction) and resets
+    the local buckets to the shared level, so limits hold across workers
+    within about one interval.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], plans: Dict[str, Limit],
+                 ip_limit: Limit | None, max_wait: float = 2.0, max_waiting: int = 8,
+                 sync_interval: float = 0.5, max_keys: int = 50000) -> None:
+        self._connect = connect
+        self.plans = plans
+        self.ip_limit = ip_limit if ip_limit and ip_limit[0] > 0 else None
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.sync_interval = sync_interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._thread: threading.Thread | None = None
+        self._local = threading.local()
+        self._next_purge = 0.0
+        self.waiting = 0
+        self.admitted = 0
+        self.delayed = 0
+        self.shed: Dict[str, int] = {"tenant": 0, "ip": 0, "queue": 0}
+        self.sync_errors = 0
+
+    def tenant_limit(self, cfg: Dict[str, Any]) -> Limit | None:
+        """Tenant "rate_limit" override, else its plan's limit, else the default plan's."""
+        limit = parse_limit(cfg["rate_limit"]) if cfg.get("rate_limit") else None
+        if limit is None:
+            limit = self.plans.get(str(cfg.get("plan") or "")) or self.plans.get("default")
+        return limit if limit and limit[0] > 0 else None
+
+    def _shared_levels(self, checks: list) -> Dict[str, float]:
+        """
+        Tokens left in the shared buckets for keys this worker hasn't seen yet
+        (one read per new key, so a worker doesn't start every tenant at full burst).
+        """
+        new = [(key, limit) for _reason, key, limit in checks if key not in self._buckets]
+        if not new:
+            return {}
+        try:
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            tats = admission_tats(conn, [key for key, _limit in new])
+        except sqlite3.Error:
+            return {}
+        wall = time.time()
+        return {key: limit[1] - max(0.0, tats[key] - wall) * limit[0] for key, limit in new if key in tats}
+
+    def _bucket_locked(self, key: str, limit: Limit, now: float, level: float | None = None) -> _Bucket:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = _Bucket(limit, now)
+            if level is not None:
+                b.tokens = max(-limit[1], level)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            b.limit = limit
+        b.refill(now)
+        b.used = now
+        return b
+
+    def admit(self, client_id: str, ip: str, cfg: Dict[str, Any]) -> float:
+        """Returns the seconds waited (0 = admitted at once); raises Shed."""
+        self._ensure_sync()
+        now = time.monotonic()
+        checks = []
+        limit = self.tenant_limit(cfg)
+        if limit is not None:
+            checks.append(("tenant", "c:" + client_id, limit))
+        if self.ip_limit is not None and ip:
+            checks.append(("ip", "ip:" + ip, self.ip_limit))
+
+        levels = self._shared_levels(checks)
+        with self._lock:
+            buckets = [(reason, self._bucket_locked(key, limit, now, levels.get(key))) for reason, key, limit in checks]
+            wait = 0.0
+            for reason, b in buckets:
+                w = b.wait_for_token()
+                if w > self.max_wait:
+                    self.shed[reason] += 1
+                    raise Shed(reason, w)
+                wait = max(wait, w)
+            if wait > 0 and self.waiting >= self.max_waiting:
+                self.shed["queue"] += 1
+                raise Shed("queue", wait)
+            for _reason, b in buckets:
+                b.tokens -= 1.0  # may go negative: a reservation
+                b.pending += 1
+            self.admitted += 1
+            if wait > 0:
+                self.delayed += 1
+                self.waiting += 1
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return wait
+
+    # --- cross-worker sync ---
+    def _ensure_sync(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._sync_loop, name="admission-sync", daemon=True)
+                    self._thread.start()
+
+    def _sync_loop(self) -> None:
+        conn = None
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self.sync(conn)
+            except sqlite3.Error:
+                self.sync_errors += 1  # counts stay pending and go out next time
+
+    def sync(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            active = time.monotonic() - 30.0
+            deltas = {k: (b.pending, b.limit[0]) for k, b in self._buckets.items() if b.pending}
+            keys = [k for k, b in self._buckets.items() if b.used >= active]
+            for k in deltas:
+                self._buckets[k].pending = 0
+        if not keys and not deltas:
+            return
+        try:
+            tats = sync_admission_buckets(conn, deltas, keys, time.time())
+        except sqlite3.Error:
+            with self._lock:
+                for k, (n, _rate) in deltas.items():
+                    b = self._buckets.get(k)
+                    if b is not None:
+                        b.pending += n
+            raise
+        wall, now = time.time(), time.monotonic()
+        with self._lock:
+            for k, tat in tats.items():
+                b = self._buckets.get(k)
+                if b is None:
+                    continue
+                rate, burst = b.limit
+                # shared level, minus what was taken here while the sync ran
+                b.tokens = max(-burst, burst - max(0.0, tat - wall) * rate - b.pending)
+                b.ts = now
+        if now >= self._next_purge:
+            self._next_purge = now + 3600
+            purge_admission_buckets(conn, wall - 3600)  # full again long ago: same as no row
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "delayed": self.delayed,
+                "waiting": self.waiting,
+                "shed": dict(self.shed),
+                "keys": len(self._buckets),
+                "sync_errors": self.sync_errors,
+            }
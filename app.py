@@ -3,18 +3,45 @@ import re
 import json
 import time
 import base64
+import hashlib
+import io
+import csv
+import zlib
+import atexit
+import calendar
+import sqlite3
 from urllib.parse import urlparse
-from typing import Any, Dict, List
-import smtplib
-from email.message import EmailMessage
+from typing import Any, Dict, List, Tuple
 import secrets
 from pathlib import Path
-from flask import Flask, request, jsonify, render_template, make_response, g, Response
+import click
+from flask import Flask, request, jsonify, render_template, make_response, g, Response, stream_with_context, url_for
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, APIStatusError
 
-from prompts import load_clients, get_client_id, merge, load_prompt_bundle
-from db import connect, init_db, insert_event, insert_lead, list_leads, stats
+from prompts import load_clients, get_client_id, merge, PromptBundle
+from db import (
+    connect, init_db, insert_event, insert_lead, stats, WriteBehind, ConnectionPool,
+    insert_tenant, update_tenant, list_tenants, import_tenants, tenant_count,
+    rebuild_rollups, rollups_missing, iter_leads, leads_page, LEAD_COLUMNS,
+)
+from tenants import TenantStore
+from delivery import DeliveryWorker, SmtpSender, digest_due
+from streaming import ReplyExtractor, sse
+from concurrency import ModelGate, ModelBusy
+from chatcache import ResponseCache, cache_key
+from snapshots import ConfigSnapshot, SnapshotRegistry
+from assets import AssetRegistry, minify_js
+from sessions import SessionStore, ChatSession
+from compaction import HistoryCompactor, ModelSummarizer, estimate_tokens
+from modelstats import ModelStats
+from routing import ModelRouter, parse_routes
+from breaker import CircuitBreaker, CircuitOpen, GuardedCreate, RetryBudget
+from admission import AdmissionControl, Shed, parse_limit, parse_plans
+from metrics import MetricsRegistry
+from tracing import TraceLog, begin_trace, end_trace, read_traces, span, summarize
+from intents import IntentMatcher, IntentStats
+from bundles import PromptRegistry
 import stripe
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY","")
@@ -44,30 +71,6 @@ def public_config(cfg: dict) -> dict:
         clean.pop(k, None)
     return clean
 
-def load_clients_file() -> dict:
-    return json.loads(CLIENTS_PATH.read_text(encoding="utf-8"))
-
-def write_clients_file_atomic(data: dict) -> None:
-    tmp = CLIENTS_PATH.with_suffix(".json.tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(CLIENTS_PATH)
-
-# lock for safe writes (macOS/Linux)
-try:
-    import fcntl
-except Exception:
-    fcntl = None
-
-def with_clients_lock(fn):
-    lock_path = Path(BASE_DIR) / ".clients.lock"
-    with open(lock_path, "w") as lock_file:
-        if fcntl is not None:
-            try:
-                fcntl.flock(lock_file, fcntl.LOCK_EX)
-            except Exception:
-                pass
-        return fn()
-
 CLIENT_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{2,40}$")
 
 def validate_client_id(raw: str) -> str | None:
@@ -89,6 +92,7 @@ def ensure_prompt_file(client_id: str, brand_name: str, demo_link: str) -> None:
         .replace("{{DEMO_LINK}}", demo_link)
     ).strip() + "\n"
     p.write_text(text, encoding="utf-8")
+    prompt_registry.bump()  # all workers recompile this tenant's bundle
 
 app = Flask(
     __name__,
@@ -97,16 +101,160 @@ app = Flask(
 )
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 60 * 60 * 24 * 7  # 7d
 
+# behind nginx/a load balancer: number of proxies whose X-Forwarded-For to trust (per-IP limits)
+PROXY_COUNT = int(os.getenv("PROXY_COUNT", "0"))
+if PROXY_COUNT > 0:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT, x_proto=PROXY_COUNT)
+
+# fingerprinted static files (/assets/app.<hash>.js); ASSET_RELOAD=1 re-reads changed files (dev)
+assets = AssetRegistry(app.static_folder, auto_reload=os.getenv("ASSET_RELOAD", "0") == "1")
+
+def asset_url(filename: str) -> str:
+    """url_for for static files, pointing at the content-hashed URL when there is one."""
+    url_name = assets.url_name(filename)
+    if url_name is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=url_name)
+
+app.jinja_env.globals["asset_url"] = asset_url
+
 MODEL = os.getenv("OPENAI_MODEL", "gpt-5-mini")
 DEFAULT_DEMO_LINK = os.getenv("DEMO_LINK", "mailto:steve.neuratrade@gmail.com")
 
 DB_PATH = os.getenv("DB_PATH", "neurapilot.sqlite3")
 AUTO_INIT_DB = os.getenv("AUTO_INIT_DB", "1") == "1"
 
+# Prometheus metrics (GET /metrics). Each worker writes its values to METRICS_DIR,
+# the scraped worker merges them; METRICS_DIR="" keeps it per process.
+METRICS_DIR = os.getenv("METRICS_DIR", DB_PATH + ".metrics")
+metrics = MetricsRegistry(METRICS_DIR or None, flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "5")))
+HTTP_SECONDS = metrics.histogram("np_http_request_duration_seconds", "Time to response headers", ("route", "method", "status"))
+TENANT_REQUESTS = metrics.counter("np_tenant_requests_total", "Requests per tenant", ("tenant", "route"))
+CHAT_REPLIES = metrics.counter("np_chat_replies_total", "Chat turns by how they were answered", ("tenant", "outcome"))
+MODEL_SECONDS = metrics.histogram("np_model_call_seconds", "Upstream model call duration", ("model",))
+MODEL_TTFT = metrics.histogram("np_model_ttft_seconds", "Upstream time to first token (streamed calls)", ("model",))
+MODEL_TOKENS = metrics.counter("np_model_tokens_total", "Responses API usage", ("tenant", "model", "kind"))
+DB_SECONDS = metrics.histogram(
+    "np_db_seconds", "Time in request-path DB calls", ("op",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0),
+)
+DELIVERY_SECONDS = metrics.histogram("np_delivery_seconds", "Outbox sends (SMTP, webhook)", ("kind", "ok"))
+atexit.register(metrics.flush)
+
+# Per-request phase timing: a Server-Timing header on every response
+# (SERVER_TIMING=0 hides it from clients) and a JSONL log of slow and sampled
+# requests, summarized by `flask trace-summary`. TRACE_LOG="" turns the log off.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+TRACE_LOG = os.getenv("TRACE_LOG", DB_PATH + ".traces.jsonl")
+trace_log = TraceLog(
+    TRACE_LOG,
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", "2000")),
+    sample=float(os.getenv("TRACE_SAMPLE", "0.01")),
+    max_per_sec=float(os.getenv("TRACE_MAX_PER_SEC", "5")),
+    max_bytes=int(float(os.getenv("TRACE_MAX_MB", "10")) * 1024 * 1024),
+) if TRACE_LOG else None
+
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASS = os.getenv("ADMIN_PASS", "change-me-now")
 
-client = OpenAI(timeout=20.0, max_retries=1)
+client = OpenAI(timeout=20.0, max_retries=0)  # retries: upstream_create's budget
+
+# Circuit breaker around every model call. Trips on UPSTREAM_ERROR_RATE failures
+# or UPSTREAM_SLOW_RATE calls slower than UPSTREAM_SLOW_CALL s (over
+# UPSTREAM_WINDOW s, at least UPSTREAM_MIN_CALLS calls); while open, /chat
+# answers with the degraded reply right away. Retries are capped at
+# UPSTREAM_RETRY_RATIO of calls, shared by all requests of the process.
+upstream_breaker = CircuitBreaker(
+    window=float(os.getenv("UPSTREAM_WINDOW", "30")),
+    min_calls=int(os.getenv("UPSTREAM_MIN_CALLS", "10")),
+    error_rate=float(os.getenv("UPSTREAM_ERROR_RATE", "0.5")),
+    slow_call=float(os.getenv("UPSTREAM_SLOW_CALL", "12")),
+    slow_rate=float(os.getenv("UPSTREAM_SLOW_RATE", "0.8")),
+    open_for=float(os.getenv("UPSTREAM_OPEN_SECONDS", "15")),
+    probe_timeout=float(os.getenv("UPSTREAM_PROBE_TIMEOUT", "30")),
+)
+retry_budget = RetryBudget(float(os.getenv("UPSTREAM_RETRY_RATIO", "0.1")))
+upstream_create = GuardedCreate(client.responses.create, upstream_breaker, retry_budget)
+
+# Server-side chat history: clients send the session id + new message only.
+# CHAT_SESSION_CHAIN=1 also chains turns via previous_response_id.
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(7 * 86400)))
+CHAT_SESSION_CHAIN = os.getenv("CHAT_SESSION_CHAIN", "0") == "1"
+
+# Token budget per model call (instructions + summary + history + message).
+# Older turns are folded into a rolling summary instead of dropped; 0 = off.
+# CHAT_SUMMARY_MODEL rewrites that summary in the background (e.g. a mini/nano model).
+CHAT_INPUT_TOKEN_BUDGET = int(os.getenv("CHAT_INPUT_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "")
+summarizer = (
+    ModelSummarizer(upstream_create, lambda: connect(DB_PATH), CHAT_SUMMARY_MODEL)
+    if CHAT_SUMMARY_MODEL and CHAT_INPUT_TOKEN_BUDGET > 0 else None
+)
+if summarizer is not None:
+    atexit.register(summarizer.stop)
+# "stable": shared instructions first, byte-identical for all tenants (prompt
+# cache friendly), tenant details last. "legacy": the old per-tenant layout.
+# Opt-in: the shared modules are still below the provider's 1024-token cache minimum.
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "legacy")
+model_stats = ModelStats()
+
+# Ordered model lists per plan, e.g. "default=gpt-5-mini,gpt-5-nano;pro=gpt-5,gpt-5-mini"
+# (a tenant's own "models" list wins). With 2+ models, a call that has no first
+# token after the primary's p(MODEL_HEDGE_QUANTILE) TTFT is hedged to the next.
+model_router = ModelRouter(
+    upstream_create,
+    parse_routes(os.getenv("MODEL_ROUTES", "")),
+    MODEL,
+    hedge=os.getenv("MODEL_HEDGE", "1") == "1",
+    quantile=float(os.getenv("MODEL_HEDGE_QUANTILE", "0.95")),
+    min_delay=float(os.getenv("MODEL_HEDGE_MIN_DELAY", "0.25")),
+    max_delay=float(os.getenv("MODEL_HEDGE_MAX_DELAY", "6.0")),
+    max_hedge_ratio=float(os.getenv("MODEL_HEDGE_MAX_RATIO", "0.1")),
+)
+
+# compiled prompt bundles, LRU; dropped on prompt file changes (inotify or
+# mtime sweep) and on prompt_meta version bumps (POST /admin/reload-prompts)
+prompt_registry = PromptRegistry(
+    PROMPTS_DIR,
+    lambda: connect(DB_PATH),
+    max_entries=int(os.getenv("PROMPT_CACHE_SIZE", "2048")),
+    scan_interval=float(os.getenv("PROMPT_POLL_INTERVAL", "5")),
+)
+
+chat_sessions = SessionStore(
+    ttl=CHAT_SESSION_TTL,
+    compactor=HistoryCompactor(CHAT_INPUT_TOKEN_BUDGET, summarizer=summarizer) if CHAT_INPUT_TOKEN_BUDGET > 0 else None,
+)
+
+# max concurrent model calls per process; up to MODEL_MAX_QUEUE more wait MODEL_QUEUE_TIMEOUT s, the rest get a 503.
+# gunicorn.conf.py sets both from its thread budget; these fallbacks only apply to other launchers.
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "64"))
+MODEL_MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", "0"))
+MODEL_QUEUE_TIMEOUT = float(os.getenv("MODEL_QUEUE_TIMEOUT", "2.0"))
+model_gate = ModelGate(MODEL_MAX_CONCURRENCY, MODEL_QUEUE_TIMEOUT, MODEL_MAX_QUEUE)
+
+# /chat admission: token buckets per tenant (rate:burst per plan, or the tenant's
+# "rate_limit") and per client IP, shared across workers via admission_buckets.
+# Requests that would wait longer than ADMISSION_MAX_WAIT s are shed with 429.
+# The per-IP bucket defaults to off without PROXY_COUNT: behind a proxy every
+# visitor would share its remote_addr and the whole site one IP's limit.
+admission = AdmissionControl(
+    lambda: connect(DB_PATH),
+    parse_plans(os.getenv("ADMISSION_PLANS", "default=5:50;starter=2:20;growth=5:50;pro=20:200")),
+    parse_limit(os.getenv("ADMISSION_IP_LIMIT", "0.5:10" if PROXY_COUNT > 0 else "off")),
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT", "2.0")),
+    max_waiting=int(os.getenv("ADMISSION_MAX_WAITING", "8")),
+) if os.getenv("ADMISSION", "1") == "1" else None
+
+# reply cache, only used for tenants with "chat_cache": true
+chat_cache = ResponseCache(
+    max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2000")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL", "600")),
+)
+
+# answered-locally vs. model counters for tenants with "fast_path": true
+intent_stats = IntentStats()
 
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 import secrets
@@ -122,50 +270,6 @@ SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
 LEAD_EMAIL_FALLBACK = os.getenv("LEAD_EMAIL_FALLBACK", "")
 LEAD_EMAIL_SUBJECT = os.getenv("LEAD_EMAIL_SUBJECT", "[NeuraPilot] Neuer Lead: {client_id}")
 
-def send_lead_email(to_addr: str, subject: str, body: str) -> None:
-    if not (SMTP_HOST and SMTP_FROM and to_addr):
-        return
-    try:
-        msg = EmailMessage()
-        msg["From"] = SMTP_FROM
-        msg["To"] = to_addr
-        msg["Subject"] = subject
-        msg.set_content(body)
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=6) as s:
-            s.starttls()
-            if SMTP_USER and SMTP_PASS:
-                s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
-    except Exception:
-        # niemals Lead speichern blockieren
-        return
-
-try:
-    import fcntl  # macOS/Linux
-except Exception:
-    fcntl = None
-
-def load_clients_file() -> dict:
-    return json.loads(CLIENTS_PATH.read_text(encoding="utf-8"))
-
-def write_clients_file_atomic(data: dict) -> None:
-    tmp = CLIENTS_PATH.with_suffix(".json.tmp")
-    txt = json.dumps(data, ensure_ascii=False, indent=2)
-    tmp.write_text(txt, encoding="utf-8")
-    tmp.replace(CLIENTS_PATH)
-
-def with_clients_lock(fn):
-    lock_path = Path(BASE_DIR) / ".clients.lock"
-    with open(lock_path, "w") as lock_file:
-        if fcntl is not None:
-            try:
-                fcntl.flock(lock_file, fcntl.LOCK_EX)
-            except Exception:
-                pass
-        return fn()
-
-
 # ---------- DB init: safe across multiple gunicorn workers ----------
 try:
     import fcntl  # macOS/Linux
@@ -185,21 +289,138 @@ def init_db_once() -> None:
         tmp = connect(DB_PATH)
         try:
             init_db(tmp)
+            # first start after the move from clients.json: seed the tenants table once
+            if tenant_count(tmp) == 0 and CLIENTS_PATH.exists():
+                import_tenants(tmp, load_clients())
+            # DB from before daily_rollup: backfill the dashboard counts once
+            if rollups_missing(tmp):
+                rebuild_rollups(tmp)
         finally:
             tmp.close()
 
 init_db_once()
 
-def get_db():
-    if "db" not in g:
-        g.db = connect(DB_PATH)
-    return g.db
+tenant_store = TenantStore(
+    lambda: connect(DB_PATH, readonly=True),
+    poll_interval=float(os.getenv("TENANT_POLL_INTERVAL", "1.0")),
+)
+
+# optional write-behind for event rows (one commit per batch instead of per row);
+# leads stay strictly synchronous unless LEAD_WRITE_MODE=behind
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+LEAD_WRITE_MODE = os.getenv("LEAD_WRITE_MODE", "sync")
+write_behind = WriteBehind(
+    lambda: connect(DB_PATH),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_MS", "50")) / 1000.0,
+    max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500")),
+    max_queue=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000")),
+    observe=lambda seconds: DB_SECONDS.observe(seconds, "write_behind_batch"),
+    spill_path=DB_PATH + ".leads-pending.jsonl",
+)
+atexit.register(write_behind.stop)
+
+def record_event(client_id: str, event: str) -> None:
+    if WRITE_BEHIND:
+        write_behind.add_event(client_id, event)
+    else:
+        with DB_SECONDS.time("insert_event"):
+            insert_event(get_db(), client_id, event)
+
+# lead notifications go through the outbox table; this thread (or `flask deliver-outbox`) sends them
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "1") == "1"
+delivery_worker = DeliveryWorker(
+    lambda: connect(DB_PATH),
+    SmtpSender(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_FROM),
+    poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "2.0")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+    observe=lambda kind, seconds, ok: DELIVERY_SECONDS.observe(seconds, kind, "1" if ok else "0"),
+)
+
+def start_delivery_worker() -> None:
+    if OUTBOX_WORKER:
+        delivery_worker.start()
+
+atexit.register(delivery_worker.stop)
+
+@app.cli.command("deliver-outbox")
+def deliver_outbox_command() -> None:
+    """Run the outbox delivery loop in the foreground (use OUTBOX_WORKER=0 on web workers)."""
+    click.echo("delivering outbox… (Ctrl+C to stop)")
+    try:
+        delivery_worker.run()
+    except KeyboardInterrupt:
+        delivery_worker.stop()
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command() -> None:
+    """Recompute the daily_rollup table from events and leads."""
+    conn = connect(DB_PATH)
+    try:
+        init_db(conn)
+        n = rebuild_rollups(conn)
+    finally:
+        conn.close()
+    click.echo(f"rebuilt {n} rollup row(s)")
+
+@app.cli.command("import-clients")
+@click.argument("path", required=False)
+@click.option("--replace", is_flag=True, help="Overwrite tenants that already exist.")
+def import_clients_command(path: str | None, replace: bool) -> None:
+    """Import tenants from clients.json (or PATH) into the tenants table."""
+    src = Path(path) if path else CLIENTS_PATH
+    data = json.loads(src.read_text(encoding="utf-8"))
+    conn = connect(DB_PATH)
+    try:
+        init_db(conn)
+        n = import_tenants(conn, data, replace=replace)
+    finally:
+        conn.close()
+    click.echo(f"imported {n} tenant(s) from {src}")
+
+@app.cli.command("trace-summary")
+@click.argument("paths", nargs=-1)
+@click.option("--route", help="Only this endpoint, e.g. chat.")
+@click.option("--since", type=float, help="Only traces from the last N hours.")
+def trace_summary_command(paths: Tuple[str, ...], route: str | None, since: float | None) -> None:
+    """Per-phase latency percentiles (ms) from TRACE_LOG and its rotated files (or PATHS)."""
+    files = list(paths) or (trace_log.files() if trace_log is not None else [])
+    if not files:
+        raise click.ClickException("no trace log found (TRACE_LOG)")
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        raise click.ClickException(f"not found: {', '.join(missing)}")
+    records = read_traces(files)
+    if route:
+        records = (r for r in records if r.get("route") == route)
+    if since:
+        cutoff = time.time() - since * 3600
+        records = (r for r in records if r.get("ts", 0) >= cutoff)
+    summary = summarize(records)
+    click.echo(f"{summary['total']['n']} trace(s) from {len(files)} file(s)")
+    click.echo(f"{'phase':<18}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'share':>8}")
+    for name, st in sorted(summary.items(), key=lambda kv: (kv[0] != "total", -kv[1]["share"])):
+        click.echo(f"{name:<18}{st['n']:>7}{st['p50']:>10.1f}{st['p95']:>10.1f}{st['p99']:>10.1f}"
+                   f"{st['max']:>10.1f}{st['share']:>7.0%}")
+
+db_pool = ConnectionPool(
+    DB_PATH,
+    size=int(os.getenv("DB_POOL_SIZE", "8")),
+    cached_statements=int(os.getenv("DB_STATEMENT_CACHE", "128")),
+)
+
+def get_db(readonly: bool = False):
+    """Request-scoped connection from the pool; readonly=True gets a query_only handle."""
+    key = "db_ro" if readonly else "db"
+    if key not in g:
+        setattr(g, key, db_pool.acquire(readonly=readonly))
+    return g.get(key)
 
 @app.teardown_appcontext
 def close_db(_exc):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    for key, readonly in (("db", False), ("db_ro", True)):
+        db = g.pop(key, None)
+        if db is not None:
+            db_pool.release(db, readonly=readonly)
 
 # ---------- helpers ----------
 def sanitize_history(history: Any, max_turns: int = 12, max_chars: int = 1500) -> List[Dict[str, str]]:
@@ -220,25 +441,6 @@ def sanitize_history(history: Any, max_turns: int = 12, max_chars: int = 1500) -
             out.append({"role": role, "content": c[:max_chars]})
     return out
 
-import urllib.request
-
-def post_webhook(url: str, payload: dict) -> None:
-    if not url:
-        return
-    try:
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            url,
-            data=data,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        with urllib.request.urlopen(req, timeout=2.5):
-            pass
-    except Exception:
-        # don't break the request if webhook fails
-        return
-
 def safe_parse_model_json(text: str) -> Dict[str, Any]:
     try:
         data = json.loads(text)
@@ -252,16 +454,14 @@ def safe_parse_model_json(text: str) -> Dict[str, Any]:
         pass
     return {"reply": (text or "…").strip(), "action": "none", "lead": {}}
 
-def get_config(client_id: str) -> Dict[str, Any]:
-    all_clients = load_clients()
-    base = all_clients.get("default", {})
-    overrides = all_clients.get(client_id, {})
+def build_config(client_id: str) -> Dict[str, Any]:
+    base = tenant_store.config("default")
+    overrides = tenant_store.config(client_id) if client_id != "default" else {}
     cfg = merge(base, overrides)
 
     demo = cfg.get("links", {}).get("demo", "{{DEMO_LINK}}")
     demo = demo.replace("{{DEMO_LINK}}", DEFAULT_DEMO_LINK)
-    cfg.setdefault("links", {})
-    cfg["links"]["demo"] = demo
+    cfg["links"] = {**cfg.get("links", {}), "demo": demo}  # copy: don't touch the shared clients dict
     return cfg
 
 def public_config(cfg: dict) -> dict:
@@ -274,6 +474,30 @@ def public_config(cfg: dict) -> dict:
             del clean[k]
     return clean
 
+def compile_snapshot(client_id: str) -> ConfigSnapshot:
+    cfg = build_config(client_id)
+    public = public_config(cfg)
+    public["meta"] = {"clientId": client_id, "model": MODEL}
+    return ConfigSnapshot(client_id, cfg, public, embed_csp_value(cfg), embed_hosts_value(cfg), IntentMatcher(cfg))
+
+def config_stamp(client_id: str) -> tuple:
+    return (tenant_store.version("default"), tenant_store.version(client_id))
+
+config_snapshots = SnapshotRegistry(config_stamp, compile_snapshot)
+
+def get_snapshot(client_id: str) -> ConfigSnapshot:
+    return config_snapshots.get(client_id)
+
+def tenant_label(client_id: str) -> str:
+    """client_id for metric labels; unknown ids share one label so they can't blow up cardinality."""
+    if client_id == "default" or tenant_store.version(client_id):
+        return client_id
+    return "other"
+
+def get_config(client_id: str) -> Dict[str, Any]:
+    """Merged tenant config (shared snapshot — don't mutate)."""
+    return config_snapshots.get(client_id).cfg
+
 def _basic_auth_ok() -> bool:
     auth = request.headers.get("Authorization", "")
     if not auth.startswith("Basic "):
@@ -299,16 +523,19 @@ def _host_from_url(u: str) -> str:
     except Exception:
         return ""
 
-def is_allowed_embed_host(client_cfg: dict) -> bool:
+def embed_hosts_value(client_cfg: dict) -> frozenset | None:
     """
-    Check the caller page host (Referer) for /widget.js requests.
+    Referer allow-list for /widget.js, compiled once per config snapshot.
+    Entries may be bare domains or origins; None means no restriction (dev).
     """
-    allowed = client_cfg.get("allowed_domains", [])
-    if not allowed:
-        return True  # dev / no restriction
-    ref = request.headers.get("Referer", "") or ""
-    host = _host_from_url(ref)
-    return any(a.lower() == host or host.endswith("." + a.lower()) for a in allowed)
+    hosts = set()
+    for d in client_cfg.get("allowed_domains", []):
+        d = (d or "").strip().lower()
+        if "://" in d:
+            d = _host_from_url(d)
+        if d:
+            hosts.add(d)
+    return frozenset(hosts) if hosts else None
 
 def verify_widget_key(client_cfg: dict, provided: str | None) -> bool:
     """
@@ -337,102 +564,459 @@ def frame_ancestors_value(client_cfg: dict) -> str:
             origins.append(f"http://{d}")
     return " ".join(origins)
 
+CSP_BASE = (
+    "default-src 'self'; "
+    "img-src 'self' data:; "
+    "style-src 'self' 'unsafe-inline'; "
+    "script-src 'self'; "
+    "connect-src 'self'; "
+)
+
+def embed_csp_value(client_cfg: dict) -> str:
+    # embed must be frameable by the customer's domains
+    return CSP_BASE + f"frame-ancestors {frame_ancestors_value(client_cfg)};"
+
 # ---------- headers ----------
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Cache-Control per endpoint. None = keep what the view (or send_file) set.
+# Everything not listed — API, admin, HTML pages — is no-store.
+CACHE_POLICY: Dict[str, str | None] = {
+    "asset": CACHE_IMMUTABLE,
+    "config": "no-cache",  # public per-tenant JSON keyed by ?client=: store, but revalidate (ETag/304)
+    "static": None,      # unhashed /static/ URLs: SEND_FILE_MAX_AGE_DEFAULT + revalidation
+    "widget_js": None,
+}
+
 @app.after_request
 def add_headers(resp):
     resp.headers["X-Content-Type-Options"] = "nosniff"
     resp.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    resp.headers["Cache-Control"] = "no-store"
+    policy = CACHE_POLICY.get(request.endpoint or "", "no-store")
+    if resp.status_code >= 400:
+        policy = "no-store"
+    if policy is not None:
+        resp.headers["Cache-Control"] = policy
+    elif "Cache-Control" not in resp.headers:
+        resp.headers["Cache-Control"] = "no-store"
 
     # Default: forbid embedding everywhere
     if request.path != "/embed":
         resp.headers["X-Frame-Options"] = "DENY"
 
-    # CSP differs for embed (must be frameable by customer domains)
+    # CSP differs for embed (must be frameable by customer domains); the
+    # view leaves the snapshot it rendered in g so both agree
     if request.path == "/embed":
-        client_id = get_client_id(request.args.get("client"))
-        cfg = get_config(client_id)
-        fa = frame_ancestors_value(cfg)
-        resp.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "img-src 'self' data:; "
-            "style-src 'self' 'unsafe-inline'; "
-            "script-src 'self'; "
-            "connect-src 'self'; "
-            f"frame-ancestors {fa};"
-        )
+        snap = g.get("snapshot") or get_snapshot(get_client_id(request.args.get("client")))
+        resp.headers["Content-Security-Policy"] = snap.embed_csp
     else:
-        resp.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "img-src 'self' data:; "
-            "style-src 'self' 'unsafe-inline'; "
-            "script-src 'self'; "
-            "connect-src 'self'; "
-            "frame-ancestors 'none';"
-        )
+        resp.headers["Content-Security-Policy"] = CSP_BASE + "frame-ancestors 'none';"
+
+    return resp
 
+# per-tenant request counts for these endpoints (client from ?client= or the JSON body)
+TENANT_ROUTES = frozenset({"index", "config", "chat", "lead", "embed"})
+
+@app.before_request
+def start_timer():
+    g.trace = begin_trace()
+    metrics.start()  # no-op once this worker's flush thread runs
+
+@app.after_request
+def observe_request(resp):
+    route = request.endpoint or "unmatched"
+    tenant = None
+    if route in TENANT_ROUTES:
+        raw = request.args.get("client")
+        if not raw and request.is_json:
+            body = request.get_json(silent=True)
+            raw = body.get("client") if isinstance(body, dict) else None
+        tenant = tenant_label(get_client_id(raw if isinstance(raw, str) else None))
+        TENANT_REQUESTS.inc(tenant, route)
+    trace = g.get("trace")
+    if trace is None:
+        return resp
+    HTTP_SECONDS.observe(trace.elapsed(), route, request.method, str(resp.status_code))
+    if SERVER_TIMING:
+        # streamed replies: only the phases before the first byte
+        resp.headers["Server-Timing"] = trace.server_timing()
+    fields = {"route": route, "method": request.method, "status": resp.status_code, "tenant": tenant,
+              "stream": resp.is_streamed}
+
+    def finish() -> None:
+        end_trace()
+        if trace_log is not None:
+            trace_log.offer(trace, **fields)  # after the body went out, so streams count in full
+
+    resp.call_on_close(finish)
     return resp
 
+@metrics.collector
+def app_samples():
+    """Existing per-worker stats objects as gauges/counters, read at scrape time."""
+    for cid, c in chat_cache.stats().get("by_client", {}).items():
+        for status, n in c.items():
+            yield ("np_chat_cache_total", "counter", "Response cache lookups", {"tenant": tenant_label(cid), "status": status}, n)
+    for cid, c in intent_stats.stats()["by_client"].items():
+        for intent, n in c.items():
+            yield ("np_fast_path_total", "counter", "Fast-path lookups by intent (miss = sent to the model)",
+                   {"tenant": tenant_label(cid), "intent": intent}, n)
+    gate = model_gate.snapshot()
+    yield ("np_model_in_flight", "gauge", "Model calls running", {}, gate["in_flight"])
+    yield ("np_model_waiting", "gauge", "Model calls queued for a slot", {}, gate["waiting"])
+    yield ("np_model_rejected_total", "counter", "Model calls rejected as busy", {}, gate["rejected"])
+    routing = model_router.stats()
+    for model, c in routing["models"].items():
+        for what in ("attempts", "wins", "errors", "cancelled"):
+            yield ("np_model_attempts_total", "counter", "Routed model attempts by result", {"model": model, "result": what}, c[what])
+    yield ("np_model_hedges_total", "counter", "Hedged model calls", {}, routing["hedges"])
+    yield ("np_model_failovers_total", "counter", "Model failovers after an error", {}, routing["failovers"])
+    breaker = upstream_breaker.snapshot()
+    yield ("np_upstream_open", "gauge", "1 while the upstream circuit is open or half-open", {}, int(breaker["state"] != "closed"))
+    yield ("np_upstream_opened_total", "counter", "Times the upstream circuit opened", {}, breaker["opened"])
+    yield ("np_upstream_rejected_total", "counter", "Calls rejected by the open circuit", {}, breaker["rejected"])
+    budget = retry_budget.snapshot()
+    yield ("np_upstream_retries_total", "counter", "Upstream retries", {}, budget["retries"])
+    yield ("np_upstream_retries_denied_total", "counter", "Retries denied by the retry budget", {}, budget["denied"])
+    if admission is not None:
+        adm = admission.stats()
+        yield ("np_admission_admitted_total", "counter", "Chat requests admitted", {}, adm["admitted"])
+        yield ("np_admission_delayed_total", "counter", "Chat requests admitted after waiting", {}, adm["delayed"])
+        for reason, n in adm["shed"].items():
+            yield ("np_admission_shed_total", "counter", "Chat requests shed", {"reason": reason}, n)
+    prompts_stats = prompt_registry.stats()
+    yield ("np_prompt_bundles_total", "counter", "Prompt bundle lookups", {"status": "hit"}, prompts_stats["hits"])
+    yield ("np_prompt_bundles_total", "counter", "Prompt bundle lookups", {"status": "miss"}, prompts_stats["misses"])
+    pool = db_pool.snapshot()
+    yield ("np_db_idle_connections", "gauge", "Pooled SQLite connections", {"mode": "rw"}, pool["idle_rw"])
+    yield ("np_db_idle_connections", "gauge", "Pooled SQLite connections", {"mode": "ro"}, pool["idle_ro"])
+    yield ("np_db_connections_opened_total", "counter", "SQLite connections opened", {}, pool["opened"])
+    wb = write_behind.snapshot()
+    yield ("np_events_queued", "gauge", "Analytics events waiting for the write-behind batch", {}, wb["queued"])
+    yield ("np_events_written_total", "counter", "Analytics events written", {}, wb["rows"])
+    yield ("np_events_sync_fallback_total", "counter", "Rows written by the caller because the queue was full", {}, wb["overflow"])
+    yield ("np_events_batch_errors_total", "counter", "Write-behind batches that failed and went row by row", {}, wb["errors"])
+    yield ("np_events_lost_total", "counter", "Event rows that could not be written", {}, wb["lost"])
+    yield ("np_leads_held", "gauge", "Write-behind leads waiting for a retry", {}, wb["held_leads"])
+    yield ("np_outbox_sent_total", "counter", "Outbox rows delivered", {}, delivery_worker.sent)
+    yield ("np_outbox_failed_total", "counter", "Outbox delivery failures", {}, delivery_worker.failed)
+    yield ("np_outbox_errors_total", "counter", "Outbox rounds that failed outside a send", {}, delivery_worker.errors)
+    if trace_log is not None:
+        tl = trace_log.stats()
+        yield ("np_traces_total", "counter", "Request traces offered to the trace log", {"written": "1"}, tl["written"])
+        yield ("np_traces_total", "counter", "Request traces offered to the trace log", {"written": "0"}, tl["dropped"])
+    if summarizer is not None:
+        yield ("np_summaries_total", "counter", "Background history summaries", {"ok": "1"}, summarizer.done)
+        yield ("np_summaries_total", "counter", "Background history summaries", {"ok": "0"}, summarizer.failed)
+
 # ---------- routes ----------
+@app.get("/assets/<path:filename>")
+def asset(filename: str):
+    """Content-hashed static file, br/gzip variant picked from Accept-Encoding."""
+    a = assets.by_url(filename)
+    if a is None:
+        return Response("Not found", status=404, mimetype="text/plain")
+    enc, body = a.pick(request.headers.get("Accept-Encoding", ""))
+    etag = a.digest if enc == "identity" else f"{a.digest}-{enc}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, content_type=a.content_type)
+        if enc != "identity":
+            resp.headers["Content-Encoding"] = enc
+    resp.set_etag(etag)
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
 @app.get("/")
 def index():
     client_id = get_client_id(request.args.get("client"))
-    return render_template("index.html", client_id=client_id)
+    return render_template("index.html", client_id=client_id, snap=get_snapshot(client_id))
 
 @app.get("/config")
 def config():
     client_id = get_client_id(request.args.get("client"))
-    cfg = get_config(client_id)
-    cfg = public_config(cfg)
-    cfg["meta"] = {"clientId": client_id, "model": MODEL}
-    return jsonify(cfg)
+    snap = get_snapshot(client_id)
+    if snap.etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(snap.body, mimetype="application/json")
+    resp.set_etag(snap.etag)
+    return resp
 
 @app.post("/chat")
 def chat():
     data = request.get_json(silent=True) or {}
     message = (data.get("message") or "").strip()
-    history = sanitize_history(data.get("history"))
     client_id = get_client_id(request.args.get("client") or data.get("client"))
 
     if not message:
         return jsonify({"reply": "Schreib mir kurz, wobei ich helfen kann 🙂", "action": "none", "lead": {}})
 
-    cfg = get_config(client_id)
+    with span("config"):
+        snap = get_snapshot(client_id)
+    cfg = snap.cfg
 
     # Widget key check (works for iframe integration)
     widget_key = request.args.get("k") or data.get("k") or request.headers.get("X-Widget-Key")
     if not verify_widget_key(cfg, widget_key):
         return jsonify({"reply": "Not allowed", "action": "none", "lead": {}}), 403
 
+    if admission is not None:
+        try:
+            with span("admission"):
+                admission.admit(client_id, request.remote_addr or "", cfg)
+        except Shed as e:
+            CHAT_REPLIES.inc(tenant_label(client_id), "limited")
+            resp = jsonify(CHAT_LIMITED_REPLY)
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(max(1, int(e.retry_after + 0.999)))
+            return resp
+
     demo_link = cfg["links"]["demo"]
     brand_name = cfg.get("brand", {}).get("name", "NeuraPilot")
 
-    prompt = load_prompt_bundle(client_id, demo_link=demo_link, brand_name=brand_name)
-    input_items = history + [{"role": "user", "content": message[:1500]}]
+    # known session: history comes from the server; otherwise start one from
+    # whatever history the client sent (first turn, old clients)
+    with DB_SECONDS.time("session_load"):
+        session = chat_sessions.load(get_db(), data.get("session"), client_id)
+    if session is None:
+        if data.get("session") and "history" not in data:
+            # expired or purged, but the client still has the turns: let it resend them
+            return jsonify({"error": "session_expired", "reply": "", "action": "none", "lead": {}}), 409
+        session = chat_sessions.new(client_id, sanitize_history(data.get("history")))
+
+    # pricing / booking / FAQ questions answerable from the config: no model call
+    if cfg.get("fast_path"):
+        with span("fast_path"):
+            hit = snap.intents.match(message)
+        intent_stats.record(client_id, hit[0] if hit else None)
+        if hit is not None:
+            CHAT_REPLIES.inc(tenant_label(client_id), "fast_path")
+            out = finalize_reply(client_id, demo_link, hit[1])
+            save_turn(session, message, out, None)
+            return sse_reply(out) if wants_stream() else (jsonify(out), 200)
+
+    if upstream_breaker.is_open():
+        CHAT_REPLIES.inc(tenant_label(client_id), "degraded")
+        out = degraded_reply(demo_link)
+        save_turn(session, message, out, None)
+        return sse_reply(out) if wants_stream() else (jsonify(out), 200)
+
+    with span("prompt"):
+        bundle = prompt_registry.get(client_id, demo_link=demo_link, brand_name=brand_name, layout=PROMPT_LAYOUT)
+    if chat_sessions.compactor is not None:
+        with span("compact"):
+            chat_sessions.compactor.compact(session, estimate_tokens(bundle.text), message[:1500])
+    input_items = chat_sessions.input_items(session) + [{"role": "user", "content": message[:1500]}]
+
+    models = model_router.models_for(cfg)
+    key = cache_key(client_id, ",".join(models), bundle.text, input_items) if cfg.get("chat_cache") else None
+
+    if wants_stream():
+        return stream_chat(client_id, demo_link, bundle, input_items, key, session, message, models)
+
+    response_ids: List[str] = []
+
+    def call_model() -> Dict[str, Any]:
+        # follow-up turns may queue for a slot; first turns are shed first
+        with span("gate"):
+            model_gate.acquire(priority=not session.is_new)
+        try:
+            t0 = time.monotonic()
+            with span("model"):
+                resp = create_response(bundle, input_items, session, models)
+            record_model_call(client_id, getattr(resp, "model", None) or models[0], time.monotonic() - t0, resp.usage)
+        finally:
+            model_gate.release()
+        response_ids.append(resp.id)
+        with span("parse"):
+            return safe_parse_model_json((resp.output_text or "").strip())
 
     try:
-        resp = client.responses.create(
-            model=MODEL,
-            instructions=prompt,
-            input=input_items,
-            temperature=0.4,
-            max_output_tokens=450,
-        )
-
-        raw = (resp.output_text or "").strip()
-        parsed = safe_parse_model_json(raw)
-
-        action = parsed.get("action", "none")
-        if action in ("book_demo", "collect_email"):
-            insert_event(get_db(), client_id, action)
-
-        if action == "book_demo" and demo_link not in parsed.get("reply", ""):
-            parsed["reply"] = f'{parsed.get("reply","").strip()}\n\nDemo-Link: {demo_link}'.strip()
-
-        return jsonify(parsed), 200
-
+        status = "miss"
+        if key:
+            parsed, status = chat_cache.get_or_compute(key, client_id, call_model)
+        else:
+            parsed = call_model()
+        CHAT_REPLIES.inc(tenant_label(client_id), "model" if status == "miss" else "cache")
+        out = finalize_reply(client_id, demo_link, parsed)
+        save_turn(session, message, out, response_ids[-1] if response_ids else None)
+        return jsonify(out), 200
+
+    except ModelBusy:
+        CHAT_REPLIES.inc(tenant_label(client_id), "busy")
+        return jsonify(CHAT_BUSY_REPLY), 503
+    except CircuitOpen:
+        CHAT_REPLIES.inc(tenant_label(client_id), "degraded")
+        out = degraded_reply(demo_link)
+        save_turn(session, message, out, None)
+        return jsonify(out), 200
     except Exception:
-        return jsonify({"reply": "Uff — technisches Problem. Bitte nochmal versuchen.", "action": "none", "lead": {}}), 500
+        CHAT_REPLIES.inc(tenant_label(client_id), "error")
+        return jsonify(CHAT_ERROR_REPLY), 500
+
+def model_params(bundle: PromptBundle, input_items: List[Dict[str, str]], session: ChatSession | None) -> Dict[str, Any]:
+    """responses.create kwargs; when chaining, only the new message goes upstream."""
+    params: Dict[str, Any] = {
+        "model": MODEL,
+        "instructions": bundle.text,
+        "input": input_items,
+        "temperature": 0.4,
+        "max_output_tokens": 450,
+    }
+    if bundle.prefix_len:
+        # route all tenants sharing the prefix to the same upstream cache
+        params["prompt_cache_key"] = bundle.prefix_hash
+    if CHAT_SESSION_CHAIN and session is not None and session.response_id:
+        params["previous_response_id"] = session.response_id
+        params["input"] = input_items[-1:]
+    return params
+
+def create_response(bundle: PromptBundle, input_items: List[Dict[str, str]], session: ChatSession | None,
+                    models: List[str] | None = None, **extra: Any):
+    models = models or [MODEL]
+    params = model_params(bundle, input_items, session)
+    try:
+        return model_router.create(models, **params, **extra)
+    except APIStatusError as e:
+        # stored response expired/unknown: resend the full history once
+        if "previous_response_id" not in params or e.status_code not in (400, 404):
+            raise
+        return model_router.create(models, **model_params(bundle, input_items, None), **extra)
+
+def save_turn(session: ChatSession, message: str, out: Dict[str, Any], response_id: str | None) -> None:
+    """Persist the turn and tell the client its session id. Never fails the reply."""
+    try:
+        with DB_SECONDS.time("session_save"):
+            chat_sessions.record_turn(get_db(), session, message, out.get("reply", ""), response_id, out.get("lead"),
+                                      degraded=bool(out.get("degraded")))
+        out["session"] = session.id
+    except sqlite3.Error:
+        pass
+
+CHAT_ERROR_REPLY = {"reply": "Uff — technisches Problem. Bitte nochmal versuchen.", "action": "none", "lead": {}}
+CHAT_LIMITED_REPLY = {"reply": "Das waren gerade sehr viele Nachrichten — bitte kurz warten.", "action": "none", "lead": {}}
+CHAT_BUSY_REPLY = {"reply": "Gerade ist viel los — bitte in ein paar Sekunden nochmal versuchen.", "action": "none", "lead": {}}
+
+def degraded_reply(demo_link: str) -> Dict[str, Any]:
+    """While the model backend is down: demo link + e-mail capture instead of a chat answer."""
+    return {
+        "reply": "Ich bin gerade kurz nicht erreichbar. Buch dir direkt einen Termin: "
+                 f"{demo_link} — oder hinterlass deine E-Mail, dann melden wir uns.",
+        "action": "collect_email",
+        "lead": {},
+        "degraded": True,
+    }
+
+def wants_stream() -> bool:
+    if request.args.get("stream") == "1":
+        return True
+    return "text/event-stream" in (request.headers.get("Accept") or "")
+
+def finalize_reply(client_id: str, demo_link: str, parsed: Dict[str, Any]) -> Dict[str, Any]:
+    action = parsed.get("action", "none")
+    if action in ("book_demo", "collect_email"):
+        record_event(client_id, action)
+
+    if action == "book_demo" and demo_link not in parsed.get("reply", ""):
+        parsed["reply"] = f'{parsed.get("reply","").strip()}\n\nDemo-Link: {demo_link}'.strip()
+    return parsed
+
+def record_model_call(client_id: str, model: str, latency: float, usage: Any = None, ttft: float | None = None) -> None:
+    model_stats.record(latency, usage, ttft)
+    MODEL_SECONDS.observe(latency, model)
+    if ttft is not None:
+        MODEL_TTFT.observe(ttft, model)
+    if usage is not None:
+        tenant = tenant_label(client_id)
+        details = getattr(usage, "input_tokens_details", None)
+        MODEL_TOKENS.inc(tenant, model, "input", amount=int(getattr(usage, "input_tokens", 0) or 0))
+        MODEL_TOKENS.inc(tenant, model, "cached", amount=int(getattr(details, "cached_tokens", 0) or 0))
+        MODEL_TOKENS.inc(tenant, model, "output", amount=int(getattr(usage, "output_tokens", 0) or 0))
+
+def sse_reply(out: Dict[str, Any]) -> Response:
+    """A finished reply in /chat's SSE format: one delta, then done."""
+    body = sse("delta", {"text": out.get("reply", "")}) + sse("done", out)
+    return Response(body, mimetype="text/event-stream")
+
+def stream_chat(
+    client_id: str, demo_link: str, bundle: PromptBundle, input_items: List[Dict[str, str]], key: str | None = None,
+    session: ChatSession | None = None, message: str = "", models: List[str] | None = None,
+) -> Response:
+    """
+    SSE variant of /chat: "delta" events carry reply text as it is generated,
+    a final "done" event carries the full {reply, action, lead}.
+    Cache hits are replayed as one delta; streamed misses fill the cache
+    but are not coalesced.
+    """
+    def generate():
+        if key:
+            cached = chat_cache.get(key, client_id)
+            if cached is not None:
+                CHAT_REPLIES.inc(tenant_label(client_id), "cache")
+                parsed = finalize_reply(client_id, demo_link, cached)
+                if session is not None:
+                    save_turn(session, message, parsed, None)
+                yield sse("delta", {"text": parsed.get("reply", "")})
+                yield sse("done", parsed)
+                return
+
+        extractor = ReplyExtractor()
+        try:
+            response_id = None
+            usage = None
+            ttft = None
+            model = (models or [MODEL])[0]
+            with span("gate"):
+                model_gate.acquire(priority=session is None or not session.is_new)
+            try:
+                t0 = time.monotonic()
+                with span("model"):
+                    events = create_response(bundle, input_items, session, models, stream=True)
+                    for ev in events:
+                        if ev.type == "response.output_text.delta":
+                            if ttft is None:
+                                ttft = time.monotonic() - t0
+                            text = extractor.feed(ev.delta or "")
+                            if text:
+                                yield sse("delta", {"text": text})
+                        elif ev.type in ("response.created", "response.completed"):
+                            response_id = ev.response.id
+                            usage = ev.response.usage or usage
+                            model = ev.response.model or model
+                        elif ev.type in ("response.failed", "error"):
+                            raise RuntimeError(ev.type)
+                record_model_call(client_id, model, time.monotonic() - t0, usage, ttft)
+            finally:
+                model_gate.release()
+
+            with span("parse"):
+                parsed = safe_parse_model_json(extractor.text().strip())
+            CHAT_REPLIES.inc(tenant_label(client_id), "model")
+            if key:
+                chat_cache.put(key, client_id, parsed)
+            out = finalize_reply(client_id, demo_link, parsed)
+            if session is not None:
+                save_turn(session, message, out, response_id)
+            yield sse("done", out)
+        except ModelBusy:
+            CHAT_REPLIES.inc(tenant_label(client_id), "busy")
+            yield sse("error", CHAT_BUSY_REPLY)
+        except CircuitOpen:
+            CHAT_REPLIES.inc(tenant_label(client_id), "degraded")
+            out = degraded_reply(demo_link)
+            if session is not None:
+                save_turn(session, message, out, None)
+            yield sse("delta", {"text": out["reply"]})
+            yield sse("done", out)
+        except Exception:
+            CHAT_REPLIES.inc(tenant_label(client_id), "error")
+            yield sse("error", CHAT_ERROR_REPLY)
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["X-Accel-Buffering"] = "no"  # nginx: don't buffer the stream
+    return resp
 
 @app.post("/lead")
 def lead():
@@ -454,34 +1038,56 @@ def lead():
     source = (data.get("source") or "chat")[:40]
     conversation = (data.get("conversation") or "")[:2000]
 
-    insert_lead(
-        get_db(),
-        client_id=client_id,
-        email=email,
-        service=service,
-        timing=timing,
-        budget=budget,
-        source=source,
-        conversation=conversation,
-    )
+    lead_data = {
+        "client_id": client_id,
+        "email": email,
+        "service": service,
+        "timing": timing,
+        "budget": budget,
+        "source": source,
+        "conversation": conversation,
+    }
+    outbox = lead_notifications(cfg, client_id, lead_data)
+    if WRITE_BEHIND and LEAD_WRITE_MODE == "behind":
+        write_behind.add_lead({**lead_data, "outbox": outbox})
+    else:
+        with DB_SECONDS.time("insert_lead"):
+            insert_lead(get_db(), **lead_data, outbox=outbox)
+    start_delivery_worker()
+    delivery_worker.notify()
+
+    return jsonify({"ok": True}), 200
+
+def lead_notifications(cfg: dict, client_id: str, lead_data: Dict[str, str]) -> List[tuple]:
+    """Outbox rows (kind, target, payload, due_ts) for a new lead."""
+    now = int(time.time())
+    rows: List[tuple] = []
+
     # Email forwarding (optional)
     to_addr = (cfg.get("lead_email_to") or LEAD_EMAIL_FALLBACK or "").strip()
-    if to_addr:
-        subj = LEAD_EMAIL_SUBJECT.format(client_id=client_id)
+    if to_addr and SMTP_HOST and SMTP_FROM:
         body = (
             f"Client: {client_id}\n"
-            f"Email: {email}\n"
-            f"Service: {service}\n"
-            f"Timing: {timing}\n"
-            f"Budget: {budget}\n"
-            f"Source: {source}\n"
+            f"Email: {lead_data['email']}\n"
+            f"Service: {lead_data['service']}\n"
+            f"Timing: {lead_data['timing']}\n"
+            f"Budget: {lead_data['budget']}\n"
+            f"Source: {lead_data['source']}\n"
             f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
             "Conversation:\n"
-            f"{conversation}\n"
+            f"{lead_data['conversation']}\n"
         )
-        send_lead_email(to_addr, subj, body)
+        payload = {"subject": LEAD_EMAIL_SUBJECT.format(client_id=client_id), "body": body}
+        digest_minutes = int(cfg.get("lead_digest_minutes") or 0)
+        if digest_minutes > 0:
+            rows.append(("email_digest", to_addr, payload, digest_due(now, digest_minutes)))
+        else:
+            rows.append(("email", to_addr, payload, now))
 
-    return jsonify({"ok": True}), 200
+    webhook_url = (cfg.get("webhook_url") or "").strip()
+    if webhook_url:
+        rows.append(("webhook", webhook_url, {"event": "lead", "ts": now, **lead_data}, now))
+    return rows
 
 @app.get("/admin/clients")
 def admin_clients():
@@ -489,9 +1095,8 @@ def admin_clients():
     if r is not None:
         return r
 
-    data = load_clients_file()
     out = []
-    for cid, cfg in data.items():
+    for cid, cfg in list_tenants(get_db(readonly=True)):
         if cid == "default":
             continue
         out.append({
@@ -532,29 +1137,20 @@ def admin_create_client():
 
     base_url = request.host_url.rstrip("/")
 
-    def _op():
-        data = load_clients_file()
-        if client_id in data:
-            return {"ok": False, "error": "Client already exists"}
-
-        data[client_id] = {
-            "brand": {"name": brand_name, "logoText": logo_text},
-            "links": {"demo": demo_link},
-            "allowed_domains": allowed_domains,
-            "widget_key": widget_key,
-            "theme": theme,
-            "copy": copy,
-            "webhook_url": webhook_url,
-            "lead_email_to": lead_email_to
-        }
-
-        write_clients_file_atomic(data)
-        ensure_prompt_file(client_id, brand_name, demo_link)
-        return {"ok": True}
-
-    res = with_clients_lock(_op)
-    if not res.get("ok"):
-        return jsonify(res), 400
+    created = insert_tenant(get_db(), client_id, {
+        "brand": {"name": brand_name, "logoText": logo_text},
+        "links": {"demo": demo_link},
+        "allowed_domains": allowed_domains,
+        "widget_key": widget_key,
+        "theme": theme,
+        "copy": copy,
+        "webhook_url": webhook_url,
+        "lead_email_to": lead_email_to
+    })
+    if not created:
+        return jsonify({"ok": False, "error": "Client already exists"}), 400
+    tenant_store.invalidate(client_id)
+    ensure_prompt_file(client_id, brand_name, demo_link)
 
     snippet = f'''<script
   src="{base_url}/widget.js"
@@ -572,6 +1168,11 @@ def admin_create_client():
         "preview_url": f"{base_url}/?client={client_id}",
     }), 200
 
+def _faq_entry_ok(entry: Any) -> bool:
+    keywords = entry.get("keywords") if isinstance(entry, dict) else None
+    return (isinstance(keywords, list) and bool(keywords)
+            and all(isinstance(k, str) and k.strip() for k in keywords))
+
 @app.post("/admin/update-client")
 def admin_update_client():
     r = require_admin()
@@ -583,17 +1184,11 @@ def admin_update_client():
     if not client_id:
         return jsonify({"ok": False, "error": "invalid client_id"}), 400
 
-    def _op():
-        data = load_clients_file()
-        if client_id not in data:
-            return {"ok": False, "error": "client not found"}
-
-        c = data[client_id]
-
+    def _op(c: dict) -> str | None:
         if "allowed_domains" in payload:
             ad = payload["allowed_domains"]
             if not isinstance(ad, list):
-                return {"ok": False, "error": "allowed_domains must be list"}
+                return "allowed_domains must be list"
             c["allowed_domains"] = [str(d).strip() for d in ad if str(d).strip()]
 
         if "demo_link" in payload:
@@ -616,12 +1211,47 @@ def admin_update_client():
         if "lead_email_to" in payload:
             c["lead_email_to"] = str(payload["lead_email_to"]).strip()
 
-        data[client_id] = c
-        write_clients_file_atomic(data)
-        return {"ok": True}
+        if "chat_cache" in payload:
+            c["chat_cache"] = bool(payload["chat_cache"])
+
+        if "plan" in payload:
+            c["plan"] = str(payload["plan"]).strip()
+
+        if "rate_limit" in payload:
+            if payload["rate_limit"] in (None, ""):
+                c.pop("rate_limit", None)
+            elif parse_limit(payload["rate_limit"]) is None:
+                return "rate_limit must be \"rate:burst\""
+            else:
+                c["rate_limit"] = payload["rate_limit"]
+
+        if "models" in payload:
+            models = payload["models"]
+            if not isinstance(models, list) or not all(isinstance(m, str) and m.strip() for m in models):
+                return "models must be a list of model names"
+            c["models"] = [m.strip() for m in models]
 
-    res = with_clients_lock(_op)
-    return jsonify(res), (200 if res.get("ok") else 400)
+        if "fast_path" in payload:
+            c["fast_path"] = bool(payload["fast_path"])
+
+        if "faq" in payload:
+            faq = payload["faq"]
+            if not isinstance(faq, list) or not all(_faq_entry_ok(f) for f in faq):
+                return "faq must be a list of {keywords, answer} with keywords a non-empty list of strings"
+            c["faq"] = faq
+
+        if "lead_digest_minutes" in payload:
+            try:
+                c["lead_digest_minutes"] = max(0, int(payload["lead_digest_minutes"]))
+            except (TypeError, ValueError):
+                return "lead_digest_minutes must be a number"
+        return None
+
+    err = update_tenant(get_db(), client_id, _op)
+    if err:
+        return jsonify({"ok": False, "error": err}), 400
+    tenant_store.invalidate(client_id)
+    return jsonify({"ok": True}), 200
 
 @app.post("/admin/rotate-key")
 def admin_rotate_key():
@@ -636,17 +1266,10 @@ def admin_rotate_key():
 
     new_key = secrets.token_urlsafe(24)
 
-    def _op():
-        data = load_clients_file()
-        if client_id not in data:
-            return {"ok": False, "error": "client not found"}
-        data[client_id]["widget_key"] = new_key
-        write_clients_file_atomic(data)
-        return {"ok": True}
-
-    res = with_clients_lock(_op)
-    if not res.get("ok"):
-        return jsonify(res), 400
+    err = update_tenant(get_db(), client_id, lambda c: c.update(widget_key=new_key))
+    if err:
+        return jsonify({"ok": False, "error": err}), 400
+    tenant_store.invalidate(client_id)
 
     return jsonify({"ok": True, "client_id": client_id, "widget_key": new_key}), 200
 
@@ -668,134 +1291,262 @@ def admin_data():
     cid = request.args.get("client") or ""
     cid = get_client_id(cid) if cid else None
 
-    db = get_db()
+    db = get_db(readonly=True)
     return jsonify({
         "client": cid or "",
         "stats": stats(db, client_id=cid),
         "kpi": kpi(db, days=7, client_id=cid),
-        "leads": list_leads(db, limit=200, client_id=cid),
     })
 
-PROMPTS_DIR = Path(BASE_DIR) / "prompts"
-CLIENT_TEMPLATE_PATH = PROMPTS_DIR / "client_template.txt"
+@app.get("/admin/cache")
+def admin_cache():
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify(chat_cache.stats())
 
-def ensure_prompt_file(client_id: str, brand_name: str, demo_link: str) -> None:
-    p = PROMPTS_DIR / f"{client_id}.txt"
-    if p.exists():
-        return
-    template = CLIENT_TEMPLATE_PATH.read_text(encoding="utf-8")
-    text = (template
-        .replace("{{BRAND_NAME}}", brand_name)
-        .replace("{{DEMO_LINK}}", demo_link)
-    ).strip() + "\n"
-    p.write_text(text, encoding="utf-8")
+@app.get("/admin/fast-path")
+def admin_fast_path():
+    """Chat turns answered from the tenant config vs. sent to the model (this worker)."""
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify(intent_stats.stats())
+
+@app.get("/admin/model-stats")
+def admin_model_stats():
+    """Upstream usage of this worker: tokens (incl. prompt-cache hits) and latency."""
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify({"layout": PROMPT_LAYOUT, **model_stats.snapshot(), "routing": model_router.stats()})
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text format, all workers merged (each flushes every METRICS_FLUSH_INTERVAL s)."""
+    r = require_admin()
+    if r is not None:
+        return r
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/prompts")
+def admin_prompts():
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify(prompt_registry.stats())
+
+@app.post("/admin/reload-prompts")
+def admin_reload_prompts():
+    """After editing prompt files by hand: every worker recompiles on its next chat."""
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify({"ok": True, "version": prompt_registry.bump()})
 
+def parse_time_arg(raw: str | None, end: bool = False) -> int | None:
+    """Unix seconds or YYYY-MM-DD (UTC); with end=True a date means the end of that day."""
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    if raw.isdigit():
+        return int(raw)
+    try:
+        ts = calendar.timegm(time.strptime(raw, "%Y-%m-%d"))
+    except ValueError:
+        return None
+    return ts + 86400 if end else ts
+
+def lead_filters_from_request() -> Dict[str, Any]:
+    cid = request.args.get("client") or ""
+    return {
+        "client_id": get_client_id(cid) if cid else None,
+        "since": parse_time_arg(request.args.get("since")),
+        "until": parse_time_arg(request.args.get("until"), end=True),
+    }
+
+ADMIN_LEADS_PAGE = 100
+ADMIN_LEADS_MAX_PAGE = 500
+
+def encode_cursor(ts: int, lead_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{ts}:{lead_id}".encode("ascii")).decode("ascii").rstrip("=")
+
+def decode_cursor(raw: str | None) -> Tuple[int, int] | None:
+    if not raw:
+        return None
+    try:
+        ts, lead_id = base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)).decode("ascii").split(":")
+        return int(ts), int(lead_id)
+    except ValueError:
+        return None
+
+@app.get("/admin/leads")
+def admin_leads():
+    """
+    One page of leads, newest first. ?cursor= (from the previous page's
+    "next"), ?limit=, ?client=, ?since=/?until=, ?q= (email/service).
+    """
+    r = require_admin()
+    if r is not None:
+        return r
+
+    cursor = request.args.get("cursor") or ""
+    before = decode_cursor(cursor)
+    if cursor and before is None:
+        return jsonify({"error": "bad cursor"}), 400
+    try:
+        limit = int(request.args.get("limit") or ADMIN_LEADS_PAGE)
+    except ValueError:
+        limit = ADMIN_LEADS_PAGE
+    limit = max(1, min(ADMIN_LEADS_MAX_PAGE, limit))
+
+    rows = leads_page(
+        get_db(readonly=True),
+        limit=limit,
+        before=before,
+        q=(request.args.get("q") or "").strip()[:200],
+        **lead_filters_from_request(),
+    )
+    nxt = encode_cursor(rows[-1]["ts"], rows[-1]["id"]) if len(rows) == limit else None
+    return jsonify({"leads": rows, "next": nxt})
+
+@app.get("/admin/export")
 @app.get("/admin/export.csv")
 def admin_export():
+    """
+    Streams all matching leads (newest first) without loading them into memory.
+    ?format=csv|ndjson, ?gzip=1, ?client=, ?since=/?until= (YYYY-MM-DD or unix), ?conversation=1
+    """
     r = require_admin()
     if r is not None:
         return r
 
-    cid = request.args.get("client") or ""
-    cid = get_client_id(cid) if cid else None
-    rows = list_leads(get_db(), limit=5000, client_id=cid)
-    header = "id,ts,client_id,email,service,timing,budget,source\n"
-    lines = [header]
-
-    for row in rows:
-        def esc(v: Any) -> str:
-            s = str(v or "").replace('"', '""')
-            return f'"{s}"'
-        lines.append(",".join([
-            esc(row.get("id")),
-            esc(row.get("ts")),
-            esc(row.get("client_id")),
-            esc(row.get("email")),
-            esc(row.get("service")),
-            esc(row.get("timing")),
-            esc(row.get("budget")),
-            esc(row.get("source")),
-        ]) + "\n")
-
-    resp = make_response("".join(lines))
-    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-    resp.headers["Content-Disposition"] = "attachment; filename=neurapilot-leads.csv"
+    fmt = "ndjson" if request.args.get("format") == "ndjson" else "csv"
+    gz = request.args.get("gzip") == "1"
+    include_conversation = request.args.get("conversation") == "1"
+    filters = lead_filters_from_request()
+    db = get_db(readonly=True)
+    cols = LEAD_COLUMNS + (("conversation",) if include_conversation else ())
+
+    def rows_text():
+        buf = io.StringIO()
+        writer = csv.writer(buf) if fmt == "csv" else None
+        if writer:
+            writer.writerow(cols)
+        n = 0
+        for row in iter_leads(db, include_conversation=include_conversation, **filters):
+            if writer:
+                writer.writerow([row.get(c) if row.get(c) is not None else "" for c in cols])
+            else:
+                buf.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n += 1
+            if n % 500 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def body():
+        if not gz:
+            for chunk in rows_text():
+                yield chunk.encode("utf-8")
+            return
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # gzip container
+        for chunk in rows_text():
+            out = z.compress(chunk.encode("utf-8"))
+            if out:
+                yield out
+        yield z.flush()
+
+    ext = "csv" if fmt == "csv" else "ndjson"
+    filename = f"neurapilot-leads.{ext}" + (".gz" if gz else "")
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(body()), mimetype="application/gzip" if gz else mimetype)
+    if not gz:
+        resp.headers["Content-Type"] = f"{mimetype}; charset=utf-8"
+    resp.headers["Content-Disposition"] = f"attachment; filename={filename}"
     return resp
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "ok", "ts": int(time.time())})
+    """Public liveness/readiness probe; internals are in /admin/status and /metrics."""
+    return jsonify({"status": "degraded" if upstream_breaker.is_open() else "ok", "ts": int(time.time())})
+
+@app.get("/admin/status")
+def admin_status():
+    """Model gate, upstream breaker, admission and DB pool of this worker."""
+    r = require_admin()
+    if r is not None:
+        return r
+    return jsonify({
+        "status": "degraded" if upstream_breaker.is_open() else "ok",
+        "ts": int(time.time()),
+        "model": model_gate.snapshot(),
+        "upstream": {**upstream_breaker.snapshot(), "retry_budget": retry_budget.snapshot()},
+        "admission": admission.stats() if admission is not None else None,
+        "db": db_pool.snapshot(),
+    })
 
 # ---------- Widget integration ----------
+WIDGET_SRC_PATH = Path(BASE_DIR) / "widget.js"
+
+def build_widget_loader() -> tuple:
+    """
+    Minify + precompress widget.js once and register it as a fingerprinted
+    asset. Returns (loader asset, bootstrap bytes, bootstrap etag). The
+    bootstrap is what /widget.js serves: a few hundred bytes that load the
+    current loader version with the snippet's data-* attributes and the
+    embed's asset URLs to prefetch.
+    """
+    loader = assets.add(
+        "widget.js",
+        minify_js(WIDGET_SRC_PATH.read_text(encoding="utf-8")).encode("utf-8"),
+        "application/javascript; charset=utf-8",
+    )
+    # what the embed page loads first; prefetched when a visitor hovers the button
+    warm = " ".join(f"assets/{assets.url_name(n)}" for n in ("style.css", "app.js") if assets.url_name(n))
+    boot = (
+        "(function(){var s=document.currentScript;if(!s)return;"
+        "var n=document.createElement(\"script\");"
+        f"n.src=new URL(\"assets/{loader.url_name}\",s.src).href;n.async=true;"
+        "for(var k in s.dataset)n.dataset[k]=s.dataset[k];"
+        "if(!n.dataset.client){var c=new URL(s.src).searchParams.get(\"client\");if(c)n.dataset.client=c;}"
+        "n.dataset.base=new URL(\".\",s.src).href;"
+        f"if(!n.dataset.warm)n.dataset.warm=\"{warm}\";"
+        "(document.head||document.documentElement).appendChild(n);})();\n"
+    ).encode("utf-8")
+    return loader, boot, hashlib.sha256(boot).hexdigest()[:16]
+
+widget_loader, WIDGET_BOOTSTRAP, WIDGET_BOOTSTRAP_ETAG = build_widget_loader()
+
 @app.get("/widget.js")
 def widget_js():
+    """
+    Stable URL used in customer snippets. Checks the Referer against the
+    tenant's precompiled allow-list and returns the tiny bootstrap; the
+    loader itself is served immutable from /assets/.
+    """
     client_id = get_client_id(request.args.get("client") or request.args.get("c"))
-    cfg = get_config(client_id)
 
     # Only serve widget script to allowed customer domains (via Referer)
-    if not is_allowed_embed_host(cfg):
+    host = _host_from_url(request.headers.get("Referer", "") or "")
+    if not get_snapshot(client_id).host_allowed(host):
         return Response("/* not allowed */", mimetype="application/javascript", status=403)
 
-    js = r"""
-(function(){
-  const s = document.currentScript;
-  const client = (s && s.dataset.client) ? s.dataset.client : "default";
-  const key = (s && s.dataset.key) ? s.dataset.key : "";
-  const pos = (s && s.dataset.position) ? s.dataset.position : "right";
-  const accent = (s && s.dataset.accent) ? s.dataset.accent : "";
-
-  const btn = document.createElement("button");
-  btn.innerText = "Chat";
-  btn.style.position = "fixed";
-  btn.style.bottom = "18px";
-  btn.style[pos] = "18px";
-  btn.style.zIndex = "999999";
-  btn.style.border = "1px solid rgba(255,255,255,.18)";
-  btn.style.borderRadius = "14px";
-  btn.style.padding = "12px 14px";
-  btn.style.fontWeight = "800";
-  btn.style.cursor = "pointer";
-  btn.style.background = accent || "rgba(255,255,255,.92)";
-  btn.style.color = "#0b1020";
-
-  const wrap = document.createElement("div");
-  wrap.style.position = "fixed";
-  wrap.style.bottom = "72px";
-  wrap.style[pos] = "18px";
-  wrap.style.width = "380px";
-  wrap.style.height = "560px";
-  wrap.style.zIndex = "999999";
-  wrap.style.display = "none";
-  wrap.style.borderRadius = "18px";
-  wrap.style.overflow = "hidden";
-  wrap.style.boxShadow = "0 24px 70px rgba(0,0,0,.45)";
-  wrap.style.border = "1px solid rgba(255,255,255,.12)";
-
-  const iframe = document.createElement("iframe");
-  const base = s.src.replace(/\/widget\.js(\?.*)?$/, "");
-  const qs = `client=${encodeURIComponent(client)}&k=${encodeURIComponent(key)}`;
-  iframe.src = `${base}/embed?${qs}`;
-  iframe.style.width = "100%";
-  iframe.style.height = "100%";
-  iframe.style.border = "0";
-  wrap.appendChild(iframe);
-
-  btn.addEventListener("click", () => {
-    wrap.style.display = (wrap.style.display === "none") ? "block" : "none";
-  });
-
-  document.body.appendChild(btn);
-  document.body.appendChild(wrap);
-})();
-"""
-    resp = Response(js, mimetype="application/javascript")
-    resp.headers["Cache-Control"] = "public, max-age=3600"  # ok to cache a bit
+    if request.if_none_match.contains(WIDGET_BOOTSTRAP_ETAG):
+        resp = Response(status=304)
+    else:
+        resp = Response(WIDGET_BOOTSTRAP, mimetype="application/javascript")
+    resp.set_etag(WIDGET_BOOTSTRAP_ETAG)
+    # short: a new loader version reaches sites within minutes
+    resp.headers["Cache-Control"] = "public, max-age=300"
     return resp
 
 @app.get("/embed")
 def embed():
     client_id = get_client_id(request.args.get("client"))
-    return render_template("embed.html", client_id=client_id)
+    g.snapshot = get_snapshot(client_id)
+    return render_template("embed.html", client_id=client_id, snap=g.snapshot)
 
 
 @app.post("/billing/checkout")
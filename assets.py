@@ -0,0 +1,158 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from typing import Dict, Iterable, Tuple
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# below this, compression overhead isn't worth a Content-Encoding
+MIN_COMPRESS_SIZE = 512
+
+class Asset:
+    """One static file: raw bytes, precompressed variants and a content hash."""
+
+    __slots__ = ("name", "content_type", "digest", "url_name", "variants", "mtime")
+
+    def __init__(self, name: str, data: bytes, content_type: str,
+                 variants: Dict[str, bytes] | None = None, mtime: float = 0.0) -> None:
+        self.name = name
+        self.content_type = content_type
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.url_name = f"{stem}.{self.digest}{ext}"
+        self.variants: Dict[str, bytes] = {"identity": data}
+        self.mtime = mtime
+        for enc, body in (variants or {}).items():
+            if len(body) < len(data):
+                self.variants[enc] = body
+
+    def pick(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """Best variant for an Accept-Encoding header: br, then gzip, then identity."""
+        accepted = {p.split(";", 1)[0].strip().lower() for p in (accept_encoding or "").split(",")}
+        for enc in ("br", "gzip"):
+            if enc in accepted and enc in self.variants:
+                return enc, self.variants[enc]
+        return "identity", self.variants["identity"]
+
+_BLOCK_COMMENT = re.compile(r"^[ \t]*/\*.*?\*/[ \t]*$", re.M | re.S)
+_LINE_COMMENT = re.compile(r"^[ \t]*//.*$", re.M)
+_TRAILING_COMMENT = re.compile(r"(?<=[;{,])[ \t]+//.*$", re.M)
+
+def minify_js(src: str) -> str:
+    """
+    Conservative minifier for our own hand-written scripts: drops comments
+    that start a line or follow `;`/`{`/`,`, indentation and blank lines.
+    Line breaks are kept so automatic semicolon insertion still works.
+    """
+    src = _BLOCK_COMMENT.sub("", src)
+    src = _LINE_COMMENT.sub("", src)
+    src = _TRAILING_COMMENT.sub("", src)
+    return "\n".join(line.strip() for line in src.splitlines() if line.strip()) + "\n"
+
+def compress_variants(data: bytes) -> Dict[str, bytes]:
+    if len(data) < MIN_COMPRESS_SIZE:
+        return {}
+    out = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        out["br"] = brotli.compress(data, quality=11)
+    return out
+
+def _read_sidecar(path: str, src_mtime: float) -> bytes | None:
+    # prebuilt app.js.gz / app.js.br from a build step win if they're not stale
+    try:
+        if os.path.getmtime(path) >= src_mtime:
+            with open(path, "rb") as f:
+                return f.read()
+    except OSError:
+        pass
+    return None
+
+class AssetRegistry:
+    """
+    Fingerprinted static assets. Files are read, hashed and compressed once;
+    templates link to `<stem>.<hash><ext>` so the URL changes whenever the
+    content does and responses can be cached as immutable. Generated assets
+    (not on disk) can be registered with add(). With auto_reload the
+    directory is re-checked by mtime on every lookup (dev only).
+    """
+
+    def __init__(self, static_dir: str, extensions: Iterable[str] = (".js", ".css", ".svg", ".png", ".ico", ".woff2"),
+                 auto_reload: bool = False) -> None:
+        self.static_dir = static_dir
+        self.extensions = tuple(extensions)
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, Asset] = {}
+        self._by_url: Dict[str, Asset] = {}
+        self.scan()
+
+    def _load(self, name: str) -> Asset:
+        path = os.path.join(self.static_dir, name)
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        variants = compress_variants(data)
+        for enc, ext in (("gzip", ".gz"), ("br", ".br")):
+            pre = _read_sidecar(path + ext, mtime)
+            if pre is not None:
+                variants[enc] = pre
+        ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if ctype.startswith("text/") or ctype == "application/javascript":
+            ctype += "; charset=utf-8"
+        return Asset(name, data, ctype, variants, mtime)
+
+    def _put_locked(self, asset: Asset) -> None:
+        old = self._by_name.get(asset.name)
+        if old is not None:
+            self._by_url.pop(old.url_name, None)
+        self._by_name[asset.name] = asset
+        self._by_url[asset.url_name] = asset
+
+    def scan(self) -> None:
+        for root, _dirs, files in os.walk(self.static_dir):
+            for fn in files:
+                if not fn.endswith(self.extensions):
+                    continue
+                name = os.path.relpath(os.path.join(root, fn), self.static_dir).replace(os.sep, "/")
+                asset = self._load(name)
+                with self._lock:
+                    self._put_locked(asset)
+
+    def add(self, name: str, data: bytes, content_type: str) -> Asset:
+        asset = Asset(name, data, content_type, compress_variants(data))
+        with self._lock:
+            self._put_locked(asset)
+        return asset
+
+    def _fresh(self, asset: Asset) -> Asset:
+        if not self.auto_reload or not asset.mtime:
+            return asset
+        try:
+            if os.path.getmtime(os.path.join(self.static_dir, asset.name)) == asset.mtime:
+                return asset
+            fresh = self._load(asset.name)
+        except OSError:
+            return asset
+        with self._lock:
+            self._put_locked(fresh)
+        return fresh
+
+    def get(self, name: str) -> Asset | None:
+        with self._lock:
+            asset = self._by_name.get(name)
+        return self._fresh(asset) if asset is not None else None
+
+    def by_url(self, url_name: str) -> Asset | None:
+        with self._lock:
+            return self._by_url.get(url_name)
+
+    def url_name(self, name: str) -> str | None:
+        asset = self.get(name)
+        return asset.url_name if asset is not None else None
@@ -0,0 +1,79 @@
+"""
+Fire concurrent /chat requests while probing /health, report throughput and latency.
+
+    python bench/chat_load.py --url http://127.0.0.1:8000 --concurrency 200 --requests 1000
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def chat_once(url: str, message: str) -> tuple[int, float]:
+    body = json.dumps({"message": message, "history": []}).encode("utf-8")
+    req = urllib.request.Request(f"{url}/chat", data=body, headers={"Content-Type": "application/json"}, method="POST")
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as r:
+            r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - t0
+
+def probe_health(url: str, stop: threading.Event, out: list) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=30) as r:
+                r.read()
+            out.append(time.perf_counter() - t0)
+        except Exception:
+            out.append(float("inf"))
+        time.sleep(0.1)
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--message", default="Was kostet das?")
+    args = ap.parse_args()
+
+    stop = threading.Event()
+    health: list = []
+    prober = threading.Thread(target=probe_health, args=(args.url, stop, health), daemon=True)
+    prober.start()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: chat_once(args.url, args.message), range(args.requests)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    prober.join()
+
+    ok = [dt for st, dt in results if st == 200]
+    codes: dict = {}
+    for st, _ in results:
+        codes[st] = codes.get(st, 0) + 1
+
+    print(f"requests     {args.requests} @ concurrency {args.concurrency} in {elapsed:.1f}s")
+    print(f"throughput   {len(ok) / elapsed:.1f} ok/s   status {codes}")
+    if ok:
+        print(f"chat latency p50 {pct(ok, .5):.2f}s  p99 {pct(ok, .99):.2f}s  mean {statistics.mean(ok):.2f}s")
+    print(f"/health      p50 {pct(health, .5) * 1000:.0f}ms  p99 {pct(health, .99) * 1000:.0f}ms  ({len(health)} probes)")
+
+if __name__ == "__main__":
+    main()
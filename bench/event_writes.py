@@ -0,0 +1,76 @@
+"""
+Sustained event-write throughput: commit-per-row insert_event vs WriteBehind.
+Several processes (like gunicorn workers) with several threads each write
+to one SQLite file for a fixed time.
+
+    python bench/event_writes.py --processes 4 --threads 8 --seconds 5
+"""
+from __future__ import annotations
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import connect, init_db, insert_event, WriteBehind  # noqa: E402
+
+def worker(mode: str, path: str, threads: int, seconds: float, out) -> None:
+    wb = WriteBehind(lambda: connect(path)) if mode == "behind" else None
+    counts = [0] * threads
+    lat: list = []
+    stop_at = time.monotonic() + seconds
+
+    def loop(i: int) -> None:
+        conn = connect(path) if wb is None else None
+        while time.monotonic() < stop_at:
+            t0 = time.perf_counter()
+            if wb is None:
+                insert_event(conn, f"client{i % 5}", "book_demo")
+            else:
+                wb.add_event(f"client{i % 5}", "book_demo")
+            lat.append(time.perf_counter() - t0)
+            counts[i] += 1
+
+    ts = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    if wb is not None:
+        wb.stop()
+    lat.sort()
+    out.put((sum(counts), lat[len(lat) // 2] if lat else 0, lat[int(len(lat) * .99)] if lat else 0))
+
+def run(mode: str, processes: int, threads: int, seconds: float) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    conn = connect(path)
+    init_db(conn)
+    out: mp.Queue = mp.Queue()
+    t0 = time.perf_counter()
+    procs = [mp.Process(target=worker, args=(mode, path, threads, seconds, out)) for _ in range(processes)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - t0
+    stored = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    calls = sum(r[0] for r in results)
+    p50 = max(r[1] for r in results) * 1000
+    p99 = max(r[2] for r in results) * 1000
+    print(f"{mode:7s} {stored / elapsed:10.0f} rows/s   stored {stored}/{calls}   call p50 {p50:.3f}ms  p99 {p99:.3f}ms")
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--processes", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+    for mode in ("sync", "behind"):
+        run(mode, args.processes, args.threads, args.seconds)
+
+if __name__ == "__main__":
+    main()
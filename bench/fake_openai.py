@@ -0,0 +1,140 @@
+"""
+Local stand-in for the OpenAI Responses API with injected latency.
+
+    python bench/fake_openai.py --port 9000 --latency 2.0
+    python bench/fake_openai.py --port 9000 --latency 1.0 --tail-share 0.05 --tail-latency 12   # upstream outliers
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=x gunicorn -c gunicorn.conf.py app:app
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = {
+    "reply": "Klingt gut! Geht es eher um Ads (Google/Meta) oder um Website/Landingpage?",
+    "action": "none",
+    "lead": {"service": "", "timing": "", "budget": "", "email": ""},
+}
+
+ARGS = argparse.Namespace()
+ISSUED: set = set()  # response ids, so previous_response_id can be checked
+
+def response_obj(model: str, text: str) -> dict:
+    rid = f"resp_{random.getrandbits(48):x}"
+    ISSUED.add(rid)
+    return {
+        "id": rid,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": "msg_1",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {
+            "input_tokens": 900,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": 60,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": 960,
+        },
+    }
+
+def latency_for(model: str) -> float:
+    base = ARGS.model_latency.get(model, ARGS.latency)
+    if ARGS.tail_share and random.random() < ARGS.tail_share:
+        base = ARGS.tail_latency  # injected upstream outlier
+    return max(0.0, base + random.uniform(-ARGS.jitter, ARGS.jitter))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = body.get("model") or "fake"
+        text = json.dumps(REPLY, ensure_ascii=False)
+        delay = latency_for(model)
+
+        prev = body.get("previous_response_id")
+        if prev and prev not in ISSUED:
+            payload = json.dumps({"error": {"message": f"Previous response with id '{prev}' not found.",
+                                            "type": "invalid_request_error", "param": "previous_response_id",
+                                            "code": "previous_response_not_found"}}).encode("utf-8")
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if not body.get("stream"):
+            time.sleep(delay)
+            payload = json.dumps(response_obj(model, text)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        ttft = delay * ARGS.ttft_share
+        final = response_obj(model, text)
+        chunks = [text[i:i + 8] for i in range(0, len(text), 8)]
+        step = (delay - ttft) / max(1, len(chunks))
+        try:
+            self._event({"type": "response.created", "sequence_number": 0,
+                         "response": {**final, "status": "in_progress", "output": []}})
+            time.sleep(ttft)
+            for n, chunk in enumerate(chunks, 1):
+                self._event({"type": "response.output_text.delta", "delta": chunk, "item_id": "msg_1",
+                             "output_index": 0, "content_index": 0, "sequence_number": n})
+                time.sleep(step)
+            self._event({"type": "response.completed", "response": final,
+                         "sequence_number": len(chunks) + 1})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled
+        self.close_connection = True
+
+    def _event(self, data: dict) -> None:
+        self.wfile.write(f"event: {data['type']}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+def parse_model_latency(raw: str) -> dict:
+    out = {}
+    for part in filter(None, (raw or "").split(",")):
+        name, _, sec = part.partition("=")
+        out[name.strip()] = float(sec)
+    return out
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--latency", type=float, default=2.0, help="seconds per response")
+    ap.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random jitter")
+    ap.add_argument("--ttft-share", type=float, default=0.3, help="share of latency before the first token (stream)")
+    ap.add_argument("--model-latency", type=parse_model_latency, default={},
+                    help="per-model override, e.g. gpt-5-mini=2.0,gpt-5-nano=0.4")
+    ap.add_argument("--tail-share", type=float, default=0.0, help="share of requests that get --tail-latency")
+    ap.add_argument("--tail-latency", type=float, default=10.0, help="seconds for tail requests")
+    global ARGS
+    ARGS = ap.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", ARGS.port), Handler)
+    server.daemon_threads = True
+    print(f"fake OpenAI on http://127.0.0.1:{ARGS.port}/v1 (latency {ARGS.latency}s)")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
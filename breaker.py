@@ -0,0 +1,268 @@
+from __future__ import annotations
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+class CircuitOpen(Exception):
+    """The upstream is considered down; the call was not attempted."""
+
+def upstream_failure(exc: BaseException) -> bool:
+    """Errors that say something about upstream health (not our own bad requests)."""
+    if isinstance(exc, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500 or exc.status_code in (408, 429)
+    return not isinstance(exc, CircuitOpen)
+
+class Permit:
+    """What allow() hands out; pass it back to record() or release()."""
+
+    __slots__ = ("probe", "started")
+
+    def __init__(self, probe: bool) -> None:
+        self.probe = probe
+        self.started = time.monotonic()
+
+class CircuitBreaker:
+    """
+    Closed -> open when, over the last `window` seconds and at least
+    `min_calls` calls, the failure share reaches `error_rate` or the share
+    of calls slower than `slow_call` seconds reaches `slow_rate`. Open
+    rejects everything for `open_for` seconds, then half-open lets up to
+    `probes` calls through. If they succeed it closes again; one failure
+    reopens it.
+
+    A probe holds its slot until record() or release(). A probe still
+    holding it after `probe_timeout` s is counted as a failure, so a lost
+    caller can't leave the breaker half-open forever.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: float = 30.0, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call: float = 10.0, slow_rate: float = 0.8, open_for: float = 15.0, probes: int = 1,
+                 probe_timeout: float = 30.0) -> None:
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_for = open_for
+        self.probes = max(1, probes)
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._calls: deque = deque()  # (ts, failed, slow)
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._leases: set = set()  # Permits of running probes
+        self._probe_ok = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _trip_locked(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._leases.clear()
+        self._probe_ok = 0
+        self._calls.clear()
+        self.opened += 1
+
+    def _advance_locked(self, now: float) -> None:
+        if self.state == self.OPEN and now - self._opened_at >= self.open_for:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and any(now - p.started >= self.probe_timeout for p in self._leases):
+            self._trip_locked(now)  # a probe that never reported back
+
+    def allow(self) -> Permit | None:
+        """A Permit (truthy) if the call may go upstream, else None."""
+        now = time.monotonic()
+        with self._lock:
+            self._advance_locked(now)
+            if self.state == self.CLOSED:
+                return Permit(False)
+            if self.state == self.HALF_OPEN and len(self._leases) < self.probes:
+                permit = Permit(True)
+                self._leases.add(permit)
+                return permit
+            self.rejected += 1
+            return None
+
+    def is_open(self) -> bool:
+        """Cheap pre-check for callers that want to skip work: True if allow() would reject now."""
+        with self._lock:
+            self._advance_locked(time.monotonic())
+            if self.state == self.OPEN:
+                return True
+            return self.state == self.HALF_OPEN and len(self._leases) >= self.probes
+
+    def release(self, permit: Permit | None) -> None:
+        """The call was abandoned (cancelled, client gone): no verdict, frees a probe slot."""
+        if permit is not None and permit.probe:
+            with self._lock:
+                self._leases.discard(permit)
+
+    def record(self, failed: bool, latency: float, permit: Permit | None = None) -> None:
+        now = time.monotonic()
+        slow = latency >= self.slow_call
+        with self._lock:
+            if permit is not None and permit.probe:
+                if permit not in self._leases:
+                    return  # timed out or the breaker tripped meanwhile
+                self._leases.discard(permit)
+                if failed or slow:
+                    self._trip_locked(now)
+                else:
+                    self._probe_ok += 1
+                    if self._probe_ok >= self.probes:
+                        self.state = self.CLOSED
+                        self._leases.clear()
+                        self._calls.clear()
+                return
+            if self.state != self.CLOSED:
+                return  # late result of a call started before tripping
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            n = len(self._calls)
+            if n < self.min_calls:
+                return
+            failures = sum(1 for c in self._calls if c[1])
+            slows = sum(1 for c in self._calls if c[2])
+            if failures >= self.error_rate * n or slows >= self.slow_rate * n:
+                self._trip_locked(now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            n = len(self._calls)
+            return {
+                "state": self.state,
+                "calls": n,
+                "failures": sum(1 for c in self._calls if c[1]),
+                "slow": sum(1 for c in self._calls if c[2]),
+                "probing": len(self._leases),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+class RetryBudget:
+    """Retries may add at most `ratio` of the call volume (token bucket, per process)."""
+
+    def __init__(self, ratio: float = 0.1, burst: float = 10.0) -> None:
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                self.denied += 1
+                return False
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"ratio": self.ratio, "tokens": round(self._tokens, 2), "retries": self.retries, "denied": self.denied}
+
+class _TrackedStream:
+    """
+    Reports a streamed call's outcome exactly once: done(failed) when it
+    ends or fails, done(None) when it is abandoned — close() by the caller,
+    or the iterating generator closed early (client gone).
+    """
+
+    def __init__(self, stream: Any, done: Callable[[bool | None], None]) -> None:
+        self._stream = stream
+        self._done = done
+        self._closed = False
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def _report(self, outcome: bool | None) -> None:
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+        self._done(outcome)
+
+    def __iter__(self) -> Iterator[Any]:
+        outcome: bool | None = None
+        failed = False
+        try:
+            for ev in self._stream:
+                if ev.type in ("response.failed", "error"):
+                    failed = True
+                yield ev
+            outcome = failed
+        except Exception as e:
+            outcome = upstream_failure(e)
+            raise
+        finally:
+            self._report(None if self._closed else outcome)
+
+    def close(self) -> None:
+        self._closed = True
+        try:
+            self._stream.close()
+        finally:
+            self._report(None)
+
+class GuardedCreate:
+    """
+    responses.create behind a circuit breaker and a shared retry budget.
+    Raises CircuitOpen without calling upstream while the circuit is open.
+    Retryable failures are retried once if the budget allows; the client
+    itself should be built with max_retries=0.
+    """
+
+    def __init__(self, create: Callable[..., Any], breaker: CircuitBreaker, budget: RetryBudget,
+                 backoff: float = 0.3) -> None:
+        self._create = create
+        self.breaker = breaker
+        self.budget = budget
+        self.backoff = backoff
+
+    def __call__(self, **params: Any) -> Any:
+        self.budget.deposit()
+        for attempt in (0, 1):
+            permit = self.breaker.allow()
+            if permit is None:
+                raise CircuitOpen()
+            t0 = time.monotonic()
+            try:
+                result = self._create(**params)
+            except Exception as e:
+                failed = upstream_failure(e)
+                self.breaker.record(failed, time.monotonic() - t0, permit)
+                if failed and attempt == 0 and self.budget.withdraw():
+                    time.sleep(self.backoff * (0.5 + random.random()))
+                    continue
+                raise
+            except BaseException:
+                self.breaker.release(permit)  # e.g. greenlet killed: no verdict
+                raise
+            if params.get("stream"):
+                return _TrackedStream(result, self._stream_done(permit, t0))
+            self.breaker.record(False, time.monotonic() - t0, permit)
+            return result
+        raise AssertionError("unreachable")
+
+    def _stream_done(self, permit: Permit, t0: float) -> Callable[[bool | None], None]:
+        def done(failed: bool | None) -> None:
+            if failed is None:
+                self.breaker.release(permit)
+            else:
+                self.breaker.record(failed, time.monotonic() - t0, permit)
+        return done
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+from db import prompt_version, bump_prompt_version
+from prompts import PromptBundle, compile_prompt_bundle
+
+try:
+    from inotify_simple import INotify, flags  # optional: pip install inotify_simple
+except ImportError:  # pragma: no cover
+    INotify = None
+
+BundleKey = Tuple[str, str, str, str]  # client_id, demo_link, brand_name, layout
+
+class PromptRegistry:
+    """
+    Compiled prompt bundles per (tenant, demo link, brand, layout), LRU-bounded.
+    The hot path is a dict lookup, with no file system calls.
+
+    Bundles are dropped when:
+    - prompt_meta.version moves. bump() from an admin action or
+      ensure_prompt_file; checked at most every poll_interval s.
+    - a file in prompt_dir changes. Detected by inotify when inotify_simple
+      is installed, otherwise by an mtime sweep at most every scan_interval s.
+    """
+
+    def __init__(self, prompt_dir: Path, connect: Callable[[], sqlite3.Connection], max_entries: int = 2048,
+                 poll_interval: float = 1.0, scan_interval: float = 5.0, use_inotify: bool = True) -> None:
+        self.prompt_dir = Path(prompt_dir)
+        self._connect = connect
+        self._conn: sqlite3.Connection | None = None
+        self.max_entries = max(1, max_entries)
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._bundles: "OrderedDict[BundleKey, PromptBundle]" = OrderedDict()
+        self._version = -1
+        self._next_poll = 0.0
+        self._next_scan = 0.0
+        self._mtimes: Dict[str, float] = {}
+        self._gen = 0  # bumped on every invalidation
+        self._watcher: threading.Thread | None = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if use_inotify and INotify is not None:
+            self._start_inotify()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    # --- change detection ---
+    def _start_inotify(self) -> None:
+        try:
+            ino = INotify()
+            mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.CREATE | flags.DELETE
+            ino.add_watch(str(self.prompt_dir), mask)
+        except OSError:
+            return  # e.g. watch limit reached: stay on mtime sweeps
+
+        def watch() -> None:
+            while True:
+                if ino.read():
+                    self.invalidate()
+
+        self._watcher = threading.Thread(target=watch, name="prompt-inotify", daemon=True)
+        self._watcher.start()
+
+    def _scan_mtimes(self) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        try:
+            with os.scandir(self.prompt_dir) as it:
+                for e in it:
+                    if e.name.endswith(".txt"):
+                        out[e.name] = e.stat().st_mtime
+        except OSError:
+            pass
+        return out
+
+    def _check_locked(self) -> None:
+        now = time.monotonic()
+        if now >= self._next_poll:
+            self._next_poll = now + self.poll_interval
+            try:
+                v = prompt_version(self._db())
+            except sqlite3.Error:
+                v = self._version
+            if v != self._version:
+                if self._version >= 0:
+                    self._clear_locked()
+                self._version = v
+        if self._watcher is None and now >= self._next_scan:
+            self._next_scan = now + self.scan_interval
+            mtimes = self._scan_mtimes()
+            if mtimes != self._mtimes:
+                if self._mtimes:
+                    self._clear_locked()
+                self._mtimes = mtimes
+
+    def _clear_locked(self) -> None:
+        self._bundles.clear()
+        self._gen += 1
+        self.invalidations += 1
+
+    # --- public ---
+    def get(self, client_id: str, *, demo_link: str, brand_name: str, layout: str = "stable") -> PromptBundle:
+        key = (client_id, demo_link, brand_name, layout)
+        with self._lock:
+            self._check_locked()
+            bundle = self._bundles.get(key)
+            if bundle is not None:
+                self._bundles.move_to_end(key)
+                self.hits += 1
+                return bundle
+            self.misses += 1
+            gen = self._gen
+        for _attempt in range(3):
+            bundle = compile_prompt_bundle(client_id, demo_link=demo_link, brand_name=brand_name, layout=layout)
+            with self._lock:
+                if self._gen != gen:
+                    # invalidated while compiling: the files read may be stale, compile again
+                    gen = self._gen
+                    continue
+                self._bundles[key] = bundle
+                while len(self._bundles) > self.max_entries:
+                    self._bundles.popitem(last=False)
+                return bundle
+        return bundle  # prompts keep changing: serve the latest compile uncached
+
+    def invalidate(self) -> None:
+        """Drop this process's bundles (others follow via bump())."""
+        with self._lock:
+            self._clear_locked()
+            self._next_scan = 0.0
+
+    def bump(self) -> int:
+        """Invalidate here and, through prompt_meta.version, in every worker."""
+        with self._lock:
+            v = bump_prompt_version(self._db())
+            self._clear_locked()
+            self._version = v
+            self._next_scan = 0.0
+        return v
+
+    def stats(self) -> Dict[str, int | str]:
+        with self._lock:
+            return {
+                "entries": len(self._bundles),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "version": self._version,
+                "watch": "inotify" if self._watcher is not None else "mtime",
+            }
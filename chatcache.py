@@ -0,0 +1,127 @@
+from __future__ import annotations
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+_WS = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", (text or "").strip()).casefold()
+
+def cache_key(client_id: str, model: str, prompt: str, input_items: List[Dict[str, str]]) -> str:
+    """Key on tenant + model + prompt bundle hash + normalized conversation."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    items = [[i.get("role", ""), normalize_text(i.get("content", ""))] for i in input_items]
+    raw = json.dumps([client_id, model, prompt_hash, items], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class _Flight:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Dict[str, Any] | None = None
+        self.error: BaseException | None = None
+
+class ResponseCache:
+    """
+    LRU + TTL cache for parsed model replies with single-flight coalescing:
+    concurrent identical requests wait for the first one's upstream call
+    instead of making their own. Errors are never cached.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 600.0, wait_timeout: float = 25.0) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, client_id: str, what: str) -> None:
+        c = self._counters.setdefault(client_id, {"hit": 0, "miss": 0, "coalesced": 0})
+        c[what] += 1
+
+    def _get_locked(self, key: str) -> Dict[str, Any] | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, _client_id, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: str, client_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            value = self._get_locked(key)
+            self._count(client_id, "hit" if value is not None else "miss")
+        return copy.deepcopy(value) if value is not None else None
+
+    def put(self, key: str, client_id: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, client_id, copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_compute(
+        self, key: str, client_id: str, compute: Callable[[], Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], str]:
+        """Returns (value, "hit" | "miss" | "coalesced")."""
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self._count(client_id, "hit")
+                return copy.deepcopy(value), "hit"
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            self._count(client_id, "miss" if leader else "coalesced")
+
+        if not leader:
+            if flight.event.wait(self.wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return copy.deepcopy(flight.value), "coalesced"
+            return compute(), "miss"  # leader is stuck; don't wait forever
+
+        try:
+            value = compute()
+            flight.value = value
+            self.put(key, client_id, value)
+            return copy.deepcopy(value), "miss"
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_client = {cid: dict(c) for cid, c in self._counters.items()}
+            entries = len(self._data)
+            inflight = len(self._inflight)
+        hits = sum(c["hit"] for c in by_client.values())
+        coalesced = sum(c["coalesced"] for c in by_client.values())
+        misses = sum(c["miss"] for c in by_client.values())
+        total = hits + coalesced + misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "inflight": inflight,
+            "hits": hits,
+            "misses": misses,
+            "coalesced": coalesced,
+            "hit_ratio": round((hits + coalesced) / total, 4) if total else 0.0,
+            "by_client": by_client,
+        }
@@ -0,0 +1,173 @@
+from __future__ import annotations
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from db import update_chat_summary
+
+# rough chars-per-token for mixed German/English chat text; errs on the high side
+CHARS_PER_TOKEN = 3.5
+MESSAGE_OVERHEAD = 4  # role + framing tokens per input item
+
+FACT_LABELS = (("service", "Service"), ("budget", "Budget"), ("timing", "Timing"), ("email", "E-Mail"))
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text or "") / CHARS_PER_TOKEN) + 1
+
+def items_tokens(items: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(i.get("content", "")) + MESSAGE_OVERHEAD for i in items)
+
+def merge_facts(facts: Dict[str, str], lead: Any) -> Dict[str, str]:
+    """Qualification facts the model extracted so far; later non-empty values win."""
+    out = dict(facts or {})
+    if isinstance(lead, dict):
+        for key, _label in FACT_LABELS:
+            v = lead.get(key)
+            if isinstance(v, str) and v.strip():
+                out[key] = v.strip()[:200]
+    return out
+
+def extractive_summary(previous: str, folded: List[Dict[str, str]], max_chars: int) -> str:
+    """
+    Cheap local summary: the previous summary plus the visitor's own words
+    from the folded turns (assistant turns are mostly questions back).
+    Over max_chars, lines are dropped from the middle: the first statements
+    usually carry service/budget/timing, the latest ones the current topic.
+    """
+    lines = previous.splitlines() if previous else []
+    for item in folded:
+        if item.get("role") == "user":
+            lines.append("- Besucher: " + " ".join(item.get("content", "").split())[:300])
+    while len(lines) > 3 and sum(len(l) + 1 for l in lines) > max_chars:
+        del lines[2]
+    return "\n".join(lines)[:max_chars]
+
+class HistoryCompactor:
+    """
+    Keeps a session's model input under a token budget. When instructions +
+    summary + history + the new message would exceed `budget`, the oldest
+    turns are folded into the session's rolling summary (never the last
+    `keep_items`). The summary and the extracted lead facts go upstream as one
+    developer message ahead of the remaining history, so service/budget/
+    timing survive even after the turns that mentioned them are gone.
+    """
+
+    def __init__(self, budget: int, keep_items: int = 4, summary_chars: int = 1200,
+                 summarizer: "ModelSummarizer | None" = None, low_water: float = 0.75) -> None:
+        self.budget = budget
+        self.low_water = low_water
+        self.keep_items = keep_items
+        self.summary_chars = summary_chars
+        self.summarizer = summarizer
+
+    def context_item(self, session: Any) -> Dict[str, str] | None:
+        if not session.summary:
+            return None  # nothing folded yet: the facts are still in history
+        facts = [f"{label}: {session.facts[key]}" for key, label in FACT_LABELS if session.facts.get(key)]
+        parts = ["Bisheriges Gespräch (zusammengefasst):"]
+        if facts:
+            parts.append("Bereits bekannt — " + "; ".join(facts))
+        parts.append(session.summary)
+        return {"role": "developer", "content": "\n".join(parts)}
+
+    def input_items(self, session: Any) -> List[Dict[str, str]]:
+        ctx = self.context_item(session)
+        return ([ctx] if ctx else []) + session.history
+
+    def compact(self, session: Any, instructions_tokens: int, message: str) -> bool:
+        """
+        Once the input exceeds the budget, fold old turns until it is below
+        low_water * budget, so folds (and summarizer calls) happen every few
+        turns rather than on every one. True if anything was folded.
+        """
+        fixed = instructions_tokens + estimate_tokens(message) + MESSAGE_OVERHEAD
+        previous = session.summary
+        folded: List[Dict[str, str]] = []
+
+        def size() -> int:
+            # counts the summary the folded turns will grow into, not the current one
+            if folded:
+                session.summary = extractive_summary(previous, folded, self.summary_chars)
+            return fixed + items_tokens(self.input_items(session))
+
+        if size() <= self.budget:
+            return False
+        target = int(self.budget * self.low_water)
+        while len(session.history) > self.keep_items and size() > target:
+            # fold in user+assistant pairs so the remaining history starts cleanly
+            n = 2 if len(session.history) - self.keep_items >= 2 else 1
+            folded.extend(session.history[:n])
+            session.history = session.history[n:]
+        session.summary = previous
+        if not folded:
+            return False
+        self.fold(session, folded)
+        return True
+
+    def fold(self, session: Any, folded: List[Dict[str, str]]) -> None:
+        """Merge turns that left session.history into the rolling summary."""
+        previous = session.summary
+        session.summary = extractive_summary(previous, folded, self.summary_chars)
+        session.summary_gen += 1
+        session.response_id = None  # upstream chain still holds the long context
+        if self.summarizer is not None:
+            # submitted by submit_pending() once the new summary_gen is saved
+            pending = session.pending_fold
+            if pending is not None:
+                previous, folded = pending[1], pending[2] + folded
+            session.pending_fold = (session.summary_gen, previous, folded)
+
+    def submit_pending(self, session: Any) -> None:
+        pending, session.pending_fold = session.pending_fold, None
+        if pending is not None and self.summarizer is not None:
+            self.summarizer.submit(session.id, session.client_id, *pending)
+
+class ModelSummarizer:
+    """
+    Replaces the extractive summary with one written by a (cheaper) model,
+    in the background. The result is stored on the session row only if no
+    newer fold happened meanwhile (summary_gen), so a slow summary never
+    overwrites a fresher one.
+    """
+
+    INSTRUCTIONS = (
+        "Fasse das bisherige Gespräch zwischen Website-Besucher und Sales-Assistent knapp zusammen "
+        "(max. 6 Stichpunkte, Deutsch). Behalte alles zur Qualifizierung: gewünschter Service, "
+        "Budget, Timing, Firma/Branche, Einwände, nächste Schritte. Keine Floskeln."
+    )
+
+    def __init__(self, create: Callable[..., Any], connect: Callable[[], sqlite3.Connection], model: str,
+                 max_chars: int = 1200, workers: int = 2) -> None:
+        self._create = create
+        self._connect = connect
+        self.model = model
+        self.max_chars = max_chars
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarizer")
+        self._local = threading.local()
+        self.done = 0
+        self.failed = 0
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def submit(self, session_id: str, client_id: str, gen: int, previous: str, folded: List[Dict[str, str]]) -> None:
+        self._pool.submit(self._run, session_id, client_id, gen, previous, list(folded))
+
+    def _run(self, session_id: str, client_id: str, gen: int, previous: str, folded: List[Dict[str, str]]) -> None:
+        convo = "\n".join(f"{i['role']}: {i['content']}" for i in folded)
+        text = f"Bisherige Zusammenfassung:\n{previous}\n\nNeue Turns:\n{convo}" if previous else convo
+        try:
+            resp = self._create(model=self.model, instructions=self.INSTRUCTIONS, input=text, max_output_tokens=250)
+            summary = (resp.output_text or "").strip()[: self.max_chars]
+            if summary:
+                update_chat_summary(self._db(), session_id, client_id, gen, summary)
+            self.done += 1
+        except Exception:
+            self.failed += 1  # keep the extractive summary
+
+    def stop(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
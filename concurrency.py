@@ -0,0 +1,75 @@
+from __future__ import annotations
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+class ModelBusy(Exception):
+    """No model slot is free and the wait queue is full or timed out."""
+
+class ModelGate:
+    """
+    Caps how many model calls one process has in flight.
+
+    Up to max_waiting requests beyond the cap wait up to queue_timeout
+    seconds for a slot; everything else is rejected right away, so request
+    threads/greenlets stay free for cheap routes (/config, /widget.js,
+    /health) instead of piling up behind the upstream. Works with gthread
+    and gevent workers (gevent patches the threading primitives).
+    Low-priority calls (priority=False, e.g. a conversation's first turn)
+    never queue: under load they are shed first.
+    """
+
+    def __init__(self, limit: int, queue_timeout: float, max_waiting: int = 0) -> None:
+        self.limit = max(1, limit)
+        self.queue_timeout = max(0.0, queue_timeout)
+        self.max_waiting = max(0, max_waiting)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self, priority: bool = True) -> None:
+        if self._sem.acquire(blocking=False):
+            with self._lock:
+                self.in_flight += 1
+            return
+        with self._lock:
+            if not priority or self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise ModelBusy()
+            self.waiting += 1
+        try:
+            ok = self._sem.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not ok:
+            with self._lock:
+                self.rejected += 1
+            raise ModelBusy()
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._sem.release()
+
+    @contextmanager
+    def slot(self, priority: bool = True) -> Iterator[None]:
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "max_waiting": self.max_waiting,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+            }
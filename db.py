@@ -1,8 +1,15 @@
 # db.py
 from __future__ import annotations
+import json
+import os
+import queue
 import sqlite3
+import threading
 import time
-from typing import Any, Dict, List
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from tracing import span
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS leads (
@@ -35,6 +42,8 @@ CREATE INDEX IF NOT EXISTS idx_billing_session ON billing_accounts(stripe_sessio
 
 CREATE INDEX IF NOT EXISTS idx_leads_ts ON leads(ts DESC);
 CREATE INDEX IF NOT EXISTS idx_leads_client ON leads(client_id);
+CREATE INDEX IF NOT EXISTS idx_leads_ts_id ON leads(ts, id);
+CREATE INDEX IF NOT EXISTS idx_leads_client_ts ON leads(client_id, ts, id);
 
 CREATE TABLE IF NOT EXISTS events (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -46,10 +55,81 @@ CREATE TABLE IF NOT EXISTS events (
 CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts DESC);
 CREATE INDEX IF NOT EXISTS idx_events_client ON events(client_id);
 CREATE INDEX IF NOT EXISTS idx_events_event ON events(event);
+
+-- tenant configs (formerly clients.json); version = tenant_meta.config_version at last write
+CREATE TABLE IF NOT EXISTS tenants (
+  client_id TEXT PRIMARY KEY,
+  config TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  updated_ts INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_tenants_version ON tenants(version);
+
+CREATE TABLE IF NOT EXISTS tenant_meta (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  config_version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO tenant_meta (id, config_version) VALUES (1, 0);
+
+-- bumped whenever prompt files change, so every worker drops its compiled bundles
+CREATE TABLE IF NOT EXISTS prompt_meta (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO prompt_meta (id, version) VALUES (1, 0);
+
+-- lead notifications waiting for the delivery worker (kind: email | email_digest | webhook)
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL,
+  client_id TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  target TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_ts INTEGER NOT NULL,
+  locked_until INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_ts);
+
+-- per-day counts maintained on every event/lead write (event = event name, or 'lead')
+CREATE TABLE IF NOT EXISTS daily_rollup (
+  client_id TEXT NOT NULL,
+  day TEXT NOT NULL,
+  event TEXT NOT NULL,
+  c INTEGER NOT NULL,
+  PRIMARY KEY (client_id, day, event)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_rollup_day ON daily_rollup(day, event);
+
+-- server-side chat sessions; data = JSON state owned by sessions.py (history, response id, ...)
+CREATE TABLE IF NOT EXISTS chat_sessions (
+  id TEXT PRIMARY KEY,
+  client_id TEXT NOT NULL,
+  data TEXT NOT NULL,
+  updated INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions(updated);
+
+-- admission control, one shared token bucket per key ("c:<client>", "ip:<addr>") as a
+-- GCRA theoretical arrival time: the bucket is full again at tat (unix seconds)
+CREATE TABLE IF NOT EXISTS admission_buckets (
+  key TEXT PRIMARY KEY,
+  tat REAL NOT NULL,
+  updated INTEGER NOT NULL
+);
 """
 
-def connect(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+def connect(db_path: str, readonly: bool = False, cached_statements: int = 128) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, cached_statements=cached_statements)
     conn.row_factory = sqlite3.Row
 
     # Better concurrency / fewer locks
@@ -57,9 +137,87 @@ def connect(db_path: str) -> sqlite3.Connection:
     conn.execute("PRAGMA busy_timeout=5000;")     # wait 5s if locked
     conn.execute("PRAGMA journal_mode=WAL;")      # WAL helps multi-read/write
     conn.execute("PRAGMA synchronous=NORMAL;")
+    if readonly:
+        conn.execute("PRAGMA query_only=ON;")
 
     return conn
 
+class ConnectionPool:
+    """
+    Per-process pool of long-lived, pre-configured connections, with
+    separate read-write and read-only (query_only) handles.
+
+    acquire() hands out an idle connection (pinging it first if it sat idle
+    longer than check_after seconds) or opens a new one; release() rolls back
+    anything left open and keeps up to `size` connections per kind.
+    """
+
+    def __init__(self, db_path: str, size: int = 8, cached_statements: int = 128, check_after: float = 30.0) -> None:
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.cached_statements = cached_statements
+        self.check_after = check_after
+        self._lock = threading.Lock()
+        self._idle: Dict[bool, List[Tuple[float, sqlite3.Connection]]] = {False: [], True: []}
+        self.opened = 0
+        self.reused = 0
+        self.replaced = 0
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        self.opened += 1
+        return connect(self.db_path, readonly=readonly, cached_statements=self.cached_statements)
+
+    def acquire(self, readonly: bool = False) -> sqlite3.Connection:
+        while True:
+            with self._lock:
+                if not self._idle[readonly]:
+                    break
+                last_used, conn = self._idle[readonly].pop()
+            if time.monotonic() - last_used < self.check_after:
+                self.reused += 1
+                return conn
+            try:
+                conn.execute("SELECT 1").fetchone()
+                self.reused += 1
+                return conn
+            except sqlite3.Error:
+                self.replaced += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+        return self._open(readonly)
+
+    def release(self, conn: sqlite3.Connection, readonly: bool = False) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle[readonly]) < self.size:
+                self._idle[readonly].append((time.monotonic(), conn))
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle = self._idle[False] + self._idle[True]
+            self._idle = {False: [], True: []}
+        for _ts, conn in idle:
+            conn.close()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "idle_rw": len(self._idle[False]),
+                "idle_ro": len(self._idle[True]),
+                "opened": self.opened,
+                "reused": self.reused,
+                "replaced": self.replaced,
+            }
+
 def init_db(conn: sqlite3.Connection, retries: int = 12, base_sleep: float = 0.15) -> None:
     for i in range(retries):
         try:
@@ -73,12 +231,44 @@ def init_db(conn: sqlite3.Connection, retries: int = 12, base_sleep: float = 0.1
             raise
     raise sqlite3.OperationalError("database is locked (init_db)")
 
-def insert_event(conn: sqlite3.Connection, client_id: str, event: str) -> None:
-    conn.execute(
-        "INSERT INTO events (ts, client_id, event) VALUES (?, ?, ?)",
-        (int(time.time()), client_id, event),
+LEAD_EVENT = "lead"
+
+def _day(ts: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))  # same as date(ts,'unixepoch')
+
+def _bump_rollup(conn: sqlite3.Connection, counts: Counter) -> None:
+    conn.executemany(
+        """
+        INSERT INTO daily_rollup (client_id, day, event, c) VALUES (?, ?, ?, ?)
+        ON CONFLICT (client_id, day, event) DO UPDATE SET c = c + excluded.c
+        """,
+        [(cid, day, ev, n) for (cid, day, ev), n in counts.items()],
+    )
+
+def _write_events(conn: sqlite3.Connection, rows: List[Tuple[int, str, str]]) -> None:
+    conn.executemany("INSERT INTO events (ts, client_id, event) VALUES (?, ?, ?)", rows)
+    _bump_rollup(conn, Counter((cid, _day(ts), ev) for ts, cid, ev in rows))
+
+def _write_lead(conn: sqlite3.Connection, lead: Dict[str, Any]) -> int:
+    cur = conn.execute(
+        """
+        INSERT INTO leads (ts, client_id, email, service, timing, budget, source, conversation)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (lead["ts"], lead["client_id"], lead["email"], lead.get("service", ""), lead.get("timing", ""),
+         lead.get("budget", ""), lead.get("source", "chat"), lead.get("conversation", "")),
+    )
+    conn.executemany(
+        "INSERT INTO outbox (ts, client_id, kind, target, payload, next_attempt_ts) VALUES (?, ?, ?, ?, ?, ?)",
+        [(lead["ts"], lead["client_id"], kind, target, json.dumps(payload, ensure_ascii=False), due)
+         for kind, target, payload, due in lead.get("outbox", ())],
     )
-    conn.commit()
+    _bump_rollup(conn, Counter([(lead["client_id"], _day(lead["ts"]), LEAD_EVENT)]))
+    return int(cur.lastrowid)
+
+def insert_event(conn: sqlite3.Connection, client_id: str, event: str) -> None:
+    with span("db_event"), conn:
+        _write_events(conn, [(int(time.time()), client_id, event)])
 
 def insert_lead(
     conn: sqlite3.Connection,
@@ -89,148 +279,607 @@ def insert_lead(
     budget: str = "",
     source: str = "chat",
     conversation: str = "",
-) -> None:
-    conn.execute(
-        """
-        INSERT INTO leads (ts, client_id, email, service, timing, budget, source, conversation)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (int(time.time()), client_id, email, service, timing, budget, source, conversation),
-    )
-    conn.commit()
+    outbox: Iterable[Tuple[str, str, Dict[str, Any], int]] = (),
+) -> int:
+    """
+    Insert a lead plus its notifications (kind, target, payload, due_ts) in
+    one transaction, so a committed lead always has its deliveries queued.
+    """
+    lead = {
+        "ts": int(time.time()), "client_id": client_id, "email": email, "service": service,
+        "timing": timing, "budget": budget, "source": source, "conversation": conversation,
+        "outbox": list(outbox),
+    }
+    with span("db_lead"), conn:
+        return _write_lead(conn, lead)
 
-def list_leads(conn: sqlite3.Connection, limit: int = 200) -> List[Dict[str, Any]]:
-    cur = conn.execute(
-        "SELECT id, ts, client_id, email, service, timing, budget, source FROM leads ORDER BY ts DESC LIMIT ?",
-        (limit,),
-    )
-    return [dict(r) for r in cur.fetchall()]
+class WriteBehind:
+    """
+    Per-process write-behind queue for events (and optionally leads).
 
-def stats(conn: sqlite3.Connection) -> Dict[str, Any]:
-    lead_count = conn.execute("SELECT COUNT(*) AS c FROM leads").fetchone()["c"]
-    event_counts = conn.execute(
-        "SELECT event, COUNT(*) AS c FROM events GROUP BY event"
-    ).fetchall()
+    A background thread flushes whatever arrived within flush_interval
+    seconds, up to max_batch rows, with executemany in one transaction —
+    one commit/fsync per batch instead of per row. When the queue is full,
+    callers wait up to put_timeout and then write the row themselves
+    (backpressure). stop() drains the queue; call it on worker shutdown.
 
-    by_client = conn.execute(
-        """
-        SELECT client_id,
-          SUM(CASE WHEN event='book_demo' THEN 1 ELSE 0 END) AS book_demo,
-          SUM(CASE WHEN event='collect_email' THEN 1 ELSE 0 END) AS collect_email,
-          COUNT(*) AS total_events
-        FROM events
-        GROUP BY client_id
-        ORDER BY total_events DESC
-        """
-    ).fetchall()
+    A batch that fails is retried row by row, so one bad row doesn't sink
+    the rest. Events that still fail are counted in `lost`. Leads are
+    never dropped: they are held and retried with every later batch, and
+    at stop() whatever is still held goes to spill_path, which the next
+    WriteBehind on that path picks up again.
+    """
 
-    return {
-        "leads_total": int(lead_count),
-        "events": {r["event"]: int(r["c"]) for r in event_counts},
-        "by_client": [dict(r) for r in by_client],
-    }
+    _STOP = object()
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        flush_interval: float = 0.05,
+        max_batch: int = 500,
+        max_queue: int = 10000,
+        put_timeout: float = 0.5,
+        observe: Callable[[float], None] | None = None,
+        spill_path: str | None = None,
+    ) -> None:
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self.observe = observe  # seconds per written batch, e.g. for metrics
+        self.max_batch = max(1, max_batch)
+        self.put_timeout = put_timeout
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_queue))
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.spill_path = spill_path
+        self._held: List[Dict[str, Any]] = []  # leads whose write failed
+        self._held_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.overflow = 0
+        self.errors = 0  # failed batches (rows then went one by one)
+        self.lost = 0    # event rows that could not be written at all
+        self._load_spill()
+
+    def add_event(self, client_id: str, event: str) -> None:
+        self._put(("event", (int(time.time()), client_id, event)))
+
+    def add_lead(self, lead: Dict[str, Any]) -> None:
+        lead = dict(lead)
+        lead.setdefault("ts", int(time.time()))
+        self._put(("lead", lead))
+
+    def _put(self, item: Tuple[str, Any]) -> None:
+        self._ensure_started()
+        try:
+            self._q.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self.overflow += 1
+            self._write([item])
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def _tx(self, events: List[Tuple[int, str, str]], leads: List[Dict[str, Any]], retries: int) -> None:
+        """One transaction; lock contention is retried, any other error raised."""
+        for i in range(retries):
+            try:
+                with self._db_lock:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    with self._conn:
+                        if events:
+                            _write_events(self._conn, events)
+                        for lead in leads:
+                            _write_lead(self._conn, lead)
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e).lower() or i == retries - 1:
+                    raise
+                time.sleep(0.05 * (i + 1))
+
+    def _reset_conn(self) -> None:
+        with self._db_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _write(self, items: List[Tuple[str, Any]], retries: int = 8) -> None:
+        if self._held:
+            self._retry_held()
+        events = [x for kind, x in items if kind == "event"]
+        leads = [x for kind, x in items if kind == "lead"]
+        t0 = time.perf_counter()
+        try:
+            self._tx(events, leads, retries)
+        except Exception:
+            self.errors += 1
+            self._reset_conn()
+            self._write_rows(items, retries)
+            return
+        self.batches += 1
+        self.rows += len(items)
+        if self.observe is not None:
+            self.observe(time.perf_counter() - t0)
+
+    def _write_rows(self, items: List[Tuple[str, Any]], retries: int) -> None:
+        for kind, x in items:
+            try:
+                self._tx([x] if kind == "event" else [], [x] if kind == "lead" else [], retries)
+                self.rows += 1
+            except Exception:
+                if kind == "lead":
+                    with self._held_lock:
+                        self._held.append(x)
+                else:
+                    self.lost += 1
+
+    def _retry_held(self) -> None:
+        with self._held_lock:
+            held, self._held = self._held, []
+        self._write_rows([("lead", lead) for lead in held], retries=1)
+
+    def _load_spill(self) -> None:
+        if not self.spill_path:
+            return
+        claimed = f"{self.spill_path}.{os.getpid()}"
+        try:
+            os.replace(self.spill_path, claimed)  # another worker may race us for it
+        except FileNotFoundError:
+            return
+        with open(claimed, encoding="utf-8") as f:
+            self._held.extend(json.loads(line) for line in f if line.strip())
+        os.remove(claimed)
+
+    def _spill(self) -> None:
+        with self._held_lock:
+            held, self._held = self._held, []
+        if not held:
+            return
+        if not self.spill_path:
+            self._held = held
+            return
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for lead in held:
+                f.write(json.dumps(lead, ensure_ascii=False) + "\n")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Tuple[str, Any]] = []
+            try:
+                item = self._q.get()
+                if item is self._STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        nxt = self._q.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if nxt is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(nxt)
+                self._write(batch)
+            except Exception:
+                # keep the flusher alive whatever happens; the batch's leads are
+                # retried with the next one (at least once), its events are lost
+                self.errors += 1
+                leads = [x for kind, x in batch if kind == "lead"]
+                with self._held_lock:
+                    self._held.extend(leads)
+                self.lost += len(batch) - len(leads)
 
-def list_leads(conn: sqlite3.Connection, limit: int = 200, client_id: str | None = None) -> List[Dict[str, Any]]:
+    def flush(self) -> None:
+        """Write everything queued so far from the calling thread."""
+        items = []
+        while True:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                items.append(item)
+        for i in range(0, len(items), self.max_batch):
+            self._write(items[i:i + self.max_batch])
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._q.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self.flush()
+        if self._held:
+            self._retry_held()
+        self._spill()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "queued": self._q.qsize(),
+            "batches": self.batches,
+            "rows": self.rows,
+            "overflow": self.overflow,
+            "errors": self.errors,
+            "lost": self.lost,
+            "held_leads": len(self._held),
+        }
+
+LEAD_COLUMNS = ("id", "ts", "client_id", "email", "service", "timing", "budget", "source")
+
+def leads_page(
+    conn: sqlite3.Connection,
+    limit: int = 200,
+    client_id: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    before: Tuple[int, int] | None = None,
+    q: str = "",
+    include_conversation: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    One page of leads, newest first, keyset-paginated on (ts, id): pass the
+    (ts, id) of the last row as `before` to get the next page. since is
+    inclusive, until exclusive (unix seconds). q matches email/service.
+    """
+    cols = LEAD_COLUMNS + (("conversation",) if include_conversation else ())
+    where: List[str] = []
+    args: List[Any] = []
     if client_id:
-        cur = conn.execute(
-            "SELECT id, ts, client_id, email, service, timing, budget, source FROM leads WHERE client_id=? ORDER BY ts DESC LIMIT ?",
-            (client_id, limit),
-        )
-    else:
-        cur = conn.execute(
-            "SELECT id, ts, client_id, email, service, timing, budget, source FROM leads ORDER BY ts DESC LIMIT ?",
-            (limit,),
-        )
-    return [dict(r) for r in cur.fetchall()]
+        where.append("client_id=?")
+        args.append(client_id)
+    if since is not None:
+        where.append("ts >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("ts < ?")
+        args.append(until)
+    if before is not None:
+        where.append("(ts, id) < (?, ?)")
+        args.extend(before)
+    if q:
+        where.append("(email LIKE ? ESCAPE '\\' OR service LIKE ? ESCAPE '\\')")
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        args.extend([pattern, pattern])
+    sql = f"SELECT {', '.join(cols)} FROM leads"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+    args.append(limit)
+    return [dict(r) for r in conn.execute(sql, args).fetchall()]
+
+def iter_leads(conn: sqlite3.Connection, page_size: int = 1000, **filters: Any) -> Iterator[Dict[str, Any]]:
+    """All matching leads, newest first, one page in memory at a time."""
+    before = None
+    while True:
+        rows = leads_page(conn, limit=page_size, before=before, **filters)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        before = (rows[-1]["ts"], rows[-1]["id"])
 
 def stats(conn: sqlite3.Connection, client_id: str | None = None) -> Dict[str, Any]:
+    """All-time totals, read from daily_rollup."""
     if client_id:
-        lead_count = conn.execute("SELECT COUNT(*) AS c FROM leads WHERE client_id=?", (client_id,)).fetchone()["c"]
-        event_counts = conn.execute(
-            "SELECT event, COUNT(*) AS c FROM events WHERE client_id=? GROUP BY event",
+        rows = conn.execute(
+            "SELECT event, SUM(c) AS c FROM daily_rollup WHERE client_id=? GROUP BY event",
             (client_id,),
         ).fetchall()
     else:
-        lead_count = conn.execute("SELECT COUNT(*) AS c FROM leads").fetchone()["c"]
-        event_counts = conn.execute(
-            "SELECT event, COUNT(*) AS c FROM events GROUP BY event"
-        ).fetchall()
+        rows = conn.execute("SELECT event, SUM(c) AS c FROM daily_rollup GROUP BY event").fetchall()
 
+    counts = {r["event"]: int(r["c"]) for r in rows}
+    lead_count = counts.pop(LEAD_EVENT, 0)
     return {
-        "leads_total": int(lead_count),
-        "events": {r["event"]: int(r["c"]) for r in event_counts},
+        "leads_total": lead_count,
+        "events": counts,
     }
 
-def kpi(conn: sqlite3.Connection, days: int = 7, client_id: str | None = None) -> Dict[str, Any]:
-    """
-    Daily counts for last N days.
-    """
-    # leads per day
+def _since_day(days: int) -> str:
+    """First UTC day of the last `days` calendar days, today included."""
+    return _day(int(time.time()) - max(0, days - 1) * 86400)
+
+def _daily(conn: sqlite3.Connection, event: str, days: int, client_id: str | None) -> List[Dict[str, Any]]:
     if client_id:
-        leads_rows = conn.execute(
+        rows = conn.execute(
             """
-            SELECT date(ts,'unixepoch') AS d, COUNT(*) AS c
-            FROM leads
-            WHERE client_id=? AND ts >= strftime('%s','now') - (? * 86400)
-            GROUP BY d
+            SELECT day AS d, c FROM daily_rollup
+            WHERE client_id=? AND event=? AND day >= ?
             ORDER BY d ASC
             """,
-            (client_id, days),
+            (client_id, event, _since_day(days)),
         ).fetchall()
-
-        demo_rows = conn.execute(
+    else:
+        rows = conn.execute(
             """
-            SELECT date(ts,'unixepoch') AS d, COUNT(*) AS c
-            FROM events
-            WHERE client_id=? AND event='book_demo' AND ts >= strftime('%s','now') - (? * 86400)
+            SELECT day AS d, SUM(c) AS c FROM daily_rollup
+            WHERE event=? AND day >= ?
             GROUP BY d
             ORDER BY d ASC
             """,
-            (client_id, days),
+            (event, _since_day(days)),
         ).fetchall()
-    else:
-        leads_rows = conn.execute(
+    return [{"d": r["d"], "c": int(r["c"])} for r in rows]
+
+def kpi(conn: sqlite3.Connection, days: int = 7, client_id: str | None = None) -> Dict[str, Any]:
+    """
+    Daily counts for last N days.
+    """
+    return {
+        "days": days,
+        "leads_daily": _daily(conn, LEAD_EVENT, days, client_id),
+        "book_demo_daily": _daily(conn, "book_demo", days, client_id),
+    }
+
+def funnel(conn: sqlite3.Connection, client_id: str, days: int = 7) -> Dict[str, Any]:
+    rows = conn.execute(
+        "SELECT event, SUM(c) AS c FROM daily_rollup WHERE client_id=? AND day >= ? GROUP BY event",
+        (client_id, _since_day(days)),
+    ).fetchall()
+    counts = {r["event"]: int(r["c"]) for r in rows}
+    return {
+        "days": days,
+        "leads": counts.get(LEAD_EVENT, 0),
+        "book_demo": counts.get("book_demo", 0),
+        "collect_email": counts.get("collect_email", 0),
+    }
+
+def rebuild_rollups(conn: sqlite3.Connection) -> int:
+    """Recompute daily_rollup from events + leads (backfill after upgrade, or repair)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM daily_rollup")
+        conn.execute(
             """
-            SELECT date(ts,'unixepoch') AS d, COUNT(*) AS c
-            FROM leads
-            WHERE ts >= strftime('%s','now') - (? * 86400)
-            GROUP BY d
-            ORDER BY d ASC
+            INSERT INTO daily_rollup (client_id, day, event, c)
+            SELECT client_id, date(ts,'unixepoch'), event, COUNT(*) FROM events GROUP BY 1, 2, 3
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO daily_rollup (client_id, day, event, c)
+            SELECT client_id, date(ts,'unixepoch'), ?, COUNT(*) FROM leads GROUP BY 1, 2
+            ON CONFLICT (client_id, day, event) DO UPDATE SET c = c + excluded.c
             """,
-            (days,),
-        ).fetchall()
+            (LEAD_EVENT,),
+        )
+        n = conn.execute("SELECT COUNT(*) FROM daily_rollup").fetchone()[0]
+        conn.commit()
+        return int(n)
+    except BaseException:
+        conn.rollback()
+        raise
 
-        demo_rows = conn.execute(
+def rollups_missing(conn: sqlite3.Connection) -> bool:
+    """True if there is history but no rollup rows yet (DB from before daily_rollup)."""
+    if conn.execute("SELECT 1 FROM daily_rollup LIMIT 1").fetchone():
+        return False
+    return bool(
+        conn.execute("SELECT 1 FROM events LIMIT 1").fetchone()
+        or conn.execute("SELECT 1 FROM leads LIMIT 1").fetchone()
+    )
+
+# ---------- tenants ----------
+def _bump_config_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute(
+        "UPDATE tenant_meta SET config_version = config_version + 1 WHERE id=1 RETURNING config_version"
+    ).fetchone()[0])
+
+def config_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT config_version FROM tenant_meta WHERE id=1").fetchone()
+    return int(row[0]) if row else 0
+
+def prompt_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT version FROM prompt_meta WHERE id=1").fetchone()
+    return int(row[0]) if row else 0
+
+def bump_prompt_version(conn: sqlite3.Connection) -> int:
+    with conn:
+        return int(conn.execute("UPDATE prompt_meta SET version = version + 1 WHERE id=1 RETURNING version").fetchone()[0])
+
+def get_tenant(conn: sqlite3.Connection, client_id: str) -> Tuple[int, Dict[str, Any]] | None:
+    with span("db_tenant"):
+        row = conn.execute("SELECT version, config FROM tenants WHERE client_id=?", (client_id,)).fetchone()
+    if row is None:
+        return None
+    return int(row["version"]), json.loads(row["config"])
+
+def list_tenants(conn: sqlite3.Connection) -> List[Tuple[str, Dict[str, Any]]]:
+    rows = conn.execute("SELECT client_id, config FROM tenants ORDER BY client_id").fetchall()
+    return [(r["client_id"], json.loads(r["config"])) for r in rows]
+
+def changed_tenants(conn: sqlite3.Connection, since_version: int) -> List[str]:
+    rows = conn.execute("SELECT client_id FROM tenants WHERE version > ?", (since_version,)).fetchall()
+    return [r["client_id"] for r in rows]
+
+def insert_tenant(conn: sqlite3.Connection, client_id: str, config: Dict[str, Any]) -> bool:
+    """Returns False if the tenant already exists."""
+    try:
+        with conn:
+            v = _bump_config_version(conn)
+            conn.execute(
+                "INSERT INTO tenants (client_id, config, version, updated_ts) VALUES (?, ?, ?, ?)",
+                (client_id, json.dumps(config, ensure_ascii=False), v, int(time.time())),
+            )
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def update_tenant(
+    conn: sqlite3.Connection, client_id: str, mutate: Callable[[Dict[str, Any]], str | None]
+) -> str | None:
+    """
+    Read-modify-write one tenant under the write lock. `mutate` edits the
+    config in place and returns an error message to abort. Returns the error
+    (or "client not found"), None on success.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT config FROM tenants WHERE client_id=?", (client_id,)).fetchone()
+        if row is None:
+            conn.rollback()
+            return "client not found"
+        cfg = json.loads(row["config"])
+        err = mutate(cfg)
+        if err:
+            conn.rollback()
+            return err
+        v = _bump_config_version(conn)
+        conn.execute(
+            "UPDATE tenants SET config=?, version=?, updated_ts=? WHERE client_id=?",
+            (json.dumps(cfg, ensure_ascii=False), v, int(time.time()), client_id),
+        )
+        conn.commit()
+        return None
+    except BaseException:
+        conn.rollback()
+        raise
+
+def import_tenants(conn: sqlite3.Connection, data: Dict[str, Any], replace: bool = False) -> int:
+    """One-shot import of a clients.json dict. Existing tenants are kept unless replace=True."""
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    now = int(time.time())
+    with conn:
+        v = _bump_config_version(conn)
+        cur = conn.executemany(
+            f"{verb} INTO tenants (client_id, config, version, updated_ts) VALUES (?, ?, ?, ?)",
+            [(cid, json.dumps(cfg, ensure_ascii=False), v, now) for cid, cfg in data.items() if isinstance(cfg, dict)],
+        )
+    return cur.rowcount
+
+def tenant_count(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("SELECT COUNT(*) FROM tenants").fetchone()[0])
+
+
+# ---------- outbox ----------
+def claim_outbox(conn: sqlite3.Connection, limit: int = 50, lease_seconds: int = 120) -> List[Dict[str, Any]]:
+    """
+    Lease up to `limit` due rows for this worker. Leased rows are invisible
+    to other workers until lease_seconds pass (e.g. the worker died).
+    """
+    now = int(time.time())
+    with conn:
+        rows = conn.execute(
             """
-            SELECT date(ts,'unixepoch') AS d, COUNT(*) AS c
-            FROM events
-            WHERE event='book_demo' AND ts >= strftime('%s','now') - (? * 86400)
-            GROUP BY d
-            ORDER BY d ASC
+            UPDATE outbox SET locked_until = ?, attempts = attempts + 1
+            WHERE id IN (
+              SELECT id FROM outbox
+              WHERE status='pending' AND next_attempt_ts <= ? AND locked_until <= ?
+              ORDER BY next_attempt_ts, id LIMIT ?
+            )
+            RETURNING id, ts, client_id, kind, target, payload, attempts
             """,
-            (days,),
+            (now + lease_seconds, now, now, limit),
         ).fetchall()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["payload"] = json.loads(d["payload"])
+        out.append(d)
+    out.sort(key=lambda d: d["id"])
+    return out
 
-    return {
-        "days": days,
-        "leads_daily": [dict(r) for r in leads_rows],
-        "book_demo_daily": [dict(r) for r in demo_rows],
-    }
+def outbox_done(conn: sqlite3.Connection, ids: List[int]) -> None:
+    with conn:
+        conn.executemany("UPDATE outbox SET status='sent', locked_until=0 WHERE id=?", [(i,) for i in ids])
 
-def funnel(conn: sqlite3.Connection, client_id: str, days: int = 7) -> Dict[str, Any]:
-    leads = conn.execute(
-        "SELECT COUNT(*) AS c FROM leads WHERE client_id=? AND ts >= strftime('%s','now') - (?*86400)",
-        (client_id, days),
-    ).fetchone()["c"]
-
-    demos = conn.execute(
-        "SELECT COUNT(*) AS c FROM events WHERE client_id=? AND event='book_demo' AND ts >= strftime('%s','now') - (?*86400)",
-        (client_id, days),
-    ).fetchone()["c"]
-
-    emails = conn.execute(
-        "SELECT COUNT(*) AS c FROM events WHERE client_id=? AND event='collect_email' AND ts >= strftime('%s','now') - (?*86400)",
-        (client_id, days),
-    ).fetchone()["c"]
-
-    return {"days": days, "leads": int(leads), "book_demo": int(demos), "collect_email": int(emails)}
\ No newline at end of file
+def outbox_retry(conn: sqlite3.Connection, ids: List[int], error: str, next_ts: int, max_attempts: int) -> None:
+    """Schedule another attempt, or mark failed once max_attempts is used up."""
+    with conn:
+        conn.executemany(
+            """
+            UPDATE outbox SET
+              status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+              next_attempt_ts = ?, locked_until = 0, last_error = ?
+            WHERE id=?
+            """,
+            [(max_attempts, next_ts, error[:500], i) for i in ids],
+        )
+
+def outbox_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    rows = conn.execute("SELECT status, COUNT(*) AS c FROM outbox GROUP BY status").fetchall()
+    return {r["status"]: int(r["c"]) for r in rows}
+
+# ---------- chat sessions ----------
+def get_chat_session(conn: sqlite3.Connection, session_id: str, client_id: str, min_updated: int) -> Dict[str, Any] | None:
+    with span("db_session"):
+        row = conn.execute(
+            "SELECT data FROM chat_sessions WHERE id=? AND client_id=? AND updated >= ?",
+            (session_id, client_id, min_updated),
+        ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def save_chat_session(conn: sqlite3.Connection, session_id: str, client_id: str, data: Dict[str, Any]) -> None:
+    with span("db_session_save"), conn:
+        conn.execute(
+            """
+            INSERT INTO chat_sessions (id, client_id, data, updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated = excluded.updated
+            WHERE chat_sessions.client_id = excluded.client_id
+            """,
+            (session_id, client_id, json.dumps(data, ensure_ascii=False, separators=(",", ":")), int(time.time())),
+        )
+
+def update_chat_summary(conn: sqlite3.Connection, session_id: str, client_id: str, gen: int, summary: str) -> bool:
+    """Set the session's summary unless a newer fold (summary_gen) happened meanwhile."""
+    with conn:
+        cur = conn.execute(
+            """
+            UPDATE chat_sessions SET data = json_set(data, '$.summary', ?)
+            WHERE id=? AND client_id=? AND json_extract(data, '$.summary_gen') = ?
+            """,
+            (summary, session_id, client_id, gen),
+        )
+    return cur.rowcount > 0
+
+def purge_chat_sessions(conn: sqlite3.Connection, before: int) -> int:
+    with conn:
+        return conn.execute("DELETE FROM chat_sessions WHERE updated < ?", (before,)).rowcount
+
+def sync_admission_buckets(
+    conn: sqlite3.Connection, deltas: Dict[str, Tuple[int, float]], keys: Iterable[str], now: float
+) -> Dict[str, float]:
+    """
+    Charge this worker's consumption (key -> (tokens, rate)) and return the
+    shared tat of every key in `keys`, all in one transaction.
+    """
+    out: Dict[str, float] = {}
+    with conn:
+        for key, (n, rate) in deltas.items():
+            out[key] = conn.execute(
+                """
+                INSERT INTO admission_buckets (key, tat, updated) VALUES (:key, :now + :cost, :ts)
+                ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :cost, updated = :ts
+                RETURNING tat
+                """,
+                {"key": key, "now": now, "cost": n / rate, "ts": int(now)},
+            ).fetchone()[0]
+        rest = [k for k in keys if k not in out]
+        for i in range(0, len(rest), 500):
+            out.update(admission_tats(conn, rest[i:i + 500]))
+    return out
+
+def admission_tats(conn: sqlite3.Connection, keys: List[str]) -> Dict[str, float]:
+    rows = conn.execute(
+        f"SELECT key, tat FROM admission_buckets WHERE key IN ({','.join('?' * len(keys))})", keys
+    ).fetchall()
+    return {r["key"]: r["tat"] for r in rows}
+
+def purge_admission_buckets(conn: sqlite3.Connection, before: float) -> int:
+    with conn:
+        return conn.execute("DELETE FROM admission_buckets WHERE tat < ?", (before,)).rowcount
@@ -0,0 +1,254 @@
+from __future__ import annotations
+import http.client
+import json
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from db import claim_outbox, outbox_done, outbox_retry
+
+class SmtpSender:
+    """One long-lived SMTP session (STARTTLS + login once), reopened when it drops or sits idle."""
+
+    def __init__(self, host: str, port: int, user: str, password: str, sender: str,
+                 timeout: float = 10.0, idle_timeout: float = 60.0) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._conn: smtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.host and self.sender)
+
+    def _open(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        conn.starttls()
+        if self.user and self.password:
+            conn.login(self.user, self.password)
+        return conn
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._conn is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        if self._conn is None:
+            self._conn = self._open()
+        return self._conn
+
+    def send(self, to_addr: str, subject: str, body: str) -> None:
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = to_addr
+        msg["Subject"] = subject
+        msg.set_content(body)
+        try:
+            self._connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # stale session: reconnect once, then let the caller retry later
+            self.close()
+            self._connection().send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception:
+                pass
+
+class WebhookSender:
+    """Keep-alive HTTP(S) connections per host for webhook POSTs."""
+
+    def __init__(self, timeout: float = 5.0) -> None:
+        self.timeout = timeout
+        self._conns: Dict[Tuple[str, str], http.client.HTTPConnection] = {}
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        key = (scheme, netloc)
+        conn = self._conns.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = self._conns[key] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def post(self, url: str, payload: Dict[str, Any]) -> None:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError(f"bad webhook url: {url!r}")
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        for attempt in (1, 2):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("POST", path, body=data, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.will_close:
+                    self._drop(parts.scheme, parts.netloc)
+                if resp.status >= 400:
+                    raise RuntimeError(f"webhook HTTP {resp.status}")
+                return
+            except (http.client.HTTPException, ConnectionError, OSError):
+                # server closed a kept-alive connection: retry once on a fresh one
+                self._drop(parts.scheme, parts.netloc)
+                if attempt == 2:
+                    raise
+
+    def _drop(self, scheme: str, netloc: str) -> None:
+        conn = self._conns.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self) -> None:
+        for key in list(self._conns):
+            self._drop(*key)
+
+def digest_due(now: int, minutes: int) -> int:
+    """End of the current digest window."""
+    window = max(1, minutes) * 60
+    return (now // window + 1) * window
+
+class DeliveryWorker:
+    """
+    Drains the outbox in a background thread. Several workers (one per
+    gunicorn process, or a standalone `flask deliver-outbox`) can run at
+    once; rows are leased in claim_outbox so each is sent once. Failed
+    sends are retried with exponential backoff until max_attempts.
+    email_digest rows due together are sent as one mail per (tenant, address).
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        smtp: SmtpSender,
+        webhooks: WebhookSender | None = None,
+        poll_interval: float = 2.0,
+        batch_size: int = 50,
+        max_attempts: int = 8,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+        observe: Callable[[str, float, bool], None] | None = None,
+    ) -> None:
+        self._connect = connect
+        self.smtp = smtp
+        self.webhooks = webhooks or WebhookSender()
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.observe = observe  # (kind, seconds, ok) per send, e.g. for metrics
+        self._conn: sqlite3.Connection | None = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.sent = 0
+        self.failed = 0
+        self.errors = 0  # rounds that failed outside a send (DB errors, bugs)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _reset_db(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _backoff(self, attempts: int) -> int:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(0, attempts - 1))
+        return int(time.time() + delay * random.uniform(0.8, 1.2))
+
+    def _deliver(self, kind: str, target: str, rows: List[Dict[str, Any]]) -> None:
+        if kind == "webhook":
+            self.webhooks.post(target, rows[0]["payload"])
+        elif kind == "email":
+            p = rows[0]["payload"]
+            self.smtp.send(target, p["subject"], p["body"])
+        elif kind == "email_digest":
+            client_id = rows[0]["client_id"]
+            subject = f"[NeuraPilot] {len(rows)} neue Lead(s): {client_id}"
+            body = "\n\n----------------------------------------\n\n".join(r["payload"]["body"] for r in rows)
+            self.smtp.send(target, subject, body)
+        else:
+            raise ValueError(f"unknown outbox kind {kind!r}")
+
+    def run_once(self) -> int:
+        """Claim and deliver one batch; returns the number of rows handled."""
+        conn = self._db()
+        rows = claim_outbox(conn, limit=self.batch_size)
+        groups: Dict[Tuple[str, str, str, int], List[Dict[str, Any]]] = {}
+        for r in rows:
+            # digests group per tenant+address, everything else goes out one by one
+            gid = 0 if r["kind"] == "email_digest" else r["id"]
+            groups.setdefault((r["kind"], r["client_id"], r["target"], gid), []).append(r)
+
+        for (kind, _client_id, target, _gid), items in groups.items():
+            ids = [r["id"] for r in items]
+            t0 = time.monotonic()
+            try:
+                self._deliver(kind, target, items)
+                if self.observe is not None:
+                    self.observe(kind, time.monotonic() - t0, True)
+                outbox_done(conn, ids)
+                self.sent += len(ids)
+            except Exception as e:
+                if self.observe is not None:
+                    self.observe(kind, time.monotonic() - t0, False)
+                if kind != "webhook":
+                    self.smtp.close()
+                attempts = max(r["attempts"] for r in items)
+                outbox_retry(conn, ids, f"{type(e).__name__}: {e}", self._backoff(attempts), self.max_attempts)
+                self.failed += len(ids)
+        return len(rows)
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                n = self.run_once()
+            except sqlite3.OperationalError:
+                n = 0  # locked/busy: try again next round
+            except Exception:
+                # anything else must not end the loop (thread or `flask deliver-outbox`):
+                # count it, start over with a fresh connection after poll_interval
+                self.errors += 1
+                self._reset_db()
+                n = 0
+            if n < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="outbox-delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.smtp.close()
+        self.webhooks.close()
@@ -0,0 +1,46 @@
+# gunicorn.conf.py — `gunicorn -c gunicorn.conf.py app:app`
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+
+# "gthread" (default): every request gets a thread, model calls are capped by
+#   MODEL_MAX_CONCURRENCY so a few threads always stay free for cheap routes.
+# "gevent": cooperative greenlets, hundreds of model calls in flight per process
+#   (needs `pip install gevent`).
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+if worker_class == "gthread":
+    # running + queued model calls and /chat requests waiting in admission all
+    # hold a thread; together they must leave `reserve` free for /config,
+    # /widget.js, /health
+    reserve = int(os.getenv("GUNICORN_FREE_THREADS", "8"))
+    max_queue = int(os.environ.setdefault("MODEL_MAX_QUEUE", "4"))
+    max_waiting = int(os.environ.setdefault("ADMISSION_MAX_WAITING", "8")) if os.getenv("ADMISSION", "1") == "1" else 0
+    os.environ.setdefault("MODEL_MAX_CONCURRENCY", str(max(1, threads - reserve - max_queue - max_waiting)))
+else:
+    os.environ.setdefault("MODEL_MAX_CONCURRENCY", str(max(1, worker_connections - 100)))
+    os.environ.setdefault("MODEL_MAX_QUEUE", "50")
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+def on_starting(server):
+    # counters start at zero with a fresh master; files of the last run's workers go
+    from metrics import clear_dir
+    db_path = os.getenv("DB_PATH", "neurapilot.sqlite3")
+    clear_dir(os.getenv("METRICS_DIR", db_path + ".metrics"))
+
+def post_worker_init(worker):
+    # pick up outbox rows left over from before a restart without waiting for the next lead
+    from app import start_delivery_worker
+    start_delivery_worker()
+
+def worker_exit(server, worker):
+    # flush queued write-behind rows before the worker goes away
+    from app import metrics, write_behind
+    write_behind.stop()
+    metrics.flush()  # its counters stay in the merged totals
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import copy
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+from prompts import resolve_placeholders
+
+# Only short, single-topic messages are answered locally; anything longer or
+# combining several questions ("was kostet das und wie lange dauert es") goes
+# to the model.
+MAX_WORDS = 12
+_MULTI = re.compile(r"\b(und|aber|oder|wenn|falls|vergleich\w*|unterschied\w*|and|but|or|if|vs)\b")
+_NORM = re.compile(r"[^\w€$%-]+")
+
+PRICING_RE = re.compile(r"\b(preis\w*|kosten|kostet|pricing|prices?|tarif\w*|pakete?|plans?|was zahl\w*)\b")
+DEMO_RE = re.compile(r"\b(demo|termin\w*|buchen|book\w*|call|meeting|kalender|calendly|calendar)\b")
+
+def _normalize(text: str) -> str:
+    return " ".join(_NORM.sub(" ", (text or "").casefold()).split())
+
+def _pricing_reply(plans: List[Dict[str, Any]], demo_link: str) -> str:
+    lines = ["Unsere Pakete:"]
+    for p in plans:
+        line = f"- {p.get('name', '')}: {p.get('price', '')}{p.get('period', '')}".rstrip()
+        items = [str(i) for i in p.get("items") or []]
+        if items:
+            line += f" ({', '.join(items)})"
+        lines.append(line)
+    lines.append(f"Welches passt am ehesten? Oder wir klären es in 10 Minuten: {demo_link}")
+    return "\n".join(lines)
+
+class IntentMatcher:
+    """
+    Deterministic answers compiled from one tenant config: pricing from
+    `pricing`, booking from `links.demo` and the tenant's own `faq` entries
+    ({"keywords": [...], "answer": "..."}; {{DEMO_LINK}}/{{BRAND_NAME}}
+    are resolved). A message matching more than one intent is left to the
+    model. Replies have the model's {reply, action, lead} shape.
+    """
+
+    def __init__(self, cfg: Dict[str, Any]) -> None:
+        demo_link = cfg.get("links", {}).get("demo", "")
+        brand_name = cfg.get("brand", {}).get("name", "NeuraPilot")
+        self.intents: List[Tuple[str, re.Pattern, Dict[str, Any]]] = []
+
+        for i, faq in enumerate(cfg.get("faq") or []):
+            if not isinstance(faq, dict) or not faq.get("answer"):
+                continue
+            keywords = faq.get("keywords")
+            if not isinstance(keywords, list):
+                continue  # a bare string would turn into one alternative per letter
+            words = [_normalize(str(k)) for k in keywords]
+            words = [re.escape(w) for w in words if w]
+            if not words:
+                continue
+            reply = resolve_placeholders(str(faq["answer"]), demo_link=demo_link, brand_name=brand_name)
+            self._add(f"faq:{faq.get('id') or i}", re.compile(r"\b(" + "|".join(words) + r")\b"), reply,
+                      faq.get("action", "none"))
+
+        if demo_link:
+            self._add("demo", DEMO_RE, f"Klar — hier kannst du direkt einen Termin buchen: {demo_link}", "book_demo")
+        plans = [p for p in cfg.get("pricing") or [] if isinstance(p, dict)]
+        if plans:
+            self._add("pricing", PRICING_RE, _pricing_reply(plans, demo_link), "none")
+
+    def _add(self, name: str, pattern: re.Pattern, reply: str, action: str) -> None:
+        if action not in ("none", "book_demo", "collect_email"):
+            action = "none"
+        self.intents.append((name, pattern, {"reply": reply, "action": action, "lead": {}}))
+
+    def match(self, message: str) -> Tuple[str, Dict[str, Any]] | None:
+        """(intent name, reply dict) for an unambiguous match, else None."""
+        text = _normalize(message)
+        if not text or len(text.split()) > MAX_WORDS or _MULTI.search(text):
+            return None
+        hits = [(name, out) for name, pattern, out in self.intents if pattern.search(text)]
+        if len(hits) != 1:
+            return None
+        name, out = hits[0]
+        return name, copy.deepcopy(out)
+
+class IntentStats:
+    """Per-tenant fast-path counters: answered locally (per intent) vs. passed to the model."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def record(self, client_id: str, intent: str | None) -> None:
+        with self._lock:
+            c = self._counters.setdefault(client_id, {"miss": 0})
+            key = intent or "miss"
+            c[key] = c.get(key, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_client = {cid: dict(c) for cid, c in self._counters.items()}
+        misses = sum(c["miss"] for c in by_client.values())
+        hits = sum(n for c in by_client.values() for k, n in c.items() if k != "miss")
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "by_client": by_client,
+        }
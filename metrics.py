@@ -0,0 +1,259 @@
+from __future__ import annotations
+import bisect
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+# seconds; covers cache hits (ms) up to slow model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+# (name, "counter" | "gauge", help, labels, value) produced by collectors at scrape time
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+_SHARDS = 16
+
+class _Shard:
+    __slots__ = ("lock", "values")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+
+class _Metric:
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labels: Tuple[str, ...]) -> None:
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        with shard.lock:
+            shard.values[key] = shard.values.get(key, 0.0) + amount
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labels: Tuple[str, ...],
+                 buckets: Tuple[float, ...]) -> None:
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)  # le semantics: value <= bound
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        with shard.lock:
+            v = shard.values.get(key)
+            if v is None:
+                v = shard.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+class MetricsRegistry:
+    """
+    Counters and histograms for the hot path plus collectors that turn
+    existing stats objects into samples at scrape time.
+
+    Updates go to one of a few lock-striped shards, picked once per
+    thread (or greenlet), so request threads practically never contend.
+    Each process dumps its merged values to `<dir>/<pid>.json` every
+    flush_interval s; render() merges all files. Counters and histograms
+    of exited workers are kept, their gauges dropped.
+    """
+
+    def __init__(self, dir: str | None = None, flush_interval: float = 5.0) -> None:
+        self.dir = dir
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._shards = [_Shard() for _ in range(_SHARDS)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self._thread: threading.Thread | None = None
+
+    def _shard(self) -> _Shard:
+        i = getattr(self._local, "shard", None)
+        if i is None:
+            i = self._local.shard = next(self._next_shard) % _SHARDS
+        return self._shards[i]
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        m = self._metrics[name] = Counter(self, name, help, labels)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        m = self._metrics[name] = Histogram(self, name, help, labels, buckets)
+        return m
+
+    def collector(self, fn: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+        self._collectors.append(fn)
+        return fn
+
+    # --- per-process snapshot ---
+    def snapshot(self) -> Dict[str, Any]:
+        """{name: {type, help, [buckets], samples: {label json: value}}} for this process."""
+        out: Dict[str, Any] = {}
+        for m in self._metrics.values():
+            entry = out[m.name] = {"type": m.kind, "help": m.help, "samples": {}}
+            if isinstance(m, Histogram):
+                entry["buckets"] = list(m.buckets)
+        for shard in self._shards:
+            with shard.lock:
+                items = list(shard.values.items())
+            for (name, label_values), v in items:
+                m = self._metrics[name]
+                samples = out[name]["samples"]
+                lk = json.dumps(list(zip(m.labels, label_values)))
+                if isinstance(v, list):
+                    cur = samples.get(lk)
+                    samples[lk] = [a + b for a, b in zip(cur, v)] if cur else list(v)
+                else:
+                    samples[lk] = samples.get(lk, 0.0) + v
+        for fn in self._collectors:
+            try:
+                samples = list(fn())
+            except Exception:
+                continue  # a broken collector must not break /metrics
+            for name, kind, help, labels, value in samples:
+                entry = out.setdefault(name, {"type": kind, "help": help, "samples": {}})
+                lk = json.dumps(sorted(labels.items()))
+                entry["samples"][lk] = entry["samples"].get(lk, 0.0) + float(value)
+        return out
+
+    # --- multi-process ---
+    def flush(self) -> None:
+        if not self.dir:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        path = os.path.join(self.dir, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "ts": time.time(), "metrics": self.snapshot()}, f)
+        os.replace(tmp, path)
+
+    def start(self) -> None:
+        if not self.dir or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        def loop() -> None:
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        self._thread = threading.Thread(target=loop, name="metrics-flush", daemon=True)
+        self._thread.start()
+
+    def _all_snapshots(self) -> List[Tuple[bool, Dict[str, Any]]]:
+        """(alive, metrics) for every process, this one freshly computed."""
+        own = os.getpid()
+        out = [(True, self.snapshot())]
+        if not self.dir or not os.path.isdir(self.dir):
+            return out
+        for fn in os.listdir(self.dir):
+            if not fn.endswith(".json"):
+                continue
+            try:
+                pid = int(fn[:-5])
+            except ValueError:
+                continue
+            if pid == own:
+                continue
+            try:
+                with open(os.path.join(self.dir, fn), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            out.append((_alive(pid), data.get("metrics") or {}))
+        return out
+
+    def render(self) -> str:
+        """All processes merged, in Prometheus text format 0.0.4."""
+        merged: Dict[str, Any] = {}
+        for alive, snap in self._all_snapshots():
+            for name, entry in snap.items():
+                if entry["type"] == "gauge" and not alive:
+                    continue
+                m = merged.setdefault(name, {**entry, "samples": {}})
+                for lk, v in entry["samples"].items():
+                    cur = m["samples"].get(lk)
+                    if cur is None:
+                        m["samples"][lk] = v
+                    elif isinstance(v, list):
+                        m["samples"][lk] = [a + b for a, b in zip(cur, v)]
+                    else:
+                        m["samples"][lk] = cur + v
+        lines: List[str] = []
+        for name in sorted(merged):
+            m = merged[name]
+            lines.append(f"# HELP {name} {_escape_help(m['help'])}")
+            lines.append(f"# TYPE {name} {m['type']}")
+            for lk in sorted(m["samples"]):
+                labels = [tuple(p) for p in json.loads(lk)]
+                v = m["samples"][lk]
+                if m["type"] == "histogram":
+                    acc = 0
+                    for bound, n in zip(list(m["buckets"]) + ["+Inf"], v[:-2]):
+                        acc += n
+                        le = bound if bound == "+Inf" else _num(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {acc}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_num(v[-2])}")
+                    lines.append(f"{name}_count{_labels(labels)} {v[-1]}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {_num(v)}")
+        return "\n".join(lines) + "\n"
+
+def clear_dir(path: str) -> None:
+    """Drop all worker files (gunicorn on_starting: a fresh server starts at zero)."""
+    if not os.path.isdir(path):
+        return
+    for fn in os.listdir(path):
+        if fn.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(path, fn))
+            except OSError:
+                pass
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape_label(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(pairs: List[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
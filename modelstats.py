@@ -0,0 +1,54 @@
+from __future__ import annotations
+import threading
+from collections import deque
+from typing import Any, Dict
+
+def _pct(sorted_vals: list, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+class ModelStats:
+    """
+    Per-process upstream usage: call count, input/cached/output tokens and
+    latency percentiles over the last `window` calls. `usage` is the
+    Responses API usage object (or None, e.g. for aborted streams).
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        self._lock = threading.Lock()
+        self._latency: deque = deque(maxlen=window)
+        self._ttft: deque = deque(maxlen=window)
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, latency: float, usage: Any = None, ttft: float | None = None) -> None:
+        details = getattr(usage, "input_tokens_details", None)
+        with self._lock:
+            self.calls += 1
+            self._latency.append(latency)
+            if ttft is not None:
+                self._ttft.append(ttft)
+            if usage is not None:
+                self.input_tokens += int(getattr(usage, "input_tokens", 0) or 0)
+                self.output_tokens += int(getattr(usage, "output_tokens", 0) or 0)
+                self.cached_tokens += int(getattr(details, "cached_tokens", 0) or 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latency)
+            ttft = sorted(self._ttft)
+            out = {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "output_tokens": self.output_tokens,
+            }
+        out["cached_ratio"] = round(out["cached_tokens"] / out["input_tokens"], 4) if out["input_tokens"] else 0.0
+        out["latency_p50"] = round(_pct(lat, 0.50), 4)
+        out["latency_p95"] = round(_pct(lat, 0.95), 4)
+        out["ttft_p50"] = round(_pct(ttft, 0.50), 4)
+        out["ttft_p95"] = round(_pct(ttft, 0.95), 4)
+        return out
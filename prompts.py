@@ -1,10 +1,13 @@
 from __future__ import annotations
 from pathlib import Path
+import hashlib
 import json
 import re
 import time
 from typing import Any, Dict, Tuple
 
+from tracing import span
+
 BASE_DIR = Path(__file__).resolve().parent
 PROMPT_DIR = BASE_DIR / "prompts"
 CLIENTS_PATH = BASE_DIR / "clients.json"
@@ -82,4 +85,60 @@ def load_prompt_bundle(client_id: str, *, demo_link: str, brand_name: str) -> st
         parts.append(_read_text_cached(PROMPT_DIR / "agency_sales.txt"))
 
     full = "\n\n".join(parts)
-    return resolve_placeholders(full, demo_link=demo_link, brand_name=brand_name)
\ No newline at end of file
+    return resolve_placeholders(full, demo_link=demo_link, brand_name=brand_name)
+
+# --- prefix-stable layout ---
+# Shared modules come first and stay byte-identical for every tenant, so the
+# provider's prompt cache can reuse them; everything tenant-specific goes
+# into a trailing section.
+SHARED_MODULES = ("core.txt", "agency_sales.txt")
+TENANT_HEADER = "## Tenant"
+_SHARED_PLACEHOLDERS = {
+    "{{DEMO_LINK}}": "see Tenant section below",
+    "{{BRAND_NAME}}": "see Tenant section below",
+}
+
+class PromptBundle:
+    """Final instructions for one tenant, plus hashes of the whole text and of the shared prefix."""
+
+    __slots__ = ("client_id", "text", "prefix_len", "prefix_hash", "hash", "layout")
+
+    def __init__(self, client_id: str, prefix: str, suffix: str, layout: str) -> None:
+        self.client_id = client_id
+        self.text = prefix + suffix
+        self.prefix_len = len(prefix)
+        self.prefix_hash = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+        self.hash = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
+        self.layout = layout
+
+def shared_prefix() -> str:
+    parts = []
+    for name in SHARED_MODULES:
+        path = PROMPT_DIR / name
+        if path.exists():
+            text = _read_text_cached(path)
+            for ph, ref in _SHARED_PLACEHOLDERS.items():
+                text = text.replace(ph, ref)
+            parts.append(text.strip())
+    return "\n\n".join(parts)
+
+def tenant_section(client_id: str, *, demo_link: str, brand_name: str) -> str:
+    lines = [TENANT_HEADER, f"Brand: {brand_name}", f"Demo link: {demo_link}"]
+    if client_id != "default":
+        p = PROMPT_DIR / f"{client_id}.txt"
+        if p.exists():
+            lines.append("")
+            lines.append(resolve_placeholders(_read_text_cached(p), demo_link=demo_link, brand_name=brand_name))
+    return "\n".join(lines)
+
+def compile_prompt_bundle(client_id: str, *, demo_link: str, brand_name: str, layout: str = "stable") -> PromptBundle:
+    """
+    layout="stable": shared prefix (core + agency module, placeholders
+    pointing at the tenant section) followed by the tenant section.
+    layout="legacy": load_prompt_bundle() as before, no shared prefix.
+    """
+    with span("prompt_compile"):
+        if layout == "legacy":
+            return PromptBundle(client_id, "", load_prompt_bundle(client_id, demo_link=demo_link, brand_name=brand_name), layout)
+        prefix = shared_prefix() + "\n\n"
+        return PromptBundle(client_id, prefix, tenant_section(client_id, demo_link=demo_link, brand_name=brand_name), layout)
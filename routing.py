@@ -0,0 +1,263 @@
+from __future__ import annotations
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List
+
+from modelstats import _pct
+
+_DONE = object()
+
+def parse_routes(raw: str) -> Dict[str, List[str]]:
+    """"default=gpt-5-mini,gpt-5-nano;pro=gpt-5,gpt-5-mini" -> {route: [models]}"""
+    out: Dict[str, List[str]] = {}
+    for part in filter(None, (raw or "").split(";")):
+        name, _, models = part.partition("=")
+        models_list = [m.strip() for m in models.split(",") if m.strip()]
+        if name.strip() and models_list:
+            out[name.strip()] = models_list
+    return out
+
+class RoutedResponse:
+    """What a hedged non-streaming call returns; the fields app.py reads from a Response."""
+
+    __slots__ = ("id", "model", "output_text", "usage")
+
+    def __init__(self, id: str | None, model: str, output_text: str, usage: Any) -> None:
+        self.id = id
+        self.model = model
+        self.output_text = output_text
+        self.usage = usage
+
+class _Attempt:
+    __slots__ = ("model", "started", "events", "stream", "cancelled", "first")
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.started = time.monotonic()
+        self.events: "queue.Queue[Any]" = queue.Queue()
+        self.stream: Any = None
+        self.cancelled = False
+        self.first = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()  # unblocks the reader thread
+            except Exception:
+                pass
+
+class ModelRouter:
+    """
+    Sends a chat turn to an ordered list of models (per tenant or plan).
+
+    With one model, calls pass straight through. With more, the call is
+    streamed upstream and hedged: if the first model hasn't produced a
+    text delta within its hedge delay, the next one is started as well.
+    Whichever delivers a first token first wins and the other stream is
+    closed. An attempt that fails before its first token fails over to the
+    next model at once.
+
+    The hedge delay is the `quantile` of the model's recent time-to-first-
+    token (rolling window), clamped to [min_delay, max_delay]; max_delay
+    until min_samples are in. Hedges are capped at about max_hedge_ratio
+    of calls (token bucket), so a slow upstream doesn't double our load.
+    """
+
+    def __init__(self, create: Callable[..., Any], routes: Dict[str, List[str]], default_model: str,
+                 hedge: bool = True, quantile: float = 0.95, min_delay: float = 0.25, max_delay: float = 6.0,
+                 min_samples: int = 20, max_hedge_ratio: float = 0.1, window: int = 512) -> None:
+        self._create = create
+        self.routes = routes
+        self.default_model = default_model
+        self.hedge = hedge
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.window = window
+        self._lock = threading.Lock()
+        self._ttft: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._hedge_tokens = 1.0
+        self.calls = 0
+        self.hedges = 0
+        self.failovers = 0
+
+    # --- routing ---
+    def models_for(self, cfg: Dict[str, Any]) -> List[str]:
+        """Tenant "models" list, else the route for its "plan", else the default route."""
+        models = cfg.get("models")
+        if isinstance(models, list) and models:
+            return [str(m) for m in models]
+        route = self.routes.get(str(cfg.get("plan") or "")) or self.routes.get("default")
+        return list(route) if route else [self.default_model]
+
+    # --- latency bookkeeping ---
+    def _count(self, model: str, what: str) -> None:
+        c = self._counters.setdefault(model, {"attempts": 0, "wins": 0, "errors": 0, "cancelled": 0})
+        c[what] += 1
+
+    def _record_ttft(self, model: str, ttft: float) -> None:
+        with self._lock:
+            w = self._ttft.get(model)
+            if w is None:
+                w = self._ttft[model] = deque(maxlen=self.window)
+            w.append(ttft)
+
+    def hedge_delay(self, model: str) -> float:
+        with self._lock:
+            w = sorted(self._ttft.get(model) or ())
+        if len(w) < self.min_samples:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, _pct(w, self.quantile)))
+
+    def _take_hedge_token(self) -> bool:
+        with self._lock:
+            if self._hedge_tokens < 1.0:
+                return False
+            self._hedge_tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    # --- calls ---
+    def create(self, models: List[str], **params: Any) -> Any:
+        """responses.create over a route: a Response, or an event iterator with stream=True."""
+        params.pop("model", None)
+        if len(models) == 1:
+            with self._lock:
+                self.calls += 1
+                self._count(models[0], "attempts")
+            return self._create(model=models[0], **params)
+        stream = bool(params.pop("stream", False))
+        events = self._hedged(models, params)
+        return events if stream else self._collect(events)
+
+    def _collect(self, events: Iterator[Any]) -> RoutedResponse:
+        parts: List[str] = []
+        rid, model, usage = None, "", None
+        for ev in events:
+            if ev.type == "response.output_text.delta":
+                parts.append(ev.delta or "")
+            elif ev.type in ("response.created", "response.completed"):
+                rid = ev.response.id
+                model = ev.response.model
+                usage = ev.response.usage or usage
+        return RoutedResponse(rid, model, "".join(parts), usage)
+
+    def _run(self, a: _Attempt, params: Dict[str, Any], ctl: "queue.Queue[Any]") -> None:
+        try:
+            stream = self._create(model=a.model, stream=True, **params)
+            a.stream = stream
+            if a.cancelled:
+                stream.close()
+                return
+            for ev in stream:
+                if a.cancelled:
+                    break
+                if ev.type in ("response.failed", "error") and not a.first:
+                    raise RuntimeError(ev.type)
+                a.events.put(ev)
+                if ev.type == "response.output_text.delta" and not a.first:
+                    a.first = True
+                    self._record_ttft(a.model, time.monotonic() - a.started)
+                    ctl.put((a, None))
+            a.events.put(_DONE)
+            if not a.first:
+                a.first = True  # completed without text: still an answer
+                ctl.put((a, None))
+        except Exception as e:
+            if a.cancelled:
+                return
+            a.events.put(e)
+            if not a.first:
+                ctl.put((a, e))
+
+    def _hedged(self, models: List[str], params: Dict[str, Any]) -> Iterator[Any]:
+        """Picks the winning attempt (raising if all fail), then streams its events."""
+        ctl: "queue.Queue[Any]" = queue.Queue()
+        attempts: List[_Attempt] = []
+
+        def start(i: int) -> None:
+            a = _Attempt(models[i])
+            attempts.append(a)
+            with self._lock:
+                self._count(a.model, "attempts")
+            threading.Thread(target=self._run, args=(a, params, ctl), name="model-attempt", daemon=True).start()
+
+        with self._lock:
+            self.calls += 1
+            self._hedge_tokens = min(10.0, self._hedge_tokens + self.max_hedge_ratio)
+        start(0)
+        deadline = time.monotonic() + self.hedge_delay(models[0]) if self.hedge else None
+        winner: _Attempt | None = None
+        failed: List[_Attempt] = []
+        try:
+            while winner is None:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    a, err = ctl.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = None
+                    if len(attempts) < len(models) and self._take_hedge_token():
+                        start(len(attempts))
+                        deadline = time.monotonic() + self.hedge_delay(attempts[-1].model)
+                    continue
+                if err is None:
+                    winner = a
+                    break
+                failed.append(a)
+                with self._lock:
+                    self._count(a.model, "errors")
+                if len(attempts) < len(models):
+                    with self._lock:
+                        self.failovers += 1
+                    start(len(attempts))
+                elif len(failed) >= len(attempts):
+                    raise err
+        except BaseException:
+            for a in attempts:
+                a.cancel()
+            raise
+        with self._lock:
+            self._count(winner.model, "wins")
+        for a in attempts:
+            if a is winner or a in failed:
+                continue
+            if not a.first:
+                # censored sample: at least this slow, keeps the tail visible
+                self._record_ttft(a.model, time.monotonic() - a.started)
+            with self._lock:
+                self._count(a.model, "cancelled")
+            a.cancel()
+        return self._drain(winner)
+
+    def _drain(self, winner: _Attempt) -> Iterator[Any]:
+        try:
+            while True:
+                ev = winner.events.get()
+                if ev is _DONE:
+                    return
+                if isinstance(ev, BaseException):
+                    raise ev
+                yield ev
+        finally:
+            winner.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {m: dict(c) for m, c in self._counters.items()}
+            out = {"calls": self.calls, "hedges": self.hedges, "failovers": self.failovers,
+                   "routes": self.routes, "hedge": self.hedge}
+        for m, c in models.items():
+            with self._lock:
+                w = sorted(self._ttft.get(m) or ())
+            c["ttft_p50"] = round(_pct(w, 0.50), 4)
+            c["ttft_p95"] = round(_pct(w, 0.95), 4)
+            c["hedge_delay"] = round(self.hedge_delay(m), 4)
+        out["models"] = models
+        return out
@@ -0,0 +1,120 @@
+from __future__ import annotations
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from db import get_chat_session, save_chat_session, purge_chat_sessions
+from compaction import HistoryCompactor, merge_facts
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+class ChatSession:
+    """
+    One conversation's server-side state. `history` is the compact list of
+    {role, content} turns sent to the model; `response_id` is the last
+    Responses API id, for previous_response_id chaining. `summary`,
+    `summary_gen` and `facts` hold what compaction folded out of history.
+    """
+
+    __slots__ = ("id", "client_id", "history", "response_id", "summary", "summary_gen", "facts",
+                 "pending_fold", "is_new")
+
+    def __init__(self, session_id: str, client_id: str, history: List[Dict[str, str]] | None = None,
+                 response_id: str | None = None, is_new: bool = False) -> None:
+        self.id = session_id
+        self.client_id = client_id
+        self.history = history or []
+        self.response_id = response_id
+        self.summary = ""
+        self.summary_gen = 0
+        self.facts: Dict[str, str] = {}
+        self.pending_fold: Tuple[int, str, List[Dict[str, str]]] | None = None  # not persisted
+        self.is_new = is_new
+
+    def to_data(self) -> Dict[str, Any]:
+        return {
+            "history": self.history,
+            "response_id": self.response_id,
+            "summary": self.summary,
+            "summary_gen": self.summary_gen,
+            "facts": self.facts,
+        }
+
+    @classmethod
+    def from_data(cls, session_id: str, client_id: str, data: Dict[str, Any]) -> "ChatSession":
+        s = cls(session_id, client_id, data.get("history") or [], data.get("response_id"))
+        s.summary = data.get("summary") or ""
+        s.summary_gen = int(data.get("summary_gen") or 0)
+        s.facts = data.get("facts") or {}
+        return s
+
+class SessionStore:
+    """
+    Chat sessions in the chat_sessions table, shared by all workers. Clients
+    keep only the opaque id and send just the new message per turn. Sessions
+    idle for longer than ttl are treated as gone; expired rows are purged at
+    most every purge_interval seconds per process. With a compactor, turns
+    beyond max_turns are folded into the summary instead of being dropped.
+    """
+
+    def __init__(self, ttl: int = 7 * 86400, max_turns: int = 12, max_chars: int = 1500,
+                 purge_interval: float = 600.0, compactor: HistoryCompactor | None = None) -> None:
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.purge_interval = purge_interval
+        self.compactor = compactor
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def new(self, client_id: str, history: List[Dict[str, str]] | None = None) -> ChatSession:
+        return ChatSession(secrets.token_urlsafe(18), client_id, list(history or [])[-self.max_turns:], is_new=True)
+
+    def load(self, conn: sqlite3.Connection, session_id: str | None, client_id: str) -> ChatSession | None:
+        """The stored session, or None if the id is unknown, expired or belongs to another tenant."""
+        if not session_id or not _SESSION_ID.match(session_id):
+            return None
+        data = get_chat_session(conn, session_id, client_id, int(time.time()) - self.ttl)
+        if data is None:
+            return None
+        return ChatSession.from_data(session_id, client_id, data)
+
+    def input_items(self, session: ChatSession) -> List[Dict[str, str]]:
+        """History as sent upstream (with the summary message when compacting), without our own flags."""
+        items = session.history if self.compactor is None else self.compactor.input_items(session)
+        return [{"role": i["role"], "content": i["content"]} for i in items]
+
+    def record_turn(self, conn: sqlite3.Connection, session: ChatSession, message: str, reply: str,
+                    response_id: str | None = None, lead: Any = None, degraded: bool = False) -> None:
+        """
+        Append user message + assistant reply, trim to max_turns and persist.
+        degraded=True marks a fallback reply sent while the model was down.
+        """
+        answer: Dict[str, Any] = {"role": "assistant", "content": (reply or "")[: self.max_chars]}
+        if degraded:
+            answer["degraded"] = True
+        history = session.history + [{"role": "user", "content": message[: self.max_chars]}, answer]
+        session.history = history[-self.max_turns:]
+        session.response_id = response_id
+        if self.compactor is not None:
+            session.facts = merge_facts(session.facts, lead)
+            if len(history) > self.max_turns:
+                self.compactor.fold(session, history[: -self.max_turns])
+        save_chat_session(conn, session.id, session.client_id, session.to_data())
+        if self.compactor is not None:
+            self.compactor.submit_pending(session)
+        self._maybe_purge(conn)
+
+    def _maybe_purge(self, conn: sqlite3.Connection) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            purge_chat_sessions(conn, int(time.time()) - self.ttl)
+        except sqlite3.OperationalError:
+            pass  # busy: next time
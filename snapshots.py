@@ -0,0 +1,69 @@
+from __future__ import annotations
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Tuple
+
+class ConfigSnapshot:
+    """
+    One tenant's compiled config: merged dict, browser-safe dict, the
+    serialized /config body and its content hash (used as strong ETag),
+    plus the CSP header for /embed.
+    Treat every field as read-only — snapshots are shared across requests.
+    embed_hosts is the precompiled Referer allow-list (None = no restriction),
+    intents the tenant's fast-path IntentMatcher.
+    """
+
+    __slots__ = ("client_id", "cfg", "public", "body", "etag", "inline_json", "embed_csp", "embed_hosts", "intents")
+
+    def __init__(self, client_id: str, cfg: Dict[str, Any], public: Dict[str, Any], embed_csp: str,
+                 embed_hosts: FrozenSet[str] | None = None, intents: Any = None) -> None:
+        self.client_id = client_id
+        self.cfg = cfg
+        self.public = public
+        self.body = json.dumps(public, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        # same JSON, safe inside <script type="application/json"> (no "</script>", "<!--")
+        self.inline_json = self.body.decode("utf-8").replace("<", "\\u003c")
+        self.embed_csp = embed_csp
+        self.embed_hosts = embed_hosts
+        self.intents = intents
+
+    def host_allowed(self, host: str) -> bool:
+        """host equals an allowed domain or is a subdomain of one."""
+        if self.embed_hosts is None:
+            return True
+        labels = host.split(".")
+        return any(".".join(labels[i:]) in self.embed_hosts for i in range(len(labels)))
+
+class SnapshotRegistry:
+    """
+    Builds snapshots lazily and keeps each one until its version stamp
+    changes. `stamp(client_id)` returns the config versions the snapshot
+    depends on (default + tenant row) and a falsy last element for unknown
+    tenants — those are compiled per call so random ?client= values can't
+    grow the registry.
+    """
+
+    def __init__(self, stamp: Callable[[str], Tuple[int, ...]], compile: Callable[[str], ConfigSnapshot]) -> None:
+        self._stamp = stamp
+        self._compile = compile
+        self._lock = threading.Lock()
+        self._snaps: Dict[str, Tuple[Tuple[int, ...], ConfigSnapshot]] = {}
+
+    def get(self, client_id: str) -> ConfigSnapshot:
+        stamp = self._stamp(client_id)
+        with self._lock:
+            entry = self._snaps.get(client_id)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        snap = self._compile(client_id)
+        if stamp[-1] or client_id == "default":
+            with self._lock:
+                self._snaps[client_id] = (stamp, snap)
+        return snap
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snaps = {}
@@ -44,9 +44,11 @@
   // ---- state ----
   const STORE_KEY = `np_history_${clientId}`;
   const CFG_KEY = `np_cfg_${clientId}`;
+  const SESSION_KEY = `np_session_${clientId}`;
   const CFG_TTL_MS = 10 * 60 * 1000;
 
   let history = [];
+  let sessionId = "";
   let cfg = null;
   let lastLead = {};
 
@@ -77,7 +79,7 @@
   }
 
   function addBubble(role, text) {
-    if (!els.msgs) return;
+    if (!els.msgs) return null;
     const wrap = document.createElement("div");
     wrap.className = `msg msg--${role}`;
 
@@ -88,6 +90,13 @@
     wrap.appendChild(bubble);
     els.msgs.appendChild(wrap);
     scrollToBottom();
+    return bubble;
+  }
+
+  function setBubbleText(bubble, text) {
+    if (!bubble) return;
+    bubble.innerHTML = renderMarkdownLite(text);
+    scrollToBottom();
   }
 
   function setTyping(on) {
@@ -113,6 +122,15 @@
     } catch (_) {}
   }
 
+  // server-side session id: with it, /chat only needs the new message
+  function loadSession() {
+    try { return localStorage.getItem(SESSION_KEY) || ""; } catch (_) { return ""; }
+  }
+
+  function saveSession(id) {
+    try { localStorage.setItem(SESSION_KEY, id); } catch (_) {}
+  }
+
   function loadHistory() {
     try {
       const raw = localStorage.getItem(STORE_KEY);
@@ -130,6 +148,7 @@
   }
 
   // ---- config caching ----
+  // Cached config is used as-is for CFG_TTL_MS, then revalidated with its ETag.
   function loadConfigCache() {
     try {
       const raw = localStorage.getItem(CFG_KEY);
@@ -137,26 +156,51 @@
       const obj = JSON.parse(raw);
       if (!obj || typeof obj !== "object") return null;
       if (!obj.ts || !obj.value) return null;
-      if (Date.now() - obj.ts > CFG_TTL_MS) return null;
-      return obj.value;
+      obj.fresh = Date.now() - obj.ts <= CFG_TTL_MS;
+      return obj;
     } catch (_) {
       return null;
     }
   }
 
-  function saveConfigCache(value) {
+  function saveConfigCache(value, etag) {
     try {
-      localStorage.setItem(CFG_KEY, JSON.stringify({ ts: Date.now(), value }));
+      localStorage.setItem(CFG_KEY, JSON.stringify({ ts: Date.now(), value, etag: etag || "" }));
     } catch (_) {}
   }
 
+  // config rendered into the page by the server (/embed, /) — no round trip
+  function readInlineConfig() {
+    try {
+      const el = document.getElementById("npConfig");
+      if (!el) return null;
+      const value = JSON.parse(el.textContent || "null");
+      if (!value || typeof value !== "object") return null;
+      saveConfigCache(value, el.dataset.etag || "");
+      return value;
+    } catch (_) {
+      return null;
+    }
+  }
+
   async function fetchConfig() {
+    const inline = readInlineConfig();
+    if (inline) return inline;
+
     const cached = loadConfigCache();
-    if (cached) return cached;
+    if (cached && cached.fresh) return cached.value;
+
+    const headers = {};
+    if (cached && cached.etag) headers["If-None-Match"] = `"${cached.etag}"`;
 
-    const res = await fetch(`/config?client=${encodeURIComponent(clientId)}`, { method: "GET" });
+    const res = await fetch(`/config?client=${encodeURIComponent(clientId)}`, { method: "GET", headers });
+    if (res.status === 304 && cached) {
+      saveConfigCache(cached.value, cached.etag);
+      return cached.value;
+    }
     const data = await res.json();
-    saveConfigCache(data);
+    const etag = (res.headers.get("ETag") || "").replace(/^W\//, "").replace(/"/g, "");
+    saveConfigCache(data, etag);
     return data;
   }
 
@@ -292,28 +336,45 @@ function getUtm() {
     setTyping(true);
     if (els.send) els.send.disabled = true;
 
+    const post = (extra) => fetch(`/chat${qs()}`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream, application/json"
+      },
+      body: JSON.stringify(Object.assign({ message: msg, client: clientId, k: widgetKey }, extra))
+    });
+
     try {
-      const res = await fetch(`/chat${qs()}`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          message: msg,
-          history,
-          client: clientId,
-          k: widgetKey
-        })
-      });
+      // no session yet: send what we have (minus the message itself) to seed one
+      const seed = () => ({ history: history.slice(0, -1) });
+      let res = await post(sessionId ? { session: sessionId } : seed());
+      if (res.status === 409 && sessionId) {
+        // the server's copy expired: start a new session from our local history
+        sessionId = "";
+        saveSession("");
+        res = await post(seed());
+      }
 
-      const data = await res.json();
+      const isStream = (res.headers.get("Content-Type") || "").includes("text/event-stream");
+      const data = isStream && res.body ? await readChatStream(res) : await res.json();
       setTyping(false);
 
-      if (!res.ok) {
-        addBubble("assistant", data.reply || "Not allowed / Fehler.");
+      if (!res.ok || data.error) {
+        const text = data.reply || "Not allowed / Fehler.";
+        if (data.bubble) setBubbleText(data.bubble, text);
+        else addBubble("assistant", text);
         return;
       }
 
+      if (data.session && data.session !== sessionId) {
+        sessionId = data.session;
+        saveSession(sessionId);
+      }
+
       const reply = (data.reply || "…").trim();
-      addBubble("assistant", reply);
+      if (data.bubble) setBubbleText(data.bubble, reply);
+      else addBubble("assistant", reply);
       history.push({ role: "assistant", content: reply });
       saveHistory();
 
@@ -339,6 +400,55 @@ function getUtm() {
     }
   }
 
+  // Reads the SSE stream of /chat: "delta" frames grow one bubble,
+  // "done"/"error" carry the final {reply, action, lead}.
+  async function readChatStream(res) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    let text = "";
+    let bubble = null;
+    let result = null;
+
+    while (!result) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+
+      let idx;
+      while ((idx = buf.indexOf("\n\n")) >= 0) {
+        const frame = buf.slice(0, idx);
+        buf = buf.slice(idx + 2);
+
+        let event = "message";
+        let payload = "";
+        for (const line of frame.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) payload += line.slice(5).trim();
+        }
+        let obj = {};
+        try { obj = JSON.parse(payload || "{}"); } catch (_) {}
+
+        if (event === "delta") {
+          text += obj.text || "";
+          if (!bubble) {
+            setTyping(false);
+            bubble = addBubble("assistant", text);
+          } else {
+            setBubbleText(bubble, text);
+          }
+        } else if (event === "done" || event === "error") {
+          result = { ...obj, error: event === "error" };
+          break;
+        }
+      }
+    }
+
+    if (!result) result = { reply: text, action: "none", lead: {}, error: !text };
+    result.bubble = bubble;
+    return result;
+  }
+
   async function submitLead() {
     const email = (els.leadEmail?.value || "").trim().toLowerCase();
     if (!email || !email.includes("@")) {
@@ -389,6 +499,7 @@ function getUtm() {
   async function init() {
     // restore history
     history = loadHistory();
+    sessionId = loadSession();
 
     // render history
     if (els.msgs && history.length > 0) {
@@ -429,13 +540,5 @@ function getUtm() {
     }
   }
 
-  const url = new URL(location.href);
-payload.utm = {
-  source: url.searchParams.get("utm_source") || "",
-  campaign: url.searchParams.get("utm_campaign") || "",
-  adset: url.searchParams.get("utm_adset") || "",
-  content: url.searchParams.get("utm_content") || ""
-};
-
   document.addEventListener("DOMContentLoaded", init);
 })();
\ No newline at end of file
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, List
+
+# JSON escapes that map to a single character
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class ReplyExtractor:
+    """
+    Incrementally pull the top-level "reply" string out of a JSON object
+    while the model is still producing it.
+
+    feed() returns the newly decoded reply text for each chunk; everything
+    else (action, lead, whitespace, code fences) is only kept in the raw buffer
+    so the full text can go through safe_parse_model_json at the end.
+    """
+
+    def __init__(self) -> None:
+        self._raw: List[str] = []
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._uni: str | None = None
+        self._high: int | None = None
+        self._expect_key = False
+        self._is_key = False
+        self._key: List[str] = []
+        self._last_key = ""
+        self._capture = False
+        self.done = False
+
+    def text(self) -> str:
+        return "".join(self._raw)
+
+    def feed(self, chunk: str) -> str:
+        self._raw.append(chunk)
+        out: List[str] = []
+        for ch in chunk:
+            self._step(ch, out)
+        return "".join(out)
+
+    def _emit(self, s: str, out: List[str]) -> None:
+        if self._is_key:
+            self._key.append(s)
+        elif self._capture:
+            out.append(s)
+
+    def _emit_codepoint(self, cp: int, out: List[str]) -> None:
+        if 0xD800 <= cp < 0xDC00:
+            self._high = cp
+            return
+        if 0xDC00 <= cp < 0xE000 and self._high is not None:
+            cp = 0x10000 + ((self._high - 0xD800) << 10) + (cp - 0xDC00)
+        self._high = None
+        self._emit(chr(cp), out)
+
+    def _step(self, ch: str, out: List[str]) -> None:
+        if self._in_str:
+            if self._uni is not None:
+                self._uni += ch
+                if len(self._uni) == 4:
+                    try:
+                        cp = int(self._uni, 16)
+                    except ValueError:
+                        cp = 0xFFFD
+                    self._uni = None
+                    self._emit_codepoint(cp, out)
+                return
+            if self._esc:
+                self._esc = False
+                if ch == "u":
+                    self._uni = ""
+                    return
+                self._emit(_ESCAPES.get(ch, ch), out)
+                return
+            if ch == "\\":
+                self._esc = True
+                return
+            if ch == '"':
+                self._in_str = False
+                if self._is_key:
+                    self._last_key = "".join(self._key)
+                    self._is_key = False
+                elif self._capture:
+                    self._capture = False
+                    self.done = True
+                return
+            self._emit(ch, out)
+            return
+
+        if ch == '"':
+            self._in_str = True
+            self._is_key = self._depth == 1 and self._expect_key
+            self._key = []
+            self._capture = (
+                not self._is_key
+                and not self.done
+                and self._depth == 1
+                and self._last_key == "reply"
+            )
+        elif ch in "{[":
+            self._depth += 1
+            if self._depth == 1:
+                self._expect_key = ch == "{"
+        elif ch in "}]":
+            self._depth = max(0, self._depth - 1)
+        elif self._depth == 1 and ch == ",":
+            self._expect_key = True
+            self._last_key = ""
+        elif self._depth == 1 and ch == ":":
+            self._expect_key = False
@@ -0,0 +1,77 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from db import config_version, changed_tenants, get_tenant
+
+_MISSING: Tuple[int, Dict[str, Any]] = (0, {})
+
+class TenantStore:
+    """
+    Per-process cache of tenant configs from the `tenants` table.
+
+    Entries are loaded on first use and kept until their row changes. Change
+    detection polls tenant_meta.config_version at most every poll_interval
+    seconds; when it moved, only rows with a newer version are dropped.
+    Admin writes in this process call invalidate() so they show up at once.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], poll_interval: float = 1.0) -> None:
+        self._connect = connect
+        self._conn: sqlite3.Connection | None = None
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._version = -1
+        self._next_poll = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _sync_locked(self) -> None:
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_interval
+        conn = self._db()
+        v = config_version(conn)
+        if v == self._version:
+            return
+        if self._version < 0:
+            self._entries.clear()
+        else:
+            for cid in changed_tenants(conn, self._version):
+                self._entries.pop(cid, None)
+            # ids looked up before they existed are cached as missing; drop those too
+            for cid in [c for c, e in self._entries.items() if e is _MISSING]:
+                del self._entries[cid]
+        self._version = v
+
+    def get(self, client_id: str) -> Tuple[int, Dict[str, Any]]:
+        """(version, raw config); version 0 and {} if the tenant doesn't exist."""
+        with self._lock:
+            self._sync_locked()
+            entry = self._entries.get(client_id)
+            if entry is None:
+                entry = get_tenant(self._db(), client_id) or _MISSING
+                if entry is not _MISSING or len(self._entries) < 10000:
+                    self._entries[client_id] = entry
+            return entry
+
+    def config(self, client_id: str) -> Dict[str, Any]:
+        return self.get(client_id)[1]
+
+    def version(self, client_id: str) -> int:
+        return self.get(client_id)[0]
+
+    def invalidate(self, client_id: str | None = None) -> None:
+        with self._lock:
+            if client_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(client_id, None)
+            self._next_poll = 0.0
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect, init_db  # noqa: E402
+
+class FakeClock:
+    """Stand-in for time.monotonic in modules under test."""
+
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def wall():
+    """A second fake clock for time.time (unix seconds)."""
+    return FakeClock(1_000_000.0)
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.sqlite3")
+    conn = connect(path)
+    init_db(conn)
+    conn.close()
+    return path
+
+@pytest.fixture
+def conn(db_path):
+    c = connect(db_path)
+    yield c
+    c.close()
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The Flask app module, imported once against a throwaway DB and a dummy API key."""
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ["DB_PATH"] = str(tmp_path_factory.mktemp("app") / "app.sqlite3")
+    import app
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,118 @@
+import pytest
+
+import admission
+from admission import AdmissionControl, Shed, parse_limit, parse_plans
+from db import connect, sync_admission_buckets
+
+@pytest.fixture
+def clocks(monkeypatch, clock, wall):
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock.advance(seconds)
+        wall.advance(seconds)
+
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    monkeypatch.setattr(admission.time, "time", wall)
+    monkeypatch.setattr(admission.time, "sleep", sleep)
+    return clock, wall, slept
+
+def make(db_path, plans="default=1:3", ip=None, max_wait=0.0, max_waiting=8):
+    adm = AdmissionControl(lambda: connect(db_path), parse_plans(plans), parse_limit(ip) if ip else None,
+                           max_wait=max_wait, max_waiting=max_waiting)
+    adm._ensure_sync = lambda: None  # tests call sync() themselves
+    return adm
+
+def test_parse_limit_and_plans():
+    assert parse_limit("2:20") == (2.0, 20.0)
+    assert parse_limit({"rate": 1}) == (1.0, 1.0)
+    assert parse_limit("x") is None
+    assert parse_limit("off") is None
+    assert parse_plans("default=2:20; pro=10:100;bad=") == {"default": (2.0, 20.0), "pro": (10.0, 100.0)}
+
+def test_tenant_limit_precedence(db_path):
+    adm = make(db_path, plans="default=1:3;pro=5:50;free=0:0")
+    assert adm.tenant_limit({}) == (1.0, 3.0)
+    assert adm.tenant_limit({"plan": "pro"}) == (5.0, 50.0)
+    assert adm.tenant_limit({"plan": "pro", "rate_limit": "2:4"}) == (2.0, 4.0)
+    assert adm.tenant_limit({"plan": "free"}) is None  # rate 0 = unlimited
+
+def test_burst_then_shed_with_retry_after(db_path, clocks):
+    clock, _wall, _slept = clocks
+    adm = make(db_path)
+    for _ in range(3):
+        assert adm.admit("c1", "", {}) == 0.0
+    with pytest.raises(Shed) as e:
+        adm.admit("c1", "", {})
+    assert e.value.reason == "tenant"
+    assert e.value.retry_after == pytest.approx(1.0)
+    clock.advance(1.0)
+    assert adm.admit("c1", "", {}) == 0.0
+    assert adm.stats()["shed"]["tenant"] == 1
+
+def test_short_wait_is_delayed_not_shed(db_path, clocks):
+    _clock, _wall, slept = clocks
+    adm = make(db_path, max_wait=2.0)
+    for _ in range(3):
+        adm.admit("c1", "", {})
+    assert adm.admit("c1", "", {}) == pytest.approx(1.0)
+    assert slept == [pytest.approx(1.0)]
+    assert adm.stats()["delayed"] == 1
+
+def test_wait_beyond_max_wait_is_shed(db_path, clocks):
+    _clock, _wall, slept = clocks
+    adm = make(db_path, plans="default=0.25:1", max_wait=2.0)
+    adm.admit("c1", "", {})
+    with pytest.raises(Shed) as e:
+        adm.admit("c1", "", {})
+    assert e.value.retry_after == pytest.approx(4.0)
+    assert slept == []
+
+def test_waiting_queue_is_bounded(db_path, clocks):
+    adm = make(db_path, max_wait=2.0, max_waiting=0)
+    for _ in range(3):
+        adm.admit("c1", "", {})
+    with pytest.raises(Shed) as e:
+        adm.admit("c1", "", {})
+    assert e.value.reason == "queue"
+
+def test_ip_bucket_spans_tenants(db_path, clocks):
+    adm = make(db_path, plans="default=100:100", ip="1:2")
+    adm.admit("c1", "9.9.9.9", {})
+    adm.admit("c2", "9.9.9.9", {})
+    with pytest.raises(Shed) as e:
+        adm.admit("c3", "9.9.9.9", {})
+    assert e.value.reason == "ip"
+    adm.admit("c3", "8.8.8.8", {})
+
+def test_gcra_tat_arithmetic(conn):
+    assert sync_admission_buckets(conn, {"k": (2, 1.0)}, [], 100.0) == {"k": 102.0}
+    assert sync_admission_buckets(conn, {"k": (1, 1.0)}, [], 101.0) == {"k": 103.0}  # still behind
+    assert sync_admission_buckets(conn, {"k": (1, 2.0)}, [], 200.0) == {"k": 200.5}  # idle: restarts at now
+    assert sync_admission_buckets(conn, {}, ["k", "missing"], 300.0) == {"k": 200.5}
+
+def test_shared_level_limits_a_second_worker(db_path, clocks):
+    a = make(db_path)
+    b = make(db_path)
+    for _ in range(3):
+        a.admit("c1", "", {})
+    a.sync(connect(db_path))
+    with pytest.raises(Shed):
+        b.admit("c1", "", {})  # first sight of c1 in b: starts from the shared (empty) bucket
+
+def test_sync_pulls_other_workers_consumption(db_path, clocks):
+    a = make(db_path)
+    b = make(db_path)
+    b.admit("c1", "", {})  # b knows c1 with 2 tokens left
+    for _ in range(2):
+        a.admit("c1", "", {})  # a saw no shared row yet: full burst
+    a.sync(connect(db_path))
+    b.sync(connect(db_path))
+    with pytest.raises(Shed):
+        b.admit("c1", "", {})
+
+def test_ip_limit_is_off_without_proxy_count(app_module):
+    # behind a proxy without PROXY_COUNT all visitors share remote_addr
+    assert app_module.PROXY_COUNT == 0
+    assert app_module.admission.ip_limit is None
@@ -0,0 +1,86 @@
+import gzip
+import os
+
+import assets
+from assets import Asset, AssetRegistry, compress_variants, minify_js
+
+BIG = b"console.log('hello');\n" * 100
+
+def test_small_files_are_not_compressed():
+    assert compress_variants(b"x" * (assets.MIN_COMPRESS_SIZE - 1)) == {}
+    variants = compress_variants(BIG)
+    assert gzip.decompress(variants["gzip"]) == BIG
+
+def test_variants_that_do_not_shrink_are_dropped():
+    a = Asset("a.js", b"abc", "application/javascript", {"gzip": b"abcdef"})
+    assert list(a.variants) == ["identity"]
+
+def test_pick_prefers_br_then_gzip():
+    a = Asset("app.js", BIG, "application/javascript", {"gzip": b"g", "br": b"b"})
+    assert a.pick("gzip, deflate, br") == ("br", b"b")
+    assert a.pick("gzip;q=1.0, identity") == ("gzip", b"g")
+    assert a.pick("deflate") == ("identity", BIG)
+    assert a.pick("") == ("identity", BIG)
+    assert Asset("app.js", BIG, "text/javascript", {"gzip": b"g"}).pick("br") == ("identity", BIG)
+
+def test_url_name_carries_the_content_hash():
+    a = Asset("js/app.js", BIG, "application/javascript")
+    assert a.url_name == f"js/app.{a.digest}.js"
+    assert Asset("js/app.js", BIG + b"//", "application/javascript").url_name != a.url_name
+
+def test_registry_scans_and_resolves_fingerprinted_names(tmp_path):
+    (tmp_path / "app.js").write_bytes(BIG)
+    (tmp_path / "notes.txt").write_text("skipped")
+    reg = AssetRegistry(str(tmp_path))
+    a = reg.get("app.js")
+    assert a.content_type.endswith("javascript; charset=utf-8")
+    assert reg.url_name("app.js") == a.url_name
+    assert reg.by_url(a.url_name) is a
+    assert reg.get("notes.txt") is None
+    assert set(a.variants) >= {"identity", "gzip"}
+
+def test_fresh_sidecar_wins_stale_one_is_ignored(tmp_path):
+    src = tmp_path / "app.js"
+    src.write_bytes(BIG)
+    side = tmp_path / "app.js.gz"
+    side.write_bytes(b"prebuilt")
+    os.utime(side, (src.stat().st_mtime + 10,) * 2)
+    assert AssetRegistry(str(tmp_path)).get("app.js").variants["gzip"] == b"prebuilt"
+    os.utime(side, (src.stat().st_mtime - 10,) * 2)
+    assert AssetRegistry(str(tmp_path)).get("app.js").variants["gzip"] != b"prebuilt"
+
+def test_auto_reload_picks_up_changes(tmp_path):
+    src = tmp_path / "app.js"
+    src.write_bytes(BIG)
+    reg = AssetRegistry(str(tmp_path), auto_reload=True)
+    old = reg.get("app.js")
+    src.write_bytes(BIG + b"// v2\n")
+    os.utime(src, (old.mtime + 5,) * 2)
+    new = reg.get("app.js")
+    assert new.url_name != old.url_name
+    assert reg.by_url(old.url_name) is None and reg.by_url(new.url_name) is new
+
+def test_add_registers_generated_assets(tmp_path):
+    reg = AssetRegistry(str(tmp_path))
+    a = reg.add("widget.js", BIG, "application/javascript; charset=utf-8")
+    assert reg.get("widget.js") is a and reg.by_url(a.url_name) is a
+
+def test_minify_drops_comments_and_indentation():
+    src = """
+    /* header
+       comment */
+    // line comment
+    function f(a, b) { // trailing after brace
+        var x = a + b; // trailing after semicolon
+        return x;
+    }
+    """
+    assert minify_js(src) == "function f(a, b) {\nvar x = a + b;\nreturn x;\n}\n"
+
+def test_minify_keeps_comment_lookalikes_inside_code():
+    src = 'var url = "https://example.com/x";\nvar re = /a\\/\\/b/;\nvar s = "/* not a comment */";\n'
+    assert minify_js(src) == src
+
+def test_minify_keeps_line_breaks_for_asi():
+    src = "var a = 1\nvar b = 2\n"
+    assert minify_js(src) == src
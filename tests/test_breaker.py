@@ -0,0 +1,179 @@
+import threading
+
+import pytest
+
+import breaker
+from breaker import CircuitBreaker, CircuitOpen, GuardedCreate, RetryBudget
+
+class Ev:
+    def __init__(self, type="response.output_text.delta"):
+        self.type = type
+
+class FakeStream:
+    def __init__(self, n=3, fail_with=None):
+        self.n = n
+        self.fail_with = fail_with
+        self.closed = False
+
+    def __iter__(self):
+        for _ in range(self.n):
+            if self.closed:
+                return
+            yield Ev()
+        if self.fail_with is not None:
+            raise self.fail_with
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def b(monkeypatch, clock):
+    monkeypatch.setattr(breaker.time, "monotonic", clock)
+    return CircuitBreaker(window=30, min_calls=4, error_rate=0.5, slow_call=10, slow_rate=0.8,
+                          open_for=15, probes=1, probe_timeout=30)
+
+def trip(b):
+    for _ in range(4):
+        b.record(True, 0.1, b.allow())
+    assert b.state == b.OPEN
+
+def test_closed_to_open_on_error_rate(b):
+    for failed in (False, True, False):
+        b.record(failed, 0.1, b.allow())
+    assert b.state == b.CLOSED
+    b.record(True, 0.1, b.allow())  # 2 of 4 failed
+    assert b.state == b.OPEN and b.is_open()
+    assert b.allow() is None and b.rejected == 1
+
+def test_opens_on_slow_calls(b):
+    for _ in range(4):
+        b.record(False, 11.0, b.allow())
+    assert b.state == b.OPEN
+
+def test_half_open_probe_success_closes(b, clock):
+    trip(b)
+    clock.advance(15)
+    assert not b.is_open()
+    probe = b.allow()
+    assert probe.probe and b.state == b.HALF_OPEN
+    assert b.is_open()  # the only probe slot is taken
+    assert b.allow() is None
+    b.record(False, 0.1, probe)
+    assert b.state == b.CLOSED and not b.is_open()
+
+def test_half_open_probe_failure_reopens(b, clock):
+    trip(b)
+    clock.advance(15)
+    b.record(True, 0.1, b.allow())
+    assert b.state == b.OPEN and b.opened == 2
+
+def test_late_result_from_before_the_trip_is_ignored(b, clock):
+    early = b.allow()
+    trip(b)
+    clock.advance(15)
+    probe = b.allow()
+    b.record(True, 0.1, early)
+    assert b.state == b.HALF_OPEN
+    b.record(False, 0.1, probe)
+    assert b.state == b.CLOSED
+
+def test_released_probe_frees_the_slot(b, clock):
+    trip(b)
+    clock.advance(15)
+    probe = b.allow()
+    b.release(probe)
+    assert b.state == b.HALF_OPEN and not b.is_open()
+    assert b.allow() is not None
+
+def test_probe_lease_times_out_as_failure(b, clock):
+    trip(b)
+    clock.advance(15)
+    b.allow()  # caller vanishes without record() or release()
+    clock.advance(29)
+    assert b.is_open() and b.state == b.HALF_OPEN
+    clock.advance(1)
+    assert b.is_open() and b.state == b.OPEN
+    clock.advance(15)
+    assert b.allow() is not None  # next probe gets through
+
+def test_results_while_open_are_ignored(b):
+    early = b.allow()
+    trip(b)
+    b.record(False, 0.1, early)
+    assert b.state == b.OPEN and b.snapshot()["calls"] == 0
+
+def guarded(b, create):
+    return GuardedCreate(create, b, RetryBudget(ratio=0, burst=0), backoff=0)
+
+def test_stream_completion_and_failure_are_recorded(b):
+    stream = guarded(b, lambda **p: FakeStream())(stream=True)
+    assert len(list(stream)) == 3
+    assert b.snapshot()["calls"] == 1 and b.snapshot()["failures"] == 0
+
+    stream = guarded(b, lambda **p: FakeStream(fail_with=ConnectionError()))(stream=True)
+    with pytest.raises(ConnectionError):
+        list(stream)
+    assert b.snapshot()["failures"] == 1
+
+@pytest.mark.parametrize("how", ["generator_closed", "stream_closed"])
+def test_abandoned_probe_stream_releases_the_slot(b, clock, how):
+    trip(b)
+    clock.advance(15)
+    stream = guarded(b, lambda **p: FakeStream(n=100))(stream=True)
+    it = iter(stream)
+    next(it)
+    assert b.is_open()  # probe in flight
+    if how == "generator_closed":
+        it.close()  # e.g. the SSE client went away
+    else:
+        stream.close()  # e.g. the router cancelled a losing hedge
+    assert b.state == b.HALF_OPEN and not b.is_open()
+    assert guarded(b, lambda **p: "ok")() == "ok"
+    assert b.state == b.CLOSED
+
+def test_abandoned_stream_outcome_reported_once(b):
+    stream = guarded(b, lambda **p: FakeStream(n=100))(stream=True)
+    it = iter(stream)
+    next(it)
+    stream.close()
+    it.close()
+    assert b.snapshot()["calls"] == 0  # no verdict recorded for a closed stream
+
+def test_retryable_failure_is_retried_within_budget(b):
+    calls = []
+
+    def flaky(**p):
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError()
+        return "ok"
+
+    assert GuardedCreate(flaky, b, RetryBudget(ratio=0, burst=1), backoff=0)() == "ok"
+    assert len(calls) == 2 and b.snapshot()["failures"] == 1
+
+def test_guarded_create_raises_circuit_open_without_calling(b):
+    trip(b)
+    calls = []
+    with pytest.raises(CircuitOpen):
+        guarded(b, lambda **p: calls.append(1))()
+    assert calls == []
+
+def test_retry_budget_caps_retries():
+    budget = RetryBudget(ratio=0.5, burst=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.snapshot()["denied"] == 1
+
+def test_concurrent_probes_limited_to_probe_count(b, clock):
+    trip(b)
+    clock.advance(15)
+    permits = []
+    threads = [threading.Thread(target=lambda: permits.append(b.allow())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(1 for p in permits if p is not None) == 1
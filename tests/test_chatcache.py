@@ -0,0 +1,82 @@
+import threading
+import time
+
+import chatcache
+from chatcache import ResponseCache
+
+def test_put_get_returns_copies():
+    cache = ResponseCache()
+    cache.put("k", "c1", {"reply": "hi", "lead": {}})
+    got = cache.get("k", "c1")
+    got["reply"] = "changed"
+    assert cache.get("k", "c1") == {"reply": "hi", "lead": {}}
+
+def test_entries_expire_after_ttl(monkeypatch, clock):
+    monkeypatch.setattr(chatcache.time, "monotonic", clock)
+    cache = ResponseCache(ttl=10)
+    cache.put("k", "c1", {"reply": "hi"})
+    clock.advance(9.9)
+    assert cache.get("k", "c1") is not None
+    clock.advance(0.2)
+    assert cache.get("k", "c1") is None
+    assert cache.stats()["entries"] == 0
+
+def test_lru_bound():
+    cache = ResponseCache(max_entries=2)
+    for k in ("a", "b", "c"):
+        cache.put(k, "c1", {"reply": k})
+    assert cache.get("a", "c1") is None
+    assert cache.get("c", "c1") == {"reply": "c"}
+
+def test_single_flight_coalesces_concurrent_misses():
+    cache = ResponseCache()
+    calls = []
+    gate = threading.Event()
+
+    def compute():
+        calls.append(1)
+        gate.wait(2)
+        return {"reply": "once"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", "c1", compute)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(2)
+
+    assert len(calls) == 1
+    statuses = sorted(status for _value, status in results)
+    assert statuses == ["coalesced"] * 4 + ["miss"]
+    assert all(value == {"reply": "once"} for value, _status in results)
+    assert cache.get_or_compute("k", "c1", compute)[1] == "hit"
+
+def test_errors_propagate_to_waiters_and_are_not_cached():
+    cache = ResponseCache()
+    gate = threading.Event()
+
+    def boom():
+        gate.wait(2)
+        raise RuntimeError("upstream")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("k", "c1", boom)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(2)
+
+    assert len(errors) == 3
+    assert cache.get_or_compute("k", "c1", lambda: {"reply": "ok"}) == ({"reply": "ok"}, "miss")
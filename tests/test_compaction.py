@@ -0,0 +1,79 @@
+from compaction import HistoryCompactor, estimate_tokens, extractive_summary, items_tokens, merge_facts
+from sessions import ChatSession
+
+def turns(n, words=40):
+    out = []
+    for i in range(n):
+        out.append({"role": "user", "content": f"frage {i} " + "wort " * words})
+        out.append({"role": "assistant", "content": f"antwort {i} " + "text " * words})
+    return out
+
+def session(history):
+    return ChatSession("s" * 20, "acme", list(history))
+
+class Summarizer:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, *args):
+        self.calls.append(args)
+
+def test_under_budget_nothing_is_folded():
+    s = session(turns(2))
+    c = HistoryCompactor(budget=10_000)
+    assert not c.compact(s, 100, "hallo")
+    assert len(s.history) == 4 and s.summary == "" and c.context_item(s) is None
+
+def test_over_budget_folds_pairs_down_to_low_water():
+    s = session(turns(10))
+    c = HistoryCompactor(budget=800, keep_items=4, low_water=0.75)
+    assert c.compact(s, 100, "neue frage")
+    fixed = 100 + estimate_tokens("neue frage") + 4
+    assert fixed + items_tokens(c.input_items(s)) <= 800  # summary included
+    assert len(s.history) % 2 == 0 and s.history[0]["role"] == "user"
+    assert s.history[-1]["content"].startswith("antwort 9")
+    assert s.summary.startswith("- Besucher: frage 0")
+    assert s.summary_gen == 1 and s.response_id is None
+
+def test_last_keep_items_are_never_folded():
+    s = session(turns(3, words=400))
+    c = HistoryCompactor(budget=100, keep_items=4)
+    assert c.compact(s, 50, "x")
+    assert [i["content"].split()[0:2] for i in s.history] == [
+        ["frage", "1"], ["antwort", "1"], ["frage", "2"], ["antwort", "2"]]
+    assert not c.compact(s, 50, "x")  # over budget, but nothing left to fold
+
+def test_context_item_carries_summary_and_facts():
+    s = session(turns(1))
+    s.summary = "- Besucher: brauche eine Website"
+    s.facts = merge_facts({}, {"service": " Website ", "budget": "", "timing": "Q3", "other": "x"})
+    assert s.facts == {"service": "Website", "timing": "Q3"}
+    ctx = HistoryCompactor(budget=1000).context_item(s)
+    assert ctx["role"] == "developer"
+    assert "Service: Website; Timing: Q3" in ctx["content"]
+    assert ctx["content"].endswith(s.summary)
+    assert HistoryCompactor(budget=1000).input_items(s)[0] is not s.history[0]
+
+def test_extractive_summary_keeps_head_and_tail_under_max_chars():
+    folded = [{"role": "user", "content": f"aussage {i} " + "x" * 50} for i in range(20)]
+    folded.insert(1, {"role": "assistant", "content": "nur eine rückfrage"})
+    out = extractive_summary("", folded, max_chars=400)
+    lines = out.splitlines()
+    assert len(out) <= 400
+    assert lines[0].startswith("- Besucher: aussage 0") and lines[1].startswith("- Besucher: aussage 1")
+    assert lines[-1].startswith("- Besucher: aussage 19")
+    assert "rückfrage" not in out
+
+def test_pending_folds_merge_until_submitted():
+    s = session(turns(10))
+    summarizer = Summarizer()
+    c = HistoryCompactor(budget=800, keep_items=4, summarizer=summarizer)
+    c.fold(s, s.history[:2])
+    c.fold(s, s.history[2:4])
+    gen, previous, folded = s.pending_fold
+    assert gen == 2 and previous == "" and len(folded) == 4
+    c.submit_pending(s)
+    assert s.pending_fold is None
+    assert summarizer.calls == [(s.id, "acme", 2, "", folded)]
+    c.submit_pending(s)
+    assert len(summarizer.calls) == 1
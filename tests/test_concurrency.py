@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from concurrency import ModelBusy, ModelGate
+
+def hold(gate):
+    """Takes a slot in a thread and keeps it until the returned event is set."""
+    got, release = threading.Event(), threading.Event()
+
+    def run():
+        with gate.slot():
+            got.set()
+            release.wait(5)
+
+    t = threading.Thread(target=run)
+    t.start()
+    got.wait(5)
+    return release, t
+
+def test_cap_rejects_when_full_and_no_queue():
+    gate = ModelGate(limit=2, queue_timeout=1.0)
+    held = [hold(gate) for _ in range(2)]
+    assert gate.snapshot()["in_flight"] == 2
+    with pytest.raises(ModelBusy):
+        gate.acquire()
+    assert gate.snapshot()["rejected"] == 1
+    for release, t in held:
+        release.set()
+        t.join()
+    assert gate.snapshot()["in_flight"] == 0
+    with gate.slot():
+        assert gate.snapshot()["in_flight"] == 1
+
+def test_queued_call_gets_the_freed_slot():
+    gate = ModelGate(limit=1, queue_timeout=5.0, max_waiting=1)
+    release, t = hold(gate)
+    acquired = threading.Event()
+
+    def waiter():
+        with gate.slot():
+            acquired.set()
+
+    w = threading.Thread(target=waiter)
+    w.start()
+    while gate.snapshot()["waiting"] == 0:
+        pass
+    assert not acquired.is_set()
+    release.set()
+    w.join(5)
+    t.join()
+    assert acquired.is_set()
+    assert gate.snapshot() == {"limit": 1, "max_waiting": 1, "in_flight": 0, "waiting": 0, "rejected": 0}
+
+def test_queue_limit_and_timeout():
+    gate = ModelGate(limit=1, queue_timeout=0.05, max_waiting=1)
+    release, t = hold(gate)
+    with pytest.raises(ModelBusy):
+        gate.acquire()  # waited queue_timeout, no slot
+    assert gate.snapshot()["waiting"] == 0
+
+    gate.queue_timeout = 5.0
+    got = threading.Event()
+    w = threading.Thread(target=lambda: (gate.acquire(), got.set(), gate.release()))
+    w.start()
+    while gate.snapshot()["waiting"] == 0:
+        pass
+    with pytest.raises(ModelBusy):
+        gate.acquire()  # the one queue place is taken: refused at once
+    release.set()
+    t.join()
+    w.join(5)
+    assert got.is_set()
+    assert gate.snapshot()["rejected"] == 2
+
+def test_low_priority_calls_never_queue():
+    gate = ModelGate(limit=1, queue_timeout=5.0, max_waiting=4)
+    release, t = hold(gate)
+    with pytest.raises(ModelBusy):
+        gate.acquire(priority=False)
+    snap = gate.snapshot()
+    assert snap["waiting"] == 0 and snap["rejected"] == 1
+    release.set()
+    t.join()
+    with gate.slot(priority=False):
+        pass
+
+def test_slot_is_released_on_error():
+    gate = ModelGate(limit=1, queue_timeout=0.0)
+    with pytest.raises(ValueError):
+        with gate.slot():
+            raise ValueError()
+    assert gate.snapshot()["in_flight"] == 0
+    gate.acquire()
+    gate.release()
@@ -0,0 +1,62 @@
+import sqlite3
+import time
+
+from db import connect, insert_lead
+from delivery import DeliveryWorker, SmtpSender
+
+class FakeWebhooks:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.posted = []
+
+    def post(self, url, payload):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("refused")
+        self.posted.append((url, payload))
+
+    def close(self):
+        pass
+
+def worker(db_path, webhooks, **kw):
+    smtp = SmtpSender("localhost", 25, "", "", "bot@example.com")
+    return DeliveryWorker(lambda: connect(db_path), smtp, webhooks, poll_interval=0.0, **kw)
+
+def queue_webhook(conn):
+    insert_lead(conn, "c1", "a@example.com", outbox=[("webhook", "https://hook.example", {"email": "a@example.com"},
+                                                       int(time.time()))])
+
+def test_delivers_and_marks_done(db_path, conn):
+    queue_webhook(conn)
+    hooks = FakeWebhooks()
+    w = worker(db_path, hooks)
+    assert w.run_once() == 1
+    assert hooks.posted == [("https://hook.example", {"email": "a@example.com"})]
+    assert w.run_once() == 0
+    assert w.sent == 1 and w.failed == 0
+
+def test_failed_send_is_rescheduled(db_path, conn):
+    queue_webhook(conn)
+    w = worker(db_path, FakeWebhooks(fail=1))
+    assert w.run_once() == 1
+    assert w.failed == 1
+    assert w.run_once() == 0  # backing off
+    row = conn.execute("SELECT attempts, last_error FROM outbox").fetchone()
+    assert row["attempts"] == 1 and "refused" in row["last_error"]
+
+def test_loop_survives_unexpected_errors(db_path, monkeypatch):
+    w = worker(db_path, FakeWebhooks())
+    errors = [sqlite3.DatabaseError("malformed"), ValueError("bug"), sqlite3.OperationalError("locked")]
+    calls = []
+
+    def run_once():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        w._stop.set()
+        return 0
+
+    monkeypatch.setattr(w, "run_once", run_once)
+    w.run()  # returns only once stopped
+    assert len(calls) == 4
+    assert w.errors == 2  # lock contention isn't counted
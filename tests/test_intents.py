@@ -0,0 +1,102 @@
+import base64
+
+import pytest
+
+from intents import MAX_WORDS, IntentMatcher, IntentStats
+
+CFG = {
+    "brand": {"name": "Acme"},
+    "links": {"demo": "https://cal.example/acme"},
+    "pricing": [
+        {"name": "Start", "price": "49€", "period": "/Monat", "items": ["1 Seite", "SEO"]},
+        {"name": "Pro", "price": "99€", "period": "/Monat"},
+    ],
+    "faq": [
+        {"id": "hosting", "keywords": ["hosting", "server standort"], "answer": "Wir hosten in Frankfurt."},
+        {"keywords": ["agb"], "answer": "Die AGB von {{BRAND_NAME}}: {{DEMO_LINK}}", "action": "collect_email"},
+        {"keywords": ["dsgvo"], "answer": "Ja.", "action": "delete_everything"},
+        {"keywords": ["ohne antwort"]},
+        "not a dict",
+    ],
+}
+
+@pytest.fixture
+def matcher():
+    return IntentMatcher(CFG)
+
+def test_pricing_reply_lists_the_plans(matcher):
+    name, out = matcher.match("Was kostet das?")
+    assert name == "pricing" and out["action"] == "none" and out["lead"] == {}
+    assert "- Start: 49€/Monat (1 Seite, SEO)" in out["reply"]
+    assert "- Pro: 99€/Monat" in out["reply"]
+    assert out["reply"].endswith("https://cal.example/acme")
+
+def test_demo_link(matcher):
+    name, out = matcher.match("Kann ich eine Demo buchen")
+    assert name == "demo" and out["action"] == "book_demo"
+    assert "https://cal.example/acme" in out["reply"]
+
+def test_faq_placeholders_and_actions(matcher):
+    assert matcher.match("wo ist euer server standort?")[0] == "faq:hosting"
+    name, out = matcher.match("AGB?")
+    assert name == "faq:1"
+    assert out["reply"] == "Die AGB von Acme: https://cal.example/acme"
+    assert out["action"] == "collect_email"
+    assert matcher.match("dsgvo")[1]["action"] == "none"  # unknown actions fall back
+    assert matcher.match("ohne antwort") is None
+
+def test_keywords_match_whole_words_only(matcher):
+    assert matcher.match("webhosting") is None
+    assert matcher.match("Hosting!")[0] == "faq:hosting"
+
+def test_two_intents_go_to_the_model(matcher):
+    assert matcher.match("Preise für hosting") is None
+
+@pytest.mark.parametrize("message", [
+    "was kostet das und wie lange dauert es",
+    "preise oder lieber eine demo",
+    "pricing vs demo",
+    "preise " + "bitte " * MAX_WORDS,
+    "",
+    "   ?!  ",
+])
+def test_long_or_combined_questions_are_not_answered(matcher, message):
+    assert matcher.match(message) is None
+
+def test_unrelated_message_misses(matcher):
+    assert matcher.match("Hallo, wer bist du?") is None
+
+def test_replies_are_copies(matcher):
+    _name, out = matcher.match("preise")
+    out["lead"]["email"] = "x@example.com"
+    assert matcher.match("preise")[1]["lead"] == {}
+
+def test_string_keywords_are_ignored():
+    m = IntentMatcher({"faq": [{"keywords": "preis", "answer": "x"}]})
+    assert m.intents == []
+    assert m.match("p") is None
+
+def test_empty_config_has_no_intents():
+    assert IntentMatcher({}).intents == []
+    assert IntentMatcher({}).match("preise") is None
+
+def test_stats():
+    s = IntentStats()
+    s.record("acme", "pricing")
+    s.record("acme", None)
+    s.record("other", "demo")
+    s.record("acme", "pricing")
+    out = s.stats()
+    assert out["hits"] == 3 and out["misses"] == 1 and out["hit_ratio"] == 0.75
+    assert out["by_client"]["acme"] == {"miss": 1, "pricing": 2}
+
+def test_update_client_rejects_string_keywords(client):
+    auth = {"Authorization": "Basic " + base64.b64encode(b"admin:change-me-now").decode()}
+    for faq in ([{"keywords": "preis", "answer": "x"}], [{"keywords": [], "answer": "x"}],
+                [{"keywords": ["ok", 3], "answer": "x"}]):
+        r = client.post("/admin/update-client", json={"client_id": "agentur_meyer", "faq": faq}, headers=auth)
+        assert r.status_code == 400, faq
+        assert "keywords" in r.get_json()["error"]
+    faq = [{"keywords": ["hosting"], "answer": "Frankfurt."}]
+    r = client.post("/admin/update-client", json={"client_id": "agentur_meyer", "faq": faq}, headers=auth)
+    assert r.status_code == 200
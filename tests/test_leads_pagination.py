@@ -0,0 +1,45 @@
+import pytest
+
+from db import _write_lead, iter_leads, leads_page
+
+@pytest.fixture
+def leads(conn):
+    # 7 leads over 3 timestamps, so pages have to split ties on ts by id
+    rows = [(100, "a@x.io"), (100, "b@x.io"), (100, "c@x.io"), (200, "d@x.io"),
+            (200, "e@x.io"), (300, "f@x.io"), (300, "g_1%@x.io")]
+    with conn:
+        for ts, email in rows:
+            _write_lead(conn, {"ts": ts, "client_id": "c1", "email": email})
+    return conn
+
+def walk(conn, limit, **filters):
+    pages, before = [], None
+    while True:
+        page = leads_page(conn, limit=limit, before=before, **filters)
+        if not page:
+            return pages
+        pages.append([r["id"] for r in page])
+        before = (page[-1]["ts"], page[-1]["id"])
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 8])
+def test_pages_cover_every_row_once_in_order(leads, limit):
+    pages = walk(leads, limit)
+    ids = [i for p in pages for i in p]
+    assert ids == [7, 6, 5, 4, 3, 2, 1]
+    assert all(len(p) <= limit for p in pages)
+
+def test_cursor_inside_a_tie_on_ts(leads):
+    page = leads_page(leads, limit=10, before=(100, 3))
+    assert [r["id"] for r in page] == [2, 1]
+
+def test_since_inclusive_until_exclusive(leads):
+    assert {r["ts"] for r in leads_page(leads, since=200, until=300)} == {200}
+    assert len(leads_page(leads, since=100, until=101)) == 3
+
+def test_like_wildcards_in_q_are_literal(leads):
+    assert [r["email"] for r in leads_page(leads, q="g_1%")] == ["g_1%@x.io"]
+    assert leads_page(leads, q="_") == leads_page(leads, q="g_")
+
+@pytest.mark.parametrize("page_size", [1, 3, 7])
+def test_iter_leads_with_exact_multiple_page_size(leads, page_size):
+    assert [r["id"] for r in iter_leads(leads, page_size=page_size)] == [7, 6, 5, 4, 3, 2, 1]
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+import pytest
+
+import metrics as metrics_mod
+from metrics import MetricsRegistry, clear_dir
+
+def parse(text):
+    """{sample line without value: value} from Prometheus text format."""
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.rpartition(" ")
+            out[key] = float(value)
+    return out
+
+def build(dir):
+    reg = MetricsRegistry(str(dir))
+    requests = reg.counter("t_requests_total", "Requests", ("route",))
+    latency = reg.histogram("t_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    return reg, requests, latency
+
+def test_counter_and_histogram_render():
+    reg = MetricsRegistry(None)
+    c = reg.counter("t_total", "Things", ("kind",))
+    h = reg.histogram("t_seconds", "Time", ("kind",), buckets=(0.1, 1.0))
+    c.inc("a")
+    c.inc("a", amount=2)
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, "a")
+    text = reg.render()
+    assert "# TYPE t_total counter" in text and "# TYPE t_seconds histogram" in text
+    s = parse(text)
+    assert s['t_total{kind="a"}'] == 3
+    assert s['t_seconds_bucket{kind="a",le="0.1"}'] == 2  # le is inclusive
+    assert s['t_seconds_bucket{kind="a",le="1"}'] == 3
+    assert s['t_seconds_bucket{kind="a",le="+Inf"}'] == 4
+    assert s['t_seconds_count{kind="a"}'] == 4
+    assert s['t_seconds_sum{kind="a"}'] == pytest.approx(3.65)
+
+def test_label_values_are_escaped():
+    reg = MetricsRegistry(None)
+    reg.counter("t_total", "x", ("v",)).inc('a"b\\c\nd')
+    assert 't_total{v="a\\"b\\\\c\\nd"} 1' in reg.render()
+
+def test_updates_from_many_threads_are_not_lost():
+    reg = MetricsRegistry(None)
+    c = reg.counter("t_total", "x")
+    threads = [threading.Thread(target=lambda: [c.inc() for _ in range(1000)]) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert parse(reg.render())["t_total"] == 20000
+
+def test_render_merges_worker_files(tmp_path, monkeypatch):
+    # "other worker": same metrics, flushed under another pid
+    other, requests, latency = build(tmp_path)
+    requests.inc("chat", amount=5)
+    latency.observe(0.5, "chat")
+    other.collector(lambda: [("t_in_flight", "gauge", "Running", {}, 7)])
+    monkeypatch.setattr(metrics_mod.os, "getpid", lambda: 4242)
+    other.flush()
+    monkeypatch.undo()
+    assert os.path.exists(tmp_path / "4242.json")
+
+    reg, requests, latency = build(tmp_path)
+    requests.inc("chat", amount=2)
+    requests.inc("lead")
+    latency.observe(0.05, "chat")
+    reg.collector(lambda: [("t_in_flight", "gauge", "Running", {}, 1)])
+
+    monkeypatch.setattr(metrics_mod, "_alive", lambda pid: True)
+    s = parse(reg.render())
+    assert s['t_requests_total{route="chat"}'] == 7
+    assert s['t_requests_total{route="lead"}'] == 1
+    assert s['t_seconds_count{route="chat"}'] == 2
+    assert s['t_seconds_bucket{route="chat",le="0.1"}'] == 1
+    assert s["t_in_flight"] == 8
+
+    # worker 4242 exited: its counters stay, its gauges go
+    monkeypatch.setattr(metrics_mod, "_alive", lambda pid: False)
+    s = parse(reg.render())
+    assert s['t_requests_total{route="chat"}'] == 7
+    assert s["t_in_flight"] == 1
+
+def test_own_file_is_not_counted_twice(tmp_path):
+    reg, requests, _latency = build(tmp_path)
+    requests.inc("chat")
+    reg.flush()
+    requests.inc("chat")
+    assert parse(reg.render())['t_requests_total{route="chat"}'] == 2
+
+def test_unreadable_files_and_broken_collectors_are_skipped(tmp_path):
+    (tmp_path / "99.json").write_text("{not json")
+    (tmp_path / "notes.json").write_text(json.dumps({"metrics": {}}))
+    reg, requests, _latency = build(tmp_path)
+    requests.inc("chat")
+    reg.collector(lambda: 1 / 0)
+    assert parse(reg.render())['t_requests_total{route="chat"}'] == 1
+
+def test_clear_dir(tmp_path):
+    (tmp_path / "1.json").write_text("{}")
+    (tmp_path / "2.json.tmp").write_text("{}")
+    (tmp_path / "keep.txt").write_text("")
+    clear_dir(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["keep.txt"]
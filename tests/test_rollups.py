@@ -0,0 +1,28 @@
+import db
+from db import funnel, insert_event, kpi, rebuild_rollups, stats
+
+NOW = 1_700_000_000  # 2023-11-14 22:13 UTC
+DAY = 86400
+
+def at(monkeypatch, ts):
+    monkeypatch.setattr(db.time, "time", lambda: ts)
+
+def test_window_is_days_calendar_days(conn, monkeypatch):
+    for back in range(9):  # one book_demo per day, today and the 8 days before
+        at(monkeypatch, NOW - back * DAY)
+        insert_event(conn, "c1", "book_demo")
+    at(monkeypatch, NOW)
+    assert funnel(conn, "c1", days=7)["book_demo"] == 7
+    assert funnel(conn, "c1", days=1)["book_demo"] == 1
+    daily = kpi(conn, days=7, client_id="c1")["book_demo_daily"]
+    assert [r["d"] for r in daily] == [db._day(NOW - back * DAY) for back in range(6, -1, -1)]
+
+def test_rollups_match_a_rebuild(conn, monkeypatch):
+    at(monkeypatch, NOW)
+    for event in ("book_demo", "book_demo", "collect_email"):
+        insert_event(conn, "c1", event)
+    insert_event(conn, "c2", "book_demo")
+    before = stats(conn)
+    assert rebuild_rollups(conn) > 0
+    assert stats(conn) == before
+    assert before["events"]["book_demo"] == 3
@@ -0,0 +1,158 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from breaker import CircuitBreaker, GuardedCreate, RetryBudget
+from routing import ModelRouter, RoutedResponse, parse_routes
+
+class FakeStream:
+    """A streamed response: first text delta after `ttft` s; close() ends it early."""
+
+    def __init__(self, model, ttft, fail=None):
+        self.model = model
+        self.ttft = ttft
+        self.fail = fail
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        resp = SimpleNamespace(id=f"resp-{self.model}", model=self.model, usage={"output_tokens": 2})
+        yield SimpleNamespace(type="response.created", response=resp)
+        if self.closed.wait(self.ttft):
+            return
+        if self.fail:
+            raise self.fail
+        for part in ("Hallo ", self.model):
+            if self.closed.is_set():
+                return
+            yield SimpleNamespace(type="response.output_text.delta", delta=part)
+        yield SimpleNamespace(type="response.completed", response=resp)
+
+    def close(self):
+        self.closed.set()
+
+class FakeUpstream:
+    """responses.create with per-model latency and failures."""
+
+    def __init__(self, ttft=None, fail_on_create=(), fail_in_stream=()):
+        self.ttft = ttft or {}
+        self.fail_on_create = set(fail_on_create)
+        self.fail_in_stream = set(fail_in_stream)
+        self.calls = []
+        self.streams = {}
+
+    def __call__(self, model, stream=False, **params):
+        self.calls.append((time.monotonic(), model))
+        if model in self.fail_on_create:
+            raise ConnectionError(model)
+        fail = RuntimeError(model) if model in self.fail_in_stream else None
+        s = self.streams[model] = FakeStream(model, self.ttft.get(model, 0.0), fail)
+        if stream:
+            return s
+        return SimpleNamespace(id=f"resp-{model}", model=model, output_text="".join(
+            ev.delta for ev in s if ev.type == "response.output_text.delta"), usage=None)
+
+def router(upstream, **kw):
+    kw.setdefault("max_delay", 0.05)
+    return ModelRouter(upstream, {}, "a", **kw)
+
+def text(events):
+    return "".join(ev.delta for ev in events if ev.type == "response.output_text.delta")
+
+def test_parse_routes_and_models_for():
+    routes = parse_routes("default=a, b;pro=c;broken=;=x")
+    assert routes == {"default": ["a", "b"], "pro": ["c"]}
+    r = ModelRouter(FakeUpstream(), routes, "z")
+    assert r.models_for({"models": ["m"]}) == ["m"]
+    assert r.models_for({"plan": "pro"}) == ["c"]
+    assert r.models_for({"plan": "unknown"}) == ["a", "b"]
+    assert ModelRouter(FakeUpstream(), {}, "z").models_for({}) == ["z"]
+
+def test_single_model_passes_through():
+    up = FakeUpstream()
+    r = router(up)
+    out = r.create(["a"], model="ignored", input="hi")
+    assert out.output_text == "Hallo a" and [m for _t, m in up.calls] == ["a"]
+    assert r.stats()["hedges"] == 0
+
+def test_fast_first_model_is_not_hedged():
+    up = FakeUpstream({"a": 0.0, "b": 0.0})
+    r = router(up, max_delay=1.0)
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo a"
+    assert [m for _t, m in up.calls] == ["a"]
+    assert r.hedges == 0 and r.stats()["models"]["a"]["wins"] == 1
+
+def test_hedge_fires_after_the_delay_and_the_loser_is_cancelled():
+    up = FakeUpstream({"a": 5.0, "b": 0.0})
+    r = router(up, max_delay=0.05)
+    t0 = time.monotonic()
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo b"
+    assert time.monotonic() - t0 < 2.0
+    (ta, _), (tb, _) = up.calls
+    assert tb - ta >= 0.05
+    assert up.streams["a"].closed.is_set()
+    stats = r.stats()
+    assert stats["hedges"] == 1
+    assert stats["models"]["a"]["cancelled"] == 1 and stats["models"]["b"]["wins"] == 1
+
+def test_hedge_delay_follows_observed_ttft():
+    r = router(FakeUpstream(), min_delay=0.1, max_delay=2.0, min_samples=5, quantile=0.5)
+    assert r.hedge_delay("a") == 2.0  # not enough samples yet
+    for v in (0.3, 0.4, 0.5, 0.6, 0.7):
+        r._record_ttft("a", v)
+    assert r.hedge_delay("a") == 0.5
+    for _ in range(10):
+        r._record_ttft("a", 0.01)
+    assert r.hedge_delay("a") == 0.1
+    for _ in range(50):
+        r._record_ttft("a", 9.0)
+    assert r.hedge_delay("a") == 2.0
+
+def test_hedges_are_capped_by_the_token_budget():
+    up = FakeUpstream({"a": 0.2, "b": 0.0})
+    r = router(up, max_delay=0.02, max_hedge_ratio=0.0)
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo b"  # the initial token
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo a"  # none left: waits for a
+    assert r.hedges == 1
+    assert [m for _t, m in up.calls] == ["a", "b", "a"]
+
+def test_error_before_first_token_fails_over_at_once():
+    up = FakeUpstream({"b": 0.0}, fail_on_create={"a"})
+    r = router(up, max_delay=5.0)
+    t0 = time.monotonic()
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo b"
+    assert time.monotonic() - t0 < 1.0  # didn't wait for the hedge delay
+    assert r.failovers == 1 and r.hedges == 0
+    assert r.stats()["models"]["a"]["errors"] == 1
+
+def test_stream_error_before_first_token_fails_over():
+    up = FakeUpstream({"a": 0.0, "b": 0.0}, fail_in_stream={"a"})
+    r = router(up, max_delay=5.0)
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo b"
+    assert r.failovers == 1
+
+def test_all_models_failing_raises():
+    up = FakeUpstream(fail_on_create={"a", "b"})
+    r = router(up)
+    with pytest.raises(ConnectionError):
+        r.create(["a", "b"], stream=True)
+    assert r.stats()["models"]["a"]["errors"] == 1 and r.stats()["models"]["b"]["errors"] == 1
+
+def test_non_streaming_call_is_collected():
+    up = FakeUpstream({"a": 5.0, "b": 0.0})
+    out = router(up).create(["a", "b"], input="hi")
+    assert isinstance(out, RoutedResponse)
+    assert (out.id, out.model, out.output_text, out.usage) == ("resp-b", "b", "Hallo b", {"output_tokens": 2})
+
+def test_cancelled_loser_releases_its_breaker_permit():
+    b = CircuitBreaker(min_calls=1, open_for=0.0, probes=2)
+    b.record(True, 0.1)
+    assert b.snapshot()["state"] == "open"
+    up = FakeUpstream({"a": 5.0, "b": 0.0})
+    r = router(GuardedCreate(up, b, RetryBudget()))
+    assert text(r.create(["a", "b"], stream=True)) == "Hallo b"
+    assert up.streams["a"].closed.is_set()
+    snap = b.snapshot()
+    assert snap["probing"] == 0  # both probe slots are free again
+    assert snap["state"] == "half_open"  # the cancelled probe gave no verdict
@@ -0,0 +1,17 @@
+import sessions
+from sessions import SessionStore
+
+def test_expired_session_is_gone(conn, monkeypatch):
+    store = SessionStore(ttl=60)
+    s = store.new("acme", [{"role": "user", "content": "hi"}])
+    store.record_turn(conn, s, "frage", "antwort")
+    assert store.load(conn, s.id, "acme").history[-1]["content"] == "antwort"
+    assert store.load(conn, s.id, "other") is None
+    now = sessions.time.time()
+    monkeypatch.setattr(sessions.time, "time", lambda: now + 61)
+    assert store.load(conn, s.id, "acme") is None
+
+def test_unknown_session_without_history_asks_the_client_to_resend(client):
+    r = client.post("/chat", json={"message": "hallo", "client": "default", "session": "x" * 24})
+    assert r.status_code == 409
+    assert r.get_json()["error"] == "session_expired"
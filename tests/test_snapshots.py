@@ -0,0 +1,77 @@
+from snapshots import ConfigSnapshot, SnapshotRegistry
+
+def snap(client_id, public):
+    return ConfigSnapshot(client_id, {}, public, "frame-ancestors 'self'")
+
+def test_etag_is_a_content_hash():
+    a = snap("a", {"x": 1, "y": "ü"})
+    assert a.etag == snap("b", {"y": "ü", "x": 1}).etag
+    assert a.etag != snap("a", {"x": 2, "y": "ü"}).etag
+    assert a.body == '{"x":1,"y":"ü"}'.encode("utf-8")
+
+def test_inline_json_cannot_close_the_script_tag():
+    s = snap("a", {"html": "</script><!--"})
+    assert "<" not in s.inline_json
+    assert s.inline_json.encode("utf-8") != s.body
+
+class Tenants:
+    def __init__(self):
+        self.versions = {"default": 1, "acme": 1}
+        self.compiled = []
+
+    def stamp(self, client_id):
+        return (self.versions["default"], self.versions.get(client_id, 0))
+
+    def compile(self, client_id):
+        self.compiled.append(client_id)
+        return snap(client_id, {"v": self.stamp(client_id)})
+
+def test_snapshot_is_reused_until_its_stamp_changes():
+    t = Tenants()
+    reg = SnapshotRegistry(t.stamp, t.compile)
+    first = reg.get("acme")
+    assert reg.get("acme") is first
+    t.versions["acme"] = 2
+    second = reg.get("acme")
+    assert second is not first and second.etag != first.etag
+    t.versions["default"] = 2  # a default change reaches every tenant
+    assert reg.get("acme") is not second
+    assert t.compiled == ["acme", "acme", "acme"]
+
+def test_unknown_tenants_are_not_kept():
+    t = Tenants()
+    reg = SnapshotRegistry(t.stamp, t.compile)
+    reg.get("nobody")
+    reg.get("nobody")
+    assert t.compiled == ["nobody", "nobody"]
+    reg.get("default")
+    reg.get("default")
+    assert t.compiled.count("default") == 1
+
+def test_clear_forces_a_rebuild():
+    t = Tenants()
+    reg = SnapshotRegistry(t.stamp, t.compile)
+    first = reg.get("acme")
+    reg.clear()
+    assert reg.get("acme") is not first
+
+def test_config_etag_and_304(client):
+    r = client.get("/config?client=default")
+    assert r.status_code == 200 and r.headers["ETag"]
+    etag = r.headers["ETag"]
+    r2 = client.get("/config?client=default", headers={"If-None-Match": etag})
+    assert r2.status_code == 304 and r2.data == b""
+    assert r2.headers["ETag"] == etag
+    r3 = client.get("/config?client=default", headers={"If-None-Match": '"something-else"'})
+    assert r3.status_code == 200 and r3.data == r.data
+
+def test_host_allowed_matches_domains_and_subdomains():
+    s = ConfigSnapshot("a", {}, {}, "", embed_hosts=frozenset({"example.com", "shop.acme.de"}))
+    assert s.host_allowed("example.com")
+    assert s.host_allowed("www.example.com")
+    assert s.host_allowed("a.b.shop.acme.de")
+    assert not s.host_allowed("acme.de")
+    assert not s.host_allowed("badexample.com")
+    assert not s.host_allowed("example.com.evil.io")
+    assert not s.host_allowed("")
+    assert snap("a", {}).host_allowed("anything.io")  # no list: unrestricted
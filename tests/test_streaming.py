@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from streaming import ReplyExtractor, sse
+
+def feed_all(chunks):
+    x = ReplyExtractor()
+    out = "".join(x.feed(c) for c in chunks)
+    return x, out
+
+def test_extracts_only_the_reply():
+    doc = '{"action": "none", "reply": "Hallo Welt", "lead": {"reply": "nope"}}'
+    x, out = feed_all([doc])
+    assert out == "Hallo Welt"
+    assert x.done
+    assert x.text() == doc
+
+def test_other_keys_and_nested_values_are_ignored():
+    doc = '{"lead": {"reply": "x", "list": ["reply", "y"]}, "note": "reply", "reply": "ok"}'
+    assert feed_all([doc])[1] == "ok"
+
+def test_escapes_are_decoded():
+    reply = 'Zeile 1\nZeile 2\t"zitiert" \\ a/b é'
+    doc = json.dumps({"reply": reply})
+    assert feed_all([doc])[1] == reply
+
+def test_surrogate_pair_split_across_chunks():
+    doc = json.dumps({"reply": "ok \U0001F680!"})  # ensure_ascii: 🚀
+    assert "\\ud83d\\ude80" in doc
+    cut = doc.index("\\ude80") - 3
+    x, out = feed_all([doc[:cut], doc[cut:]])
+    assert out == "ok \U0001F680!"
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_any_chunk_boundary_gives_the_same_text(size):
+    reply = 'Grüße — "Preis": 49€\nmehr \\ dazu \U0001F600'
+    doc = json.dumps({"action": "book_demo", "reply": reply, "lead": {}}, ensure_ascii=True)
+    chunks = [doc[i:i + size] for i in range(0, len(doc), size)]
+    x, out = feed_all(chunks)
+    assert out == reply
+    assert x.text() == doc
+
+def test_code_fence_and_whitespace_around_the_object():
+    doc = '```json\n{\n  "reply" : "hi"\n}\n```'
+    assert feed_all([doc])[1] == "hi"
+
+def test_reply_is_captured_only_once():
+    x, out = feed_all(['{"reply": "a", "reply": "b"}'])
+    assert out == "a"
+
+def test_bad_unicode_escape_becomes_replacement_char():
+    assert feed_all(['{"reply": "x\\uZZZZy"}'])[1] == "x�y"
+
+def test_sse_frame():
+    assert sse("delta", {"text": "ä"}) == 'event: delta\ndata: {"text": "ä"}\n\n'
@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+import tracing
+from tracing import Trace, TraceLog, begin_trace, current_trace, end_trace, read_traces, span, summarize
+
+def slow_trace(ms=5000.0):
+    t = Trace()
+    t.t0 -= ms / 1000
+    t.spans.append(("upstream", 0.001, ms / 1000 - 0.002))
+    return t
+
+@pytest.fixture
+def clock(monkeypatch, clock):
+    monkeypatch.setattr(tracing.time, "monotonic", clock)
+    return clock
+
+def log(tmp_path, **kw):
+    kw.setdefault("sample", 0.0)
+    kw.setdefault("max_per_sec", 1000.0)
+    return TraceLog(str(tmp_path / "traces.jsonl"), slow_ms=1000.0, **kw)
+
+def test_span_is_a_noop_outside_a_trace():
+    end_trace()
+    with span("db"):
+        pass
+    assert current_trace() is None
+
+def test_spans_and_server_timing():
+    t = begin_trace()
+    try:
+        with span("db"):
+            pass
+        with span("upstream"):
+            pass
+        with span("db"):
+            pass
+    finally:
+        end_trace()
+    assert [name for name, _s, _d in t.spans] == ["db", "upstream", "db"]
+    assert list(t.totals()) == ["db", "upstream"]
+    parts = t.server_timing().split(", ")
+    assert [p.split(";")[0] for p in parts] == ["db", "upstream", "total"]
+    assert all(p.split(";")[1].startswith("dur=") for p in parts)
+
+def test_only_slow_or_sampled_traces_are_written(tmp_path, monkeypatch):
+    tl = log(tmp_path)
+    assert not tl.offer(Trace())
+    assert tl.offer(slow_trace(), route="/chat")
+    tl.sample = 0.5
+    monkeypatch.setattr(tracing.random, "random", lambda: 0.1)
+    assert tl.offer(Trace())
+    monkeypatch.setattr(tracing.random, "random", lambda: 0.9)
+    assert not tl.offer(Trace())
+    recs = list(read_traces(tl.files()))
+    assert [r["reason"] for r in recs] == ["slow", "sampled"]
+    assert recs[0]["route"] == "/chat" and recs[0]["spans"][0][0] == "upstream"
+    assert tl.stats()["written"] == 2 and tl.stats()["dropped"] == 0
+
+def test_rate_limit_drops_bursts(tmp_path, clock):
+    tl = log(tmp_path, max_per_sec=2.0)
+    results = [tl.offer(slow_trace()) for _ in range(4)]
+    assert results == [True, True, False, False]
+    clock.advance(0.5)
+    assert tl.offer(slow_trace())
+    assert not tl.offer(slow_trace())
+    assert tl.stats()["written"] == 3 and tl.stats()["dropped"] == 3
+
+def test_rotation_keeps_at_most_backups(tmp_path):
+    tl = log(tmp_path, max_bytes=300, backups=2)
+    for i in range(20):
+        assert tl.offer(slow_trace(), i=i)
+    path = tl.path
+    assert os.path.exists(path + ".1") and os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+    assert tl.files()[:2] == [path + ".2", path + ".1"]
+    # oldest first, and nothing but whole lines in any file
+    ids = [r["i"] for r in read_traces(tl.files())]
+    assert ids == sorted(ids) and ids[-1] == 19
+    for name in tl.files():
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                json.loads(line)
+
+def test_worker_reopens_after_another_rotates(tmp_path):
+    a = log(tmp_path, max_bytes=300, backups=3)
+    b = log(tmp_path, max_bytes=300, backups=3)
+    b.offer(slow_trace(), w="b", i=0)  # b holds the file open
+    i = 0
+    while not os.path.exists(a.path + ".1"):
+        i += 1
+        a.offer(slow_trace(), w="a", i=i)
+    b.offer(slow_trace(), w="b", i=1)
+    with open(a.path, encoding="utf-8") as f:
+        last = [json.loads(line) for line in f]
+    assert last and last[-1]["w"] == "b" and last[-1]["i"] == 1
+    with open(a.path + ".1", encoding="utf-8") as f:
+        assert json.loads(f.readline())["w"] == "b"
+
+def test_summarize_sums_repeated_spans_and_shares():
+    recs = [
+        {"total_ms": 100.0, "spans": [["db", 0, 10.0], ["upstream", 10, 80.0], ["db", 90, 10.0]]},
+        {"total_ms": 300.0, "spans": [["db", 0, 20.0], ["upstream", 20, 270.0]]},
+    ]
+    s = summarize(recs)
+    assert s["total"]["n"] == 2 and s["total"]["max"] == 300.0
+    assert s["db"]["n"] == 2
+    assert s["db"]["p50"] == 20.0  # 10+10 and 20
+    assert s["upstream"]["share"] == pytest.approx(350 / 400)
+    assert s["total"]["share"] == 1.0
+    assert summarize([]) == {"total": {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "share": 0.0}}
+
+def test_read_traces_skips_torn_lines(tmp_path):
+    p = tmp_path / "t.jsonl"
+    p.write_text('{"total_ms": 1}\n{"total_ms": 2, "spa\n')
+    assert list(read_traces([str(p)])) == [{"total_ms": 1}]
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+import time
+
+import db
+from db import WriteBehind, connect
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+def lead(email="a@example.com", **extra):
+    return {"ts": int(time.time()), "client_id": "c1", "email": email, **extra}
+
+def test_batches_events_and_leads(db_path, conn):
+    wb = WriteBehind(lambda: connect(db_path), flush_interval=0.01)
+    for _ in range(20):
+        wb.add_event("c1", "book_demo")
+    wb.add_lead(lead())
+    wb.stop()
+    assert count(conn, "events") == 20
+    assert count(conn, "leads") == 1
+    snap = wb.snapshot()
+    assert snap["rows"] == 21 and snap["errors"] == 0 and snap["lost"] == 0
+
+def test_full_queue_falls_back_to_a_sync_write(db_path, conn):
+    wb = WriteBehind(lambda: connect(db_path), max_queue=1, put_timeout=0.0)
+    wb._ensure_started = lambda: None  # no flusher: the queue stays full
+    wb.add_event("c1", "a")
+    wb.add_event("c1", "b")
+    assert wb.snapshot()["overflow"] == 1
+    assert count(conn, "events") == 1
+    wb.flush()
+    assert count(conn, "events") == 2
+
+def test_locked_database_is_retried(db_path, conn):
+    wb = WriteBehind(lambda: connect(db_path))
+    real = wb._connect
+    attempts = []
+
+    class Flaky:
+        def __init__(self):
+            self.conn = real()
+
+        def __enter__(self):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return self.conn.__enter__()
+
+        def __exit__(self, *exc):
+            return self.conn.__exit__(*exc)
+
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+    wb._connect = Flaky
+    wb._write([("event", (int(time.time()), "c1", "a"))])
+    assert len(attempts) == 2
+    assert count(conn, "events") == 1 and wb.snapshot()["errors"] == 0
+
+def test_bad_row_does_not_sink_the_batch(db_path, conn):
+    wb = WriteBehind(lambda: connect(db_path))
+    wb._write([("event", (int(time.time()), "c1", "ok")),
+               ("event", (int(time.time()), "c1", None)),  # NOT NULL violation
+               ("lead", lead())])
+    assert count(conn, "events") == 1
+    assert count(conn, "leads") == 1
+    snap = wb.snapshot()
+    assert snap["errors"] == 1 and snap["lost"] == 1 and snap["held_leads"] == 0
+
+def test_failed_leads_are_held_retried_and_spilled(db_path, conn, tmp_path, monkeypatch):
+    spill = str(tmp_path / "pending.jsonl")
+    wb = WriteBehind(lambda: connect(db_path), spill_path=spill)
+    real = db._write_lead
+    monkeypatch.setattr(db, "_write_lead", lambda c, l: (_ for _ in ()).throw(RuntimeError("disk")))
+    wb._write([("lead", lead())])
+    assert wb.snapshot()["held_leads"] == 1
+    assert count(conn, "leads") == 0
+
+    wb.stop()  # still failing: goes to the spill file
+    assert [json.loads(l)["email"] for l in open(spill)] == ["a@example.com"]
+
+    monkeypatch.setattr(db, "_write_lead", real)
+    wb2 = WriteBehind(lambda: connect(db_path), spill_path=spill)
+    assert wb2.snapshot()["held_leads"] == 1
+    wb2.add_event("c1", "book_demo")  # next batch retries the held lead first
+    wb2.stop()
+    assert count(conn, "leads") == 1
+    assert wb2.snapshot()["held_leads"] == 0
+
+def test_flusher_survives_unexpected_errors(db_path, conn, monkeypatch):
+    wb = WriteBehind(lambda: connect(db_path), flush_interval=0.2)  # one batch for both rows
+    real = wb._write
+    calls = []
+
+    def flaky(items, retries=8):
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("bug")
+        real(items, retries)
+
+    monkeypatch.setattr(wb, "_write", flaky)
+    wb.add_lead(lead())
+    wb.add_event("c1", "a")
+    deadline = time.monotonic() + 2
+    while not wb.snapshot()["errors"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert wb._thread.is_alive()
+    snap = wb.snapshot()
+    assert snap["errors"] == 1 and snap["held_leads"] == 1 and snap["lost"] == 1
+    assert count(conn, "leads") == 0
+
+    wb.add_event("c1", "b")  # the next batch writes the held lead first
+    wb.stop()
+    assert count(conn, "leads") == 1
+    assert count(conn, "events") == 1
+    assert wb.snapshot()["held_leads"] == 0
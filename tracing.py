@@ -0,0 +1,213 @@
+from __future__ import annotations
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from modelstats import _pct
+
+try:
+    import fcntl  # macOS/Linux
+except Exception:
+    fcntl = None
+
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+class Trace:
+    """Spans of one request: (name, start, duration) in seconds, relative to t0."""
+
+    __slots__ = ("t0", "spans")
+
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def totals(self) -> Dict[str, float]:
+        """Seconds per phase name, repeated spans summed, in first-seen order."""
+        out: Dict[str, float] = {}
+        for name, _start, dur in self.spans:
+            out[name] = out.get(name, 0.0) + dur
+        return out
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={dur * 1000:.1f}" for name, dur in self.totals().items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+def begin_trace() -> Trace:
+    t = Trace()
+    _current.set(t)
+    return t
+
+def current_trace() -> Trace | None:
+    return _current.get()
+
+def end_trace() -> None:
+    _current.set(None)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the block into the current request's trace; a no-op outside requests (background threads)."""
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.spans.append((name, start - t.t0, time.perf_counter() - start))
+
+class TraceLog:
+    """
+    Full traces as JSON lines: every request slower than slow_ms, plus a
+    random `sample` share of the rest, at most about max_per_sec per
+    process (token bucket) so a slow upstream can't flood the disk.
+
+    The file is rotated at max_bytes to path.1 … path.<backups>. Workers
+    share it: appends are single writes, rotation happens under flock and
+    the other workers reopen when they notice the file was moved.
+    """
+
+    def __init__(self, path: str, slow_ms: float = 2000.0, sample: float = 0.01, max_per_sec: float = 5.0,
+                 max_bytes: int = 10 * 1024 * 1024, backups: int = 3) -> None:
+        self.path = path
+        self.slow_ms = slow_ms
+        self.sample = sample
+        self.max_per_sec = max_per_sec
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self._lock = threading.Lock()
+        self._f: Any = None
+        self._tokens = max(1.0, max_per_sec)
+        self._ts = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+
+    def _take_token_locked(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.max_per_sec), self._tokens + (now - self._ts) * self.max_per_sec)
+        self._ts = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def offer(self, trace: Trace, **fields: Any) -> bool:
+        """Writes the trace if it is slow or sampled and the rate allows; True if written."""
+        total_ms = trace.elapsed() * 1000
+        if total_ms >= self.slow_ms:
+            reason = "slow"
+        elif self.sample > 0 and random.random() < self.sample:
+            reason = "sampled"
+        else:
+            return False
+        record = {
+            "ts": round(time.time(), 3),
+            **fields,
+            "reason": reason,
+            "total_ms": round(total_ms, 2),
+            "spans": [[name, round(start * 1000, 2), round(dur * 1000, 2)] for name, start, dur in trace.spans],
+        }
+        line = (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if not self._take_token_locked():
+                self.dropped += 1
+                return False
+            try:
+                self._write_locked(line)
+            except OSError:
+                self.dropped += 1
+                return False
+            self.written += 1
+        return True
+
+    def _open_locked(self) -> Any:
+        if self._f is not None:
+            try:
+                moved = os.stat(self.path).st_ino != os.fstat(self._f.fileno()).st_ino
+            except FileNotFoundError:
+                moved = True
+            if moved:  # another worker rotated it
+                self._f.close()
+                self._f = None
+        if self._f is None:
+            self._f = open(self.path, "ab", buffering=0)
+        return self._f
+
+    def _write_locked(self, line: bytes) -> None:
+        f = self._open_locked()
+        f.write(line)
+        if os.fstat(f.fileno()).st_size < self.max_bytes:
+            return
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)  # without it (Windows) rotation is per-process best effort
+        try:
+            try:
+                if os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino:
+                    return  # rotated by someone else while we waited
+            except FileNotFoundError:
+                return
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+            self._f = None
+
+    def files(self) -> List[str]:
+        """The log and its rotated backups, oldest first."""
+        names = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        return [n for n in names if os.path.exists(n)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"path": self.path, "written": self.written, "dropped": self.dropped,
+                    "slow_ms": self.slow_ms, "sample": self.sample}
+
+def read_traces(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # torn line from a crash
+
+def summarize(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Per-phase percentiles in ms over the given traces: {phase: {n, p50, p95,
+    p99, max, share}}. Repeated spans of one request are summed first;
+    share is the phase's part of all request time.
+    """
+    phases: Dict[str, List[float]] = {"total": []}
+    for r in records:
+        phases["total"].append(float(r.get("total_ms", 0.0)))
+        per: Dict[str, float] = {}
+        for name, _start, dur in r.get("spans") or []:
+            per[name] = per.get(name, 0.0) + float(dur)
+        for name, dur in per.items():
+            phases.setdefault(name, []).append(dur)
+    grand = sum(phases["total"]) or 1.0
+    out: Dict[str, Dict[str, float]] = {}
+    for name, vals in phases.items():
+        vals.sort()
+        out[name] = {
+            "n": len(vals),
+            "p50": _pct(vals, 0.50),
+            "p95": _pct(vals, 0.95),
+            "p99": _pct(vals, 0.99),
+            "max": vals[-1] if vals else 0.0,
+            "share": sum(vals) / grand,
+        }
+    return out
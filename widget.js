@@ -13,7 +13,8 @@
   const width = Math.max(300, Math.min(520, parseInt(s.dataset.width || "380", 10) || 380));
   const height = Math.max(420, Math.min(760, parseInt(s.dataset.height || "560", 10) || 560));
 
-  const base = s.src.replace(/\/widget\.js(\?.*)?$/, "");
+  // set by the /widget.js bootstrap; otherwise derive from our own URL
+  const base = (s.dataset.base || s.src.replace(/\/(assets\/)?widget(\.[0-9a-f]+)?\.js(\?.*)?$/, "")).replace(/\/$/, "");
 
   // CSS (scoped-ish)
   const style = document.createElement("style");
@@ -91,24 +92,66 @@
   top.appendChild(x);
   wrap.appendChild(top);
 
-  // iframe
-  const iframe = document.createElement("iframe");
-  iframe.className = "npw-frame";
+  // iframe: created on first open by default, so visitors who never chat
+  // don't download embed.html, app.js, style.css and /config.
+  //   data-load="click" (default) | "idle" (hidden pre-render when idle) | "eager"
+  const load = (s.dataset.load || "click").trim();
   const qs = new URLSearchParams();
   qs.set("client", client);
   if (key) qs.set("k", key);
-  iframe.src = `${base}/embed?${qs.toString()}`;
-  wrap.appendChild(iframe);
+  let iframe = null;
+
+  function ensureFrame() {
+    if (iframe) return;
+    iframe = document.createElement("iframe");
+    iframe.className = "npw-frame";
+    iframe.src = `${base}/embed?${qs.toString()}`;
+    wrap.appendChild(iframe);
+  }
+
+  function addLink(rel, href) {
+    const l = document.createElement("link");
+    l.rel = rel;
+    l.href = href;
+    document.head.appendChild(l);
+  }
+
+  // warm-up: connection on idle, the embed's static assets on hover/focus
+  let connected = false, prefetched = false;
+  function preconnect() {
+    if (connected) return;
+    connected = true;
+    addLink("preconnect", base);
+  }
+  function prefetch() {
+    preconnect();
+    if (prefetched || iframe) return;
+    prefetched = true;
+    (s.dataset.warm || "").split(" ").filter(Boolean).forEach((p) => addLink("prefetch", `${base}/${p}`));
+  }
+
+  function onIdle(fn) {
+    if ("requestIdleCallback" in window) window.requestIdleCallback(fn, { timeout: 4000 });
+    else setTimeout(fn, 2000);
+  }
 
   function toggle(open) {
     const isOpen = wrap.style.display === "block";
     const next = typeof open === "boolean" ? open : !isOpen;
+    if (next) ensureFrame();
     wrap.style.display = next ? "block" : "none";
   }
 
   btn.addEventListener("click", () => toggle());
+  btn.addEventListener("pointerenter", prefetch);
+  btn.addEventListener("focus", prefetch);
+  btn.addEventListener("touchstart", prefetch, { passive: true });
   x.addEventListener("click", () => toggle(false));
 
   document.body.appendChild(btn);
   document.body.appendChild(wrap);
+
+  if (load === "eager") ensureFrame();
+  else if (load === "idle") onIdle(() => { prefetch(); ensureFrame(); });
+  else onIdle(preconnect);
 })();
\ No newline at end of file